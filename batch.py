@@ -0,0 +1,93 @@
+import glob
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils import create_batch_table
+import decomposition
+from decomposition import split_functions, run_decomposed
+from checkpoints import invoke_resumable
+from results_store import record_run
+
+
+def collect_input_files(target: str) -> list:
+    """Expand a directory (searched recursively) or glob pattern into Python files"""
+    if os.path.isdir(target):
+        pattern = os.path.join(target, "**", "*.py")
+    else:
+        pattern = target
+    return sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+
+
+def process_file(path: str, graph) -> dict:
+    """
+    Runs one file through the graph and returns a summary row. Files finished
+    in an earlier run are not processed again; interrupted ones are resumed.
+    """
+    start = time.perf_counter()
+    row = {"File": path}
+    try:
+        with open(path, 'r') as f:
+            user_input = f.read()
+        units = split_functions(user_input) if decomposition.decompose_functions else []
+        if units:
+            # Each function is translated and verified by its own pipeline
+            function_rows, whyml = run_decomposed(units, graph, label=path)
+            failed = [r for r in function_rows if not r["Verified"]]
+            runs = {r["Run"] for r in function_rows}
+            row["Run"] = "finished" if runs == {"finished"} else "new" if runs == {"new"} else "resumed"
+            row.update({
+                "Verified": not failed,
+                "Number of Tries": sum(r["Number of Tries"] for r in function_rows),
+                "Last Error": failed[-1]["Last Error"] if failed else "",
+                "Final WhyML": whyml,
+            })
+        else:
+            final_state, status = invoke_resumable(graph, user_input)
+            row["Run"] = status
+            if status != "finished":
+                record_run(final_state, path)
+            errors = final_state.get("errors", [])
+            row.update({
+                "Verified": final_state.get("execution_success", False),
+                "Number of Tries": len(final_state.get("whyml_attempts", [])),
+                "Last Error": errors[-1] if errors else "",
+                "Final WhyML": final_state.get("whyml_code", ""),
+            })
+    except Exception as e:
+        row.update({"Run": "new", "Verified": False, "Number of Tries": 0, "Last Error": f"Pipeline error: {e}", "Final WhyML": ""})
+    row["Seconds"] = round(time.perf_counter() - start, 2)
+    return row
+
+
+def run_batch(target: str, graph, max_workers: int = None):
+    """
+    Runs the graph over every Python file matched by target concurrently.
+    LLM calls and why3 processes are still bounded by the limits in
+    llm_client and why3_runner, so max_workers only bounds open pipelines.
+    """
+    files = collect_input_files(target)
+    if not files:
+        print(f"No Python files found for: {target}")
+        return []
+
+    max_workers = max_workers or len(files)
+    print(f"\nProcessing {len(files)} files with up to {max_workers} concurrent pipelines")
+    print("-" * 50)
+
+    start = time.perf_counter()
+    rows = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(process_file, path, graph): path for path in files}
+        for done, future in enumerate(as_completed(futures), start=1):
+            row = future.result()
+            rows.append(row)
+            status = "verified" if row["Verified"] else "not verified"
+            saved = ", saved result" if row["Run"] == "finished" else ", resumed" if row["Run"] == "resumed" else ""
+            print(f"[{done}/{len(files)}] {row['File']}: {status} "
+                  f"({row['Number of Tries']} tries, {row['Seconds']}s{saved})")
+
+    print(f"Batch finished in {time.perf_counter() - start:.1f}s")
+    rows.sort(key=lambda r: r["File"])
+    create_batch_table(rows)
+    return rows
@@ -0,0 +1,159 @@
+import argparse
+import glob
+import os
+import time
+from collections import defaultdict
+import pandas as pd
+from langchain_core.messages import HumanMessage
+
+from graph_builder import build_graph
+from cassette import Cassette, use_cassette
+from llm_client import llm_usage, reset_llm_usage, set_llm_cache_enabled
+from why3_runner import why3_usage, reset_why3_usage, set_proof_cache_enabled
+from example_index import set_examples, set_held_out_examples
+
+NODES = ["chatbot", "whyml_translator", "whyml_checker", "whyml_executor", "differential_tester",
+         "error_corrector", "gap_classifier"]
+
+
+def collect_cases(root: str) -> list:
+    """
+    Benchmark cases under root: one per directory holding a standard_*.py input
+    and its reference .mlw. Returns [(name, input_path, reference_path)].
+    """
+    cases = []
+    for directory in sorted(glob.glob(os.path.join(root, "*", ""))):
+        inputs = sorted(glob.glob(os.path.join(directory, "standard_*.py")))
+        if not inputs:
+            continue
+        references = sorted(glob.glob(os.path.join(directory, "*.mlw")))
+        cases.append((os.path.basename(os.path.normpath(directory)), inputs[0],
+                      references[0] if references else None))
+    return cases
+
+
+def run_case(graph, source: str) -> dict:
+    """Runs one input through the graph and returns its timing, token and outcome metrics"""
+    reset_llm_usage()
+    reset_why3_usage()
+    node_seconds = defaultdict(float)
+    started = {}
+    final_state = {}
+
+    start = time.perf_counter()
+    for mode, chunk in graph.stream({"messages": [HumanMessage(content=source)]}, stream_mode=["debug", "values"]):
+        if mode == "values":
+            final_state = chunk
+        elif chunk["type"] == "task":
+            started[chunk["payload"]["id"]] = time.perf_counter()
+        elif chunk["type"] == "task_result":
+            task = chunk["payload"]
+            node_seconds[task["name"]] += time.perf_counter() - started.pop(task["id"], start)
+    wall = time.perf_counter() - start
+
+    llm = llm_usage()
+    why3 = why3_usage()
+    return {
+        "Verified": final_state.get("execution_success", False),
+        "Retries": final_state.get("retry_count", 0),
+        "Attempts": len(final_state.get("whyml_attempts", [])),
+        "Wall s": round(wall, 2),
+        "LLM calls": llm.get("calls", 0) + llm.get("replayed", 0),
+        "Input tokens": llm.get("input_tokens", 0),
+        "Output tokens": llm.get("output_tokens", 0),
+        "LLM s": round(llm.get("seconds", 0.0), 2),
+        "LLM retries": llm.get("retries", 0),
+        "Type checks": why3.get("type_check_runs", 0),
+        "Type check s": round(why3.get("type_check_seconds", 0.0), 2),
+        "Proofs": why3.get("prove_runs", 0),
+        "Prover s": round(why3.get("prove_seconds", 0.0), 2),
+        **{f"{node} s": round(node_seconds.get(node, 0.0), 2) for node in NODES},
+    }
+
+
+def run_benchmark(root: str, mode: str = None, cassette_dir: str = "benchmark_cassettes", only: str = None) -> list:
+    """
+    Runs every case under root one after another. mode is None for live calls,
+    "record" to save each case's LLM and why3 interactions to a cassette, or
+    "replay" to run from the cassettes without network access or why3.
+    """
+    cases = [case for case in collect_cases(root) if not only or only in case[0]]
+    if not cases:
+        print(f"No benchmark cases found in: {root}")
+        return []
+
+    # Every interaction has to happen (or be replayed) for the numbers to mean anything
+    set_llm_cache_enabled(False)
+    set_proof_cache_enabled(False)
+    # Examples come from the test_code seeds only, so prompts match between record and replay
+    set_examples(learn=False)
+    graph = build_graph()
+
+    print(f"\nBenchmarking {len(cases)} cases" + (f" ({mode} mode)" if mode else ""))
+    print("-" * 50)
+
+    rows = []
+    for i, (name, input_path, reference_path) in enumerate(cases, start=1):
+        with open(input_path, "r") as f:
+            source = f.read()
+        cassette = Cassette(os.path.join(cassette_dir, f"{name}.json"), mode) if mode else None
+        use_cassette(cassette)
+        # The case's own seed is its reference answer, so it must not appear in the prompts
+        set_held_out_examples([name])
+        try:
+            row = {"Case": name, **run_case(graph, source)}
+        except Exception as e:
+            row = {"Case": name, "Verified": False, "Error": str(e)}
+        finally:
+            use_cassette(None)
+            set_held_out_examples([])
+        if mode == "record":
+            cassette.save()
+        row["Reference"] = reference_path or ""
+        rows.append(row)
+        status = "verified" if row["Verified"] else "not verified"
+        print(f"[{i}/{len(cases)}] {name}: {status} ({row.get('Retries', 0)} retries, {row.get('Wall s', 0)}s)")
+
+    create_benchmark_table(rows)
+    return rows
+
+
+def create_benchmark_table(rows: list):
+    """Prints the per-case results with an aggregate row and saves them to CSV"""
+    df = pd.DataFrame(rows)
+    numeric = df.select_dtypes("number").columns
+    total = df[numeric].sum()
+    total["Case"] = "TOTAL"
+    total["Verified"] = f"{int(df['Verified'].sum())}/{len(df)}"
+    df = pd.concat([df, total.to_frame().T], ignore_index=True)
+    df.to_csv("benchmark_results.csv", index=False)
+
+    print("\n" + "=" * 120)
+    print("BENCHMARK RESULTS")
+    print("=" * 120)
+    pd.set_option('display.max_columns', None)
+    pd.set_option('display.width', None)
+    print(df.drop(columns=["Reference"]).to_string(index=False))
+    print("=" * 120)
+    print("Results saved to: benchmark_results.csv")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline over the test_code cases.")
+    parser.add_argument("cases", nargs="?", default="test_code",
+                        help="directory of cases, one sub-directory per case (default: test_code)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--record", action="store_true",
+                      help="save every LLM and why3 interaction of each case to a cassette")
+    mode.add_argument("--replay", action="store_true",
+                      help="replay the cassettes offline instead of calling the LLM and why3")
+    parser.add_argument("--cassettes", default="benchmark_cassettes",
+                        help="directory holding one cassette per case (default: benchmark_cassettes)")
+    parser.add_argument("--only", metavar="TEXT", help="only run cases whose name contains TEXT")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_benchmark(args.cases, mode="record" if args.record else "replay" if args.replay else None,
+                  cassette_dir=args.cassettes, only=args.only)
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def make_key(*parts) -> str:
+    """Builds a content-addressed cache key from JSON-serialisable parts"""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SQLiteCache:
+    """
+    Persistent key/value cache stored in a SQLite file. Values are JSON.
+    Entries older than max_age_days are dropped, and the least recently used
+    entries are dropped once the cache holds more than max_entries.
+    Safe to share between threads and between processes using the same file.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000, max_age_days: float = 30, enabled: bool = True):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._initialised = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialised:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialised:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS cache (
+                                key TEXT PRIMARY KEY,
+                                value TEXT NOT NULL,
+                                created REAL NOT NULL,
+                                last_used REAL NOT NULL)""")
+            conn.commit()
+            self._initialised = True
+        return conn
+
+    def get(self, key: str):
+        """Returns the cached value, or None on a miss or when the cache is disabled"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+                if row is None or now - row[1] > self.max_age_seconds:
+                    self.misses += 1
+                    return None
+                conn.execute("UPDATE cache SET last_used = ? WHERE key = ?", (now, key))
+                conn.commit()
+                self.hits += 1
+                return json.loads(row[0])
+            finally:
+                conn.close()
+
+    def put(self, key: str, value):
+        """Stores a value and evicts stale or excess entries"""
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("INSERT OR REPLACE INTO cache (key, value, created, last_used) VALUES (?, ?, ?, ?)",
+                             (key, json.dumps(value), now, now))
+                self._evict(conn, now)
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        conn.execute("DELETE FROM cache WHERE created < ?", (now - self.max_age_seconds,))
+        conn.execute("""DELETE FROM cache WHERE key IN (
+                            SELECT key FROM cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)""",
+                     (self.max_entries,))
+
+    def clear(self):
+        """Removes every entry from the cache"""
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM cache")
+                conn.commit()
+            finally:
+                conn.close()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
@@ -0,0 +1,67 @@
+import json
+import os
+import threading
+from collections import defaultdict
+
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode for an interaction that was never recorded"""
+
+
+class Cassette:
+    """
+    LLM and why3 interactions of one run, saved as JSON so the run can be
+    replayed offline and deterministically. Interactions are keyed by kind
+    ("llm", "prove", "type_check", "execute") and request key. A request
+    made several times replays its recorded responses in order.
+    """
+
+    def __init__(self, path: str, mode: str = "replay"):
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._interactions = defaultdict(list)
+        self._cursor = defaultdict(int)
+        if mode == "replay":
+            with open(path, "r") as f:
+                self._interactions.update(json.load(f))
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def play(self, kind: str, key: str) -> dict:
+        """Next recorded response for the request, repeating the last one if it is asked for more often"""
+        name = f"{kind}:{key}"
+        with self._lock:
+            responses = self._interactions.get(name)
+            if not responses:
+                raise CassetteMiss(f"No recorded {kind} interaction for this request in {self.path}")
+            index = min(self._cursor[name], len(responses) - 1)
+            self._cursor[name] += 1
+            return responses[index]
+
+    def record(self, kind: str, key: str, response: dict):
+        with self._lock:
+            self._interactions[f"{kind}:{key}"].append(response)
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock, open(self.path, "w") as f:
+            json.dump(self._interactions, f, indent=1, sort_keys=True)
+
+
+# Cassette used by invoke_llm, prove_whyml and type_check_whyml, if any
+_active = None
+
+
+def use_cassette(cassette):
+    """Record to or replay from the given cassette (None for live calls only)"""
+    global _active
+    _active = cassette
+
+
+def active_cassette():
+    return _active
@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import threading
+import weakref
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+import differential
+import example_index
+import graph_nodes
+import why3_runner
+from cache import make_key
+from config import (
+    CHECKPOINT_PATH,
+    LLM_MODEL,
+    LLM_TEMPERATURE,
+    LOCAL_TYPING,
+    TEMPLATE_TRANSLATION,
+    TEMPLATE_ADD_SPECS,
+    WHY3_PROVER,
+    WHY3_TIMEOUT,
+)
+
+# One lock per input being run, so concurrent runs of the same input do not share (or
+# delete) a checkpoint thread. A lock is dropped once no run holds it
+_run_locks = weakref.WeakValueDictionary()
+_run_locks_guard = threading.Lock()
+
+# When set, saved runs are discarded and every input is processed from scratch
+fresh_runs = False
+
+
+def set_fresh_runs(enabled: bool):
+    """Ignore (and delete) saved runs instead of resuming them"""
+    global fresh_runs
+    fresh_runs = enabled
+
+
+def open_checkpointer(path: str = CHECKPOINT_PATH) -> SqliteSaver:
+    """SQLite-backed LangGraph checkpointer, shared by every pipeline in this process"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return SqliteSaver(conn)
+
+
+def run_lock(source: str) -> threading.Lock:
+    """Lock held while the graph runs on source"""
+    key = make_key("run", source)
+    with _run_locks_guard:
+        lock = _run_locks.get(key)
+        if lock is None:
+            lock = _run_locks[key] = threading.Lock()
+        return lock
+
+
+def run_settings() -> dict:
+    """Settings that change what a run produces; runs saved under other settings are not reused"""
+    return {
+        "model": LLM_MODEL,
+        "temperature": LLM_TEMPERATURE,
+        "local_typing": LOCAL_TYPING,
+        "templates": TEMPLATE_TRANSLATION,
+        "template_specs": TEMPLATE_ADD_SPECS,
+        "prover": WHY3_PROVER,
+        "timeout": WHY3_TIMEOUT,
+        "portfolio": why3_runner.prover_portfolio,
+        "split_goals": why3_runner.split_goals,
+        "candidates": graph_nodes.candidate_count,
+        "candidate_corrections": graph_nodes.candidate_corrections,
+        "differential": differential.differential_testing,
+        "examples": example_index.examples_enabled,
+    }
+
+
+def run_config(graph, source: str):
+    """
+    Graph config whose thread_id is the hash of the input and the run settings,
+    or None without a checkpointer
+    """
+    if getattr(graph, "checkpointer", None) is None:
+        return None
+    return {"configurable": {"thread_id": make_key("run", source, run_settings())}}
+
+
+def run_status(graph, config) -> tuple:
+    """
+    Looks up the saved run for config. Returns (status, values) where status
+    is "new" (nothing saved), "resumed" (interrupted before the end) or
+    "finished" (verified), and values is the saved state. A run that ended
+    without being verified is discarded, so the input is tried again.
+    """
+    if config is None:
+        return "new", {}
+    thread_id = config["configurable"]["thread_id"]
+    if fresh_runs:
+        graph.checkpointer.delete_thread(thread_id)
+        return "new", {}
+    snapshot = graph.get_state(config)
+    if not snapshot.values:
+        return "new", {}
+    if snapshot.next:
+        return "resumed", dict(snapshot.values)
+    if not snapshot.values.get("execution_success", False):
+        graph.checkpointer.delete_thread(thread_id)
+        return "new", {}
+    return "finished", dict(snapshot.values)
+
+
+def invoke_resumable(graph, source: str, on_update=None) -> tuple:
+    """
+    Runs the graph on source, continuing from the last completed step of an
+    interrupted run and returning the saved result of a finished one without
+    doing any work. If given, on_update(node_name, node_output, state) is
+    called for every node update, with the state before it. Runs on the same
+    source take turns.
+    Returns (final_state, status) with status as in run_status.
+    """
+    with run_lock(source):
+        config = run_config(graph, source)
+        status, values = run_status(graph, config)
+        if status == "finished":
+            return values, status
+        graph_input = None if status == "resumed" else {"messages": [HumanMessage(content=source)]}
+        if on_update is None:
+            return graph.invoke(graph_input, config), status
+        for mode, chunk in graph.stream(graph_input, config, stream_mode=["updates", "values"]):
+            if mode == "values":
+                values = chunk
+            else:
+                for node_name, node_output in chunk.items():
+                    on_update(node_name, node_output, values)
+        return values, status
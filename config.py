@@ -1,18 +1,172 @@
 import os
+import threading
 from dotenv import load_dotenv
-from langchain_anthropic import ChatAnthropic
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize the language model
-llm = ChatAnthropic(model='claude-sonnet-4-20250514', temperature=0.1)
+# Language model settings
+LLM_MODEL = 'claude-sonnet-4-20250514'
+LLM_TEMPERATURE = 0.1
+
+_llm = None
+_llm_lock = threading.Lock()
+
+
+def get_llm():
+    """
+    The shared language model. It is created on first use, so runs answered
+    from checkpoints, caches or cassettes never import langchain_anthropic.
+    """
+    global _llm
+    with _llm_lock:
+        if _llm is None:
+            from langchain_anthropic import ChatAnthropic
+            _llm = ChatAnthropic(model=LLM_MODEL, temperature=LLM_TEMPERATURE)
+        return _llm
+
+
+# Concurrency limits shared by every pipeline running in this process
+MAX_CONCURRENT_LLM_CALLS = 4
+
+# Provider rate limits per minute for the LLM scheduler (0 = unlimited). Set them to the
+# account's quota so requests wait in priority order instead of being rejected
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("TRUSTEDCODE_LLM_RPM", "0"))
+LLM_INPUT_TOKENS_PER_MINUTE = int(os.getenv("TRUSTEDCODE_LLM_INPUT_TPM", "0"))
+LLM_OUTPUT_TOKENS_PER_MINUTE = int(os.getenv("TRUSTEDCODE_LLM_OUTPUT_TPM", "0"))
+# Output tokens reserved for a request before its real usage is known
+LLM_OUTPUT_TOKENS_ESTIMATE = 1024
+# Retries after rate limits, overload and server errors, with full-jitter exponential backoff
+LLM_MAX_RETRIES = 6
+LLM_BACKOFF_BASE = 1.0  # seconds
+LLM_BACKOFF_MAX = 60.0  # seconds
+
+# Best-of-N mode: candidate translations requested at once at temperatures spread
+# over the range, all checked and proved in parallel; the first verified candidate wins
+CANDIDATE_COUNT = int(os.getenv("TRUSTEDCODE_CANDIDATES", "1"))
+CANDIDATE_TEMPERATURE_RANGE = (0.1, 1.0)
+# Whether error_corrector also returns several candidates
+CANDIDATE_CORRECTIONS = os.getenv("TRUSTEDCODE_CANDIDATE_CORRECTIONS", "0") == "1"
+
+# Differential testing: proved WhyML is run with `why3 execute` on generated inputs and its
+# results compared with the original Python function's; a mismatch goes back to error_corrector
+DIFFERENTIAL_TESTING = os.getenv("TRUSTEDCODE_DIFFERENTIAL", "1") != "0"
+DIFFERENTIAL_INPUTS = 100  # inputs per function, edge cases first
+DIFFERENTIAL_BATCH_SIZE = 50  # calls evaluated per `why3 execute` run
+DIFFERENTIAL_CALL_BUDGET = 0.2  # seconds per Python call; inputs taking longer are left out
+DIFFERENTIAL_MISMATCH_EXAMPLES = 5  # mismatching inputs shown to the corrector per function
+
+# Few-shot examples: verified (typed Python, WhyML) pairs, seeded from test_code and grown with
+# every verified run; the nearest are added to the translation and correction prompts
+FEW_SHOT_ENABLED = os.getenv("TRUSTEDCODE_EXAMPLES", "1") != "0"
+FEW_SHOT_EXAMPLES = 2  # examples per prompt
+FEW_SHOT_MIN_SIMILARITY = 0.3  # less similar examples are left out
+FEW_SHOT_MAX_CHARS = 3000  # longer WhyML is never used as an example
+FEW_SHOT_SHAPE_WEIGHT = 0.7  # weight of AST shape against tokens in the similarity
+EXAMPLE_SEED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_code")
+
+# Inputs with several top-level functions are split into one pipeline per function
+DECOMPOSE_FUNCTIONS = os.getenv("TRUSTEDCODE_DECOMPOSE", "1") != "0"
+
+# Append-only results store: one JSON line per attempt, classification and finished run
+RESULTS_ENABLED = os.getenv("TRUSTEDCODE_RESULTS", "1") != "0"
+RESULTS_PATH = "whyml_results.jsonl"
+
+# Seconds before an LLM call is cancelled, per calling node
+LLM_DEADLINES = {
+    "chatbot": 60,
+    "whyml_translator": 20,
+    "error_corrector": 120,
+    "classify_capability_gap": 30,
+}
+MAX_CONCURRENT_WHY3 = os.cpu_count() or 1
+
+# On-disk cache of LLM responses (set TRUSTEDCODE_LLM_CACHE=0 or pass --no-cache to bypass)
+CACHE_DIR = ".cache"
+LLM_CACHE_ENABLED = os.getenv("TRUSTEDCODE_LLM_CACHE", "1") != "0"
+LLM_CACHE_PATH = os.path.join(CACHE_DIR, "llm_cache.sqlite")
+LLM_CACHE_MAX_ENTRIES = 10000
+LLM_CACHE_MAX_AGE_DAYS = 30
+
+# Verified translations learned from runs, used as few-shot examples
+EXAMPLE_INDEX_PATH = os.path.join(CACHE_DIR, "example_index.jsonl")
+
+# Graph state is checkpointed after every step, keyed by a hash of the input and the run
+# settings, so interrupted runs resume where they stopped and verified ones are not redone
+CHECKPOINTS_ENABLED = os.getenv("TRUSTEDCODE_CHECKPOINTS", "1") != "0"
+CHECKPOINT_PATH = os.path.join(CACHE_DIR, "checkpoints.sqlite")
+
+# Opt-in rendering of the graph (--visualize). The image is only redrawn when the
+# graph's structure changes; the hash of the drawn structure is kept next to the caches
+GRAPH_VISUALIZATION_PATH = "graph_visualization.png"
+GRAPH_VISUALIZATION_KEY_PATH = os.path.join(CACHE_DIR, "graph_visualization.key")
+
+# Job server (server.py): conversions run at once, jobs waiting before new ones are
+# rejected with 503, and finished jobs kept for status queries
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+SERVER_WORKERS = 4
+SERVER_QUEUE_SIZE = 100
+SERVER_MAX_JOBS = 1000
+
+# Maximum graph steps per run; each retry takes up to three steps (check, prove, correct)
+GRAPH_RECURSION_LIMIT = 100
+
+# Why3 prover settings
+WHY3_PROVER = "alt-ergo"
+WHY3_TIMEOUT = 30  # seconds
+
+# why3 processes kept started ahead of time per command (type check, each prover), with
+# configuration and drivers loaded and waiting for a module on stdin (0 starts them on demand)
+WHY3_WARM_WORKERS = int(os.getenv("TRUSTEDCODE_WHY3_WORKERS", "2"))
+
+# Portfolio mode: run these provers at once and keep the first that proves every goal.
+# Leave empty to run WHY3_PROVER alone (override with --portfolio alt-ergo,z3,cvc5)
+PROVER_PORTFOLIO = [p for p in os.getenv("TRUSTEDCODE_PORTFOLIO", "").split(",") if p]
+
+# Split mode: split the module into its individual VCs (split_vc) and prove each goal
+# as its own prover process, spread over MAX_CONCURRENT_WHY3 cores (or pass --split-goals)
+SPLIT_GOALS = os.getenv("TRUSTEDCODE_SPLIT_GOALS", "0") == "1"
+SPLIT_GOAL_TIMELIMIT = 10  # seconds per goal
+# Command used to run a prover on one task file written by `why3 prove -o`, and the
+# output pattern that means the goal is valid. {file} and {timelimit} are substituted.
+SPLIT_PROVER_COMMANDS = {
+    "alt-ergo": (["alt-ergo", "--timelimit={timelimit}", "{file}"], r"\bValid\b"),
+    "z3": (["z3", "-T:{timelimit}", "{file}"], r"^unsat"),
+    "cvc5": (["cvc5", "--tlimit={timelimit}000", "{file}"], r"^unsat"),
+}
+
+# On-disk cache of why3 results keyed on normalised WhyML (TRUSTEDCODE_PROOF_CACHE=0 to bypass)
+PROOF_CACHE_ENABLED = os.getenv("TRUSTEDCODE_PROOF_CACHE", "1") != "0"
+PROOF_CACHE_PATH = os.path.join(CACHE_DIR, "proof_cache.sqlite")
+PROOF_CACHE_MAX_ENTRIES = 50000
+PROOF_CACHE_MAX_AGE_DAYS = 30
+
+# Add type hints with local AST inference when it can type every function, skipping the LLM
+LOCAL_TYPING = os.getenv("TRUSTEDCODE_LOCAL_TYPING", "1") != "0"
 
 # Prompt for converting Python to well-typed Python
 TYPING_PROMPT = """Convert the code provided into well-typed python code. add type hints in the function such as int or float as relevant. import relevant libraries as you see fit. You must output raw Python code only. Start directly with 'def' or 'class'. No formatting."""
 
 # Prompt for converting typed Python to WhyML
-WHYML_PROMPT = """You are an expert in formal verification using Why3. Convert the following well typed Python function into WhyML. Do NOT use markdown formatting or code blocks. Output only raw WhyML code. start with module and end blocks. import relevant libraries as you see fit."""
+WHYML_PROMPT = """You are an expert in formal verification using Why3. Convert the following well typed Python function into WhyML. State what the function computes with requires and ensures clauses, and give loops invariants and variants. Do NOT use markdown formatting or code blocks. Output only raw WhyML code. start with module and end blocks. import relevant libraries as you see fit."""
+
+# Introduces the few-shot examples added to the translation and correction prompts
+FEW_SHOT_PROMPT = """Verified translations of similar Python functions follow. Use them as a guide to the `use` imports, ref and array idioms, specifications and loop invariants that Why3 accepts and proves."""
+
+# Translate Python in the common subset (int/list code, loops, recursion) with AST templates instead of the LLM
+TEMPLATE_TRANSLATION = os.getenv("TRUSTEDCODE_TEMPLATE_TRANSLATION", "1") != "0"
+# Ask the LLM to add specifications and invariants to template translations. Without them
+# the pre-flight check rejects the template output and the error corrector adds them
+TEMPLATE_ADD_SPECS = os.getenv("TRUSTEDCODE_TEMPLATE_ADD_SPECS", "1") != "0"
+
+# Prompt for adding specifications to a template WhyML translation
+TEMPLATE_SPEC_PROMPT = """You are an expert in formal verification using Why3. The following WhyML module was translated mechanically from the Python function shown. Add requires and ensures clauses describing what the function computes, and loop invariants and variants needed to prove it. Replace `diverges` with a variant where possible. Do NOT change the program code itself. Do NOT use markdown formatting or code blocks. Output only raw WhyML code."""
+
+# Error history sent to error_corrector: the last attempts are shown in full, older ones as
+# diffs plus error signatures, and the oldest are dropped to stay under the token budget
+ERROR_HISTORY_FULL_ATTEMPTS = 2
+ERROR_HISTORY_TOKEN_BUDGET = 6000
 
 # Prompt for fixing WhyML code based on errors
 ERROR_FIX_PROMPT = """The WhyML code you generated has errors. Fix the code based on the error message. Critically analyse any previous attempts that you made to assist you with the solution.
@@ -52,6 +206,3 @@ Categories:
 12) DKnow - domain knowledge: doesn't properly use domain specific knowledge
 
 Output the category code (e.g., EKnow) and 20 words max of explination of why you think the capability gap arose:"""
-
-# Can default ot a sample WhyML sample file if LLM unable to generate code (now obsolete)
-SAMPLE_WHYML_FILE = "sample.mlw"
\ No newline at end of file
@@ -0,0 +1,217 @@
+import ast
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from python_to_whyml import module_name
+from checkpoints import invoke_resumable
+from results_store import record_run
+from config import DECOMPOSE_FUNCTIONS
+
+# Whether inputs with several functions are split into per-function pipelines
+decompose_functions = DECOMPOSE_FUNCTIONS
+
+
+def set_decompose_functions(enabled: bool):
+    """Turn per-function decomposition on or off"""
+    global decompose_functions
+    decompose_functions = enabled
+
+
+def call_dependencies(functions: list) -> dict:
+    """Maps each function name to the names of the other top-level functions it calls, transitively"""
+    names = {function.name for function in functions}
+    direct = {
+        function.name: {node.func.id for node in ast.walk(function)
+                        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+                        and node.func.id in names and node.func.id != function.name}
+        for function in functions
+    }
+
+    closure = {}
+    for name in direct:
+        seen = set()
+        pending = list(direct[name])
+        while pending:
+            callee = pending.pop()
+            if callee not in seen and callee != name:
+                seen.add(callee)
+                pending.extend(direct[callee])
+        closure[name] = seen
+    return closure
+
+
+def referenced_names(nodes: list) -> set:
+    """Every name read or annotated in the nodes"""
+    return {node.id for tree in nodes for node in ast.walk(tree) if isinstance(node, ast.Name)}
+
+
+def bound_names(node) -> set:
+    """Names a top-level import, constant assignment or class defines; None for anything else"""
+    if isinstance(node, ast.Import):
+        return {alias.asname or alias.name.split(".")[0] for alias in node.names}
+    if isinstance(node, ast.ImportFrom):
+        return {alias.asname or alias.name for alias in node.names}
+    if isinstance(node, (ast.Assign, ast.AnnAssign)):
+        targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+        return {element.id for target in targets
+                for element in (target.elts if isinstance(target, (ast.Tuple, ast.List)) else [target])
+                if isinstance(element, ast.Name)}
+    if isinstance(node, ast.ClassDef):
+        return {node.name}
+    return None
+
+
+def unit_preamble(statements: list, functions: list) -> list:
+    """
+    The top-level imports, constants and classes the functions use, directly or
+    through other constants, in their original order. Everything else (module
+    docstrings, `if __name__ == "__main__":` blocks, calls) is left out.
+    """
+    needed = referenced_names(functions)
+    kept = set()
+    changed = True
+    while changed:
+        changed = False
+        for i, node in enumerate(statements):
+            names = bound_names(node)
+            if i in kept or names is None:
+                continue
+            star_or_future = isinstance(node, ast.ImportFrom) and ("*" in names or node.module == "__future__")
+            if star_or_future or names & needed:
+                kept.add(i)
+                needed |= referenced_names([node])
+                changed = True
+    return [node for i, node in enumerate(statements) if i in kept]
+
+
+def split_functions(source: str) -> list:
+    """
+    Splits a module into one unit per top-level function. Each unit holds the
+    imports, constants and classes its functions use, the functions it calls
+    and the function itself, in their original order.
+    Returns [(function_name, unit_source)], or [] if there are fewer than two
+    functions or the source does not parse.
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return []
+
+    functions = [node for node in tree.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))]
+    if len(functions) < 2:
+        return []
+
+    statements = [node for node in tree.body if node not in functions]
+    dependencies = call_dependencies(functions)
+
+    units = []
+    for function in functions:
+        needed = dependencies[function.name] | {function.name}
+        unit_functions = [node for node in functions if node.name in needed]
+        parts = [ast.get_source_segment(source, node) for node in unit_preamble(statements, unit_functions)]
+        parts += [ast.get_source_segment(source, node) for node in unit_functions]
+        units.append((function.name, "\n\n".join(part for part in parts if part) + "\n"))
+    return units
+
+
+def code_start(whyml_code: str) -> int:
+    """Index of the first character after leading whitespace and (possibly nested) comments"""
+    i = depth = 0
+    while i < len(whyml_code):
+        if whyml_code.startswith("(*", i) and not whyml_code.startswith("(*)", i):
+            depth += 1
+            i += 2
+        elif depth and whyml_code.startswith("*)", i):
+            depth -= 1
+            i += 2
+        elif depth or whyml_code[i].isspace():
+            i += 1
+        else:
+            break
+    return i
+
+
+def rename_module(whyml_code: str, name: str) -> str:
+    """
+    Gives the module the WhyML code starts with the given name, so units can
+    share a file. Code not starting with a module or theory is left unchanged.
+    """
+    start = code_start(whyml_code)
+    match = re.compile(r"(module|theory)\s+[A-Za-z_][A-Za-z0-9_']*").match(whyml_code, start)
+    if match is None:
+        return whyml_code
+    return f"{whyml_code[:start]}{match.group(1)} {name}{whyml_code[match.end():]}"
+
+
+def process_function(name: str, unit_source: str, graph, label: str = "", on_update=None) -> dict:
+    """
+    Runs one function unit through its own pipeline and returns a summary row.
+    on_update(name, node_name, node_output, state) is called for every node update.
+    """
+    start = time.perf_counter()
+    row = {"Function": name}
+    try:
+        forward = None if on_update is None else (
+            lambda node_name, node_output, state: on_update(name, node_name, node_output, state))
+        final_state, status = invoke_resumable(graph, unit_source, forward)
+        row["Run"] = status
+        if status != "finished":
+            record_run(final_state, f"{label}::{name}" if label else name)
+        errors = final_state.get("errors", [])
+        row.update({
+            "Verified": final_state.get("execution_success", False),
+            "Number of Tries": len(final_state.get("whyml_attempts", [])),
+            "Last Error": errors[-1] if errors else "",
+            "Final WhyML": final_state.get("whyml_code", ""),
+        })
+    except Exception as e:
+        row.update({"Run": "new", "Verified": False, "Number of Tries": 0,
+                    "Last Error": f"Pipeline error: {e}", "Final WhyML": ""})
+    row["Seconds"] = round(time.perf_counter() - start, 2)
+    return row
+
+
+def assemble_modules(rows: list) -> str:
+    """
+    Joins the verified function modules into one .mlw file, one module per
+    function named after it. Functions that were not verified are listed in
+    a header comment.
+    """
+    failed = [row["Function"] for row in rows if not row["Verified"]]
+    parts = []
+    if failed:
+        parts.append(f"(* Not verified: {', '.join(failed)} *)")
+    for row in rows:
+        if row["Verified"]:
+            parts.append(rename_module(row["Final WhyML"].strip(), module_name(row["Function"])))
+    return "\n\n".join(parts) + "\n"
+
+
+def run_decomposed(units: list, graph, max_workers: int = None, label: str = "", on_update=None) -> tuple:
+    """
+    Translates and verifies each function unit as its own pipeline, in
+    parallel, so a failing function is retried without regenerating the
+    others. label names the file in the results store, and on_update is
+    passed to process_function.
+    Returns (rows in input order, assembled WhyML).
+    """
+    max_workers = max_workers or len(units)
+    print(f"\nSplit into {len(units)} functions, processed with up to {max_workers} concurrent pipelines")
+    print("-" * 50)
+
+    rows = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(process_function, name, unit_source, graph, label, on_update): name
+                   for name, unit_source in units}
+        for done, future in enumerate(as_completed(futures), start=1):
+            row = future.result()
+            rows.append(row)
+            status = "verified" if row["Verified"] else "not verified"
+            saved = ", saved result" if row["Run"] == "finished" else ", resumed" if row["Run"] == "resumed" else ""
+            print(f"[{done}/{len(units)}] {row['Function']}: {status} "
+                  f"({row['Number of Tries']} tries, {row['Seconds']}s{saved})")
+
+    order = [name for name, _ in units]
+    rows.sort(key=lambda row: order.index(row["Function"]))
+    return rows, assemble_modules(rows)
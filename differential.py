@@ -0,0 +1,329 @@
+import ast
+import itertools
+import random
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from python_to_whyml import Unsupported, whyml_identifier, whyml_type
+from type_inference import annotate_types
+from why3_runner import execute_whyml, strip_whyml_comments
+from tracing import in_context
+from config import (
+    DIFFERENTIAL_TESTING,
+    DIFFERENTIAL_INPUTS,
+    DIFFERENTIAL_BATCH_SIZE,
+    DIFFERENTIAL_CALL_BUDGET,
+    DIFFERENTIAL_MISMATCH_EXAMPLES,
+)
+
+# Whether proved WhyML is run against the Python function before a run is accepted
+differential_testing = DIFFERENTIAL_TESTING
+
+# Parameter and return types that inputs can be generated and results compared for
+TESTABLE_TYPES = {"int", "bool", "array int", "array bool"}
+
+# Values tried before the random ones
+EDGE_VALUES = {
+    "int": [0, 1, -1, 2, -2, 3, 7, 10, -10, 100, -100],
+    "bool": [False, True],
+    "array int": [[], [0], [1], [-1], [1, 2, 3], [3, 2, 1], [2, 2, 2], [5, -3, 0, 8, -1]],
+    "array bool": [[], [True], [False], [True, False, True]],
+}
+
+# Module appended to the WhyML code whose run () evaluates a batch of calls
+WRAPPER_MODULE = "DifferentialTest"
+
+# Value printed by `why3 execute`, e.g. "result: (int, int) = (3, (-7))"
+RESULT_PATTERN = re.compile(r"result\s*(?::[^=]*)?=\s*(.*?)(?:\n\s*globals|\Z)", re.DOTALL)
+VALUE_TOKEN = re.compile(r"-?\d+|\btrue\b|\bfalse\b")
+
+
+def set_differential_testing(enabled: bool):
+    """Turn differential testing of proved WhyML on or off"""
+    global differential_testing
+    differential_testing = enabled
+
+
+class CallBudgetExceeded(Exception):
+    """Raised inside a Python call that ran longer than its time budget"""
+
+
+def call_with_budget(function, args: tuple, budget: float):
+    """Calls function(*args), raising CallBudgetExceeded once it has run for budget seconds"""
+    deadline = time.perf_counter() + budget
+
+    def trace(frame, event, arg):
+        if time.perf_counter() > deadline:
+            raise CallBudgetExceeded()
+        return trace
+
+    previous = sys.gettrace()
+    sys.settrace(trace)
+    try:
+        return function(*args)
+    finally:
+        sys.settrace(previous)
+
+
+def signatures(typed_python: str) -> dict:
+    """
+    Maps each top-level function whose annotations are all testable types to
+    (parameter names, WhyML parameter types, WhyML return type).
+    """
+    try:
+        tree = ast.parse(typed_python)
+    except SyntaxError:
+        return {}
+    found = {}
+    for node in tree.body:
+        if not isinstance(node, ast.FunctionDef) or node.returns is None:
+            continue
+        args = node.args
+        if args.vararg or args.kwarg or args.kwonlyargs or args.posonlyargs:
+            continue
+        try:
+            types = [whyml_type(arg.annotation) for arg in args.args]
+            returns = whyml_type(node.returns)
+        except (Unsupported, AttributeError):
+            continue
+        if returns in ("int", "bool") and all(t in TESTABLE_TYPES for t in types):
+            found[node.name] = ([arg.arg for arg in args.args], types, returns)
+    return found
+
+
+def load_python(source: str) -> dict:
+    """
+    Executes the imports, definitions and assignments of the source (not its
+    other top-level statements, such as a main block) and returns the namespace.
+    """
+    tree = ast.parse(source)
+    tree.body = [node for node in tree.body if isinstance(node, (
+        ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef, ast.Assign, ast.AnnAssign))]
+    namespace = {"__name__": "differential_input"}
+    exec(compile(tree, "<input>", "exec"), namespace)
+    return namespace
+
+
+def random_value(whyml_type: str, rng: random.Random):
+    if whyml_type == "int":
+        return rng.randint(-50, 50)
+    if whyml_type == "bool":
+        return rng.random() < 0.5
+    element = whyml_type.split()[-1]
+    return [rng.randint(-20, 20) if element == "int" else rng.random() < 0.5 for _ in range(rng.randint(0, 8))]
+
+
+def generate_inputs(types: list, count: int, seed: str) -> list:
+    """
+    count argument tuples: combinations of edge values first, then random
+    values. The seed keeps the inputs (and so the cached results) stable across runs.
+    """
+    if not types:
+        return [()]
+    rng = random.Random(seed)
+    inputs = list(itertools.islice(itertools.product(*(EDGE_VALUES[t] for t in types)), count // 2))
+    seen = {repr(args) for args in inputs}
+    for _ in range(count * 10):
+        if len(inputs) >= count:
+            break
+        args = tuple(random_value(t, rng) for t in types)
+        if repr(args) not in seen:
+            seen.add(repr(args))
+            inputs.append(args)
+    return inputs
+
+
+def requires_clauses(whyml_code: str, name: str):
+    """Texts of the requires clauses of the program function name, or None if it is not defined"""
+    code = strip_whyml_comments(whyml_code)
+    match = re.search(rf"\blet\s+(?:rec\s+)?(?:function\s+)?{re.escape(name)}\b", code)
+    if not match:
+        return None
+    clauses = []
+    depth = 0
+    start = None
+    for i in range(match.end(), len(code)):
+        c = code[i]
+        if c in "{(":
+            if depth == 0 and c == "{":
+                start = i + 1
+            depth += 1
+        elif c in "})":
+            depth -= 1
+            if depth == 0 and c == "}" and code[:start - 1].rstrip().endswith("requires"):
+                clauses.append(code[start:i])
+        elif c == "=" and depth == 0 and code[i - 1] not in "<>:!=" and code[i + 1:i + 2] not in ("=", ">"):
+            # Start of the function body
+            break
+    return clauses
+
+
+def python_condition(clause: str):
+    """Python expression for a simple requires clause, or None if it cannot be evaluated in Python"""
+    if re.search(r"->|\b(forall|exists|old|at|if|let|match|mod|div)\b", clause):
+        return None
+    text = clause.replace("/\\", " and ").replace("\\/", " or ").replace("<>", "!=")
+    text = re.sub(r"(?<![<>=!])=(?!=)", "==", text)
+    text = re.sub(r"\blength\s+([A-Za-z_]\w*)", r"len(\1)", text)
+    text = re.sub(r"\btrue\b", "True", re.sub(r"\bfalse\b", "False", text))
+    try:
+        compile(text.strip(), "<requires>", "eval")
+    except SyntaxError:
+        return None
+    return text.strip()
+
+
+def whyml_literal(value, whyml_type: str) -> str:
+    if whyml_type == "bool":
+        return "true" if value else "false"
+    if whyml_type == "int":
+        return f"({value})" if value < 0 else str(value)
+    element = whyml_type.split()[-1]
+    default = "false" if element == "bool" else "0"
+    writes = "".join(f"a[{i}] <- {whyml_literal(v, element)}; " for i, v in enumerate(value))
+    return f"(let a = Array.make {len(value)} {default} in {writes}a)"
+
+
+def python_tokens(value) -> list:
+    if isinstance(value, bool):
+        return ["true" if value else "false"]
+    return [str(value)]
+
+
+def result_tokens(stdout: str):
+    """Integers and booleans of the value printed by `why3 execute`, or None if there is none"""
+    match = RESULT_PATTERN.search(stdout or "")
+    if not match:
+        return None
+    return VALUE_TOKEN.findall(match.group(1))
+
+
+def wrapper_module(whyml_code: str, module: str, calls: list) -> str:
+    """The WhyML code followed by a module whose run () returns the tuple of the calls' results"""
+    imports = ["int.Int", "array.Array", module]
+    return (whyml_code.rstrip() + f"\n\nmodule {WRAPPER_MODULE}\n"
+            + "".join(f"  use {name}\n" for name in imports)
+            + "\n  let run () =\n    (" + ",\n     ".join(calls) + ")\nend\n")
+
+
+def run_batch(whyml_code: str, module: str, calls: list):
+    """Evaluates the calls in one `why3 execute` run. Returns (tokens or None, reason)"""
+    try:
+        result = execute_whyml(wrapper_module(whyml_code, module, calls), WRAPPER_MODULE, "run ()")
+    except subprocess.TimeoutExpired:
+        return None, "why3 execute timed out"
+    except FileNotFoundError:
+        return None, "why3 not found"
+    tokens = result_tokens(result.stdout) if result.returncode == 0 else None
+    if tokens is None:
+        lines = (result.stderr or result.stdout).strip().splitlines()
+        return None, f"why3 execute failed: {lines[-1] if lines else result.returncode}"
+    if len(tokens) != len(calls):
+        return None, f"why3 execute returned {len(tokens)} values for {len(calls)} calls"
+    return tokens, ""
+
+
+def check_function(whyml_code: str, module: str, name: str, params: list, types: list, function) -> dict:
+    """Compares one Python function with its WhyML translation on generated inputs"""
+    check = {"function": name, "status": "skipped", "inputs": 0, "mismatches": [], "reason": ""}
+    whyml_name = whyml_identifier(name)
+    clauses = requires_clauses(whyml_code, whyml_name)
+    if clauses is None:
+        check["reason"] = f"no program function {whyml_name} in the WhyML code"
+        return check
+    conditions = [python_condition(clause) for clause in clauses]
+    if None in conditions:
+        check["reason"] = "precondition cannot be evaluated in Python"
+        return check
+
+    # Inputs outside the precondition, or on which the Python function fails or runs too long, are left out
+    cases = []
+    for args in generate_inputs(types, DIFFERENTIAL_INPUTS, name):
+        scope = {whyml_identifier(param): value for param, value in zip(params, args)}
+        try:
+            if not all(eval(condition, {"__builtins__": {}, "len": len}, dict(scope)) for condition in conditions):
+                continue
+        except Exception:
+            check["reason"] = "precondition cannot be evaluated in Python"
+            return check
+        try:
+            value = call_with_budget(function, tuple(list(a) if isinstance(a, list) else a for a in args),
+                                     DIFFERENTIAL_CALL_BUDGET)
+        except Exception:
+            continue
+        if isinstance(value, int):
+            cases.append((args, value))
+    if not cases:
+        check["reason"] = "no input the Python function returns a value for"
+        return check
+
+    calls = [f"{whyml_name} " + (" ".join(whyml_literal(a, t) for a, t in zip(args, types)) or "()")
+             for args, _ in cases]
+    batches = [range(i, min(i + DIFFERENTIAL_BATCH_SIZE, len(cases)))
+               for i in range(0, len(cases), DIFFERENTIAL_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=len(batches)) as pool:
+        outcomes = list(pool.map(in_context(lambda batch: run_batch(whyml_code, module, [calls[i] for i in batch])),
+                                 batches))
+
+    reasons = []
+    for batch, (tokens, reason) in zip(batches, outcomes):
+        if tokens is None:
+            reasons.append(reason)
+            continue
+        for i, actual in zip(batch, tokens):
+            args, value = cases[i]
+            check["inputs"] += 1
+            if python_tokens(value) != [actual]:
+                check["mismatches"].append((f"{name}({', '.join(map(repr, args))})", python_tokens(value)[0], actual))
+    if check["inputs"]:
+        check["status"] = "failed" if check["mismatches"] else "passed"
+    check["reason"] = "; ".join(dict.fromkeys(reasons))
+    return check
+
+
+def differential_test(original_python: str, typed_python: str, whyml_code: str) -> list:
+    """
+    Runs every testable function of the original Python in-process and its
+    WhyML translation with batched `why3 execute` runs on the same generated
+    inputs. Returns one check per function (see check_function).
+    """
+    found = signatures(typed_python) or signatures(annotate_types(original_python)[0])
+    module = re.search(r"\bmodule\s+([A-Z][A-Za-z0-9_']*)", strip_whyml_comments(whyml_code))
+    if not found or module is None:
+        return []
+    try:
+        namespace = load_python(original_python)
+    except Exception as e:
+        print(f"Differential testing skipped, the Python code could not be loaded: {e}")
+        return []
+    return [check_function(whyml_code, module.group(1), name, params, types, namespace[name])
+            for name, (params, types, _) in found.items() if callable(namespace.get(name))]
+
+
+def describe_checks(checks: list) -> str:
+    """One line per function checked"""
+    if not checks:
+        return "Differential testing skipped: no function with int, bool or list parameters and an int or bool result."
+    lines = []
+    for check in checks:
+        if check["status"] == "skipped":
+            lines.append(f"{check['function']}: not tested ({check['reason']})")
+        else:
+            lines.append(f"{check['function']}: {check['inputs'] - len(check['mismatches'])}/{check['inputs']} "
+                         f"inputs agree" + (f" ({check['reason']})" if check["reason"] else ""))
+    return "\n".join(lines)
+
+
+def mismatch_report(checks: list) -> str:
+    """Error message for the corrector describing the inputs on which the WhyML code computes something else"""
+    lines = ["Semantic mismatch: the WhyML code proves, but does not compute the same results as the original Python code."]
+    for check in checks:
+        if not check["mismatches"]:
+            continue
+        lines.append(f"{check['function']}: {len(check['mismatches'])} of {check['inputs']} inputs differ, for example:")
+        for call, expected, actual in check["mismatches"][:DIFFERENTIAL_MISMATCH_EXAMPLES]:
+            lines.append(f"  {call} = {expected} in Python, {actual} in WhyML")
+    return "\n".join(lines)
@@ -0,0 +1,92 @@
+import difflib
+import re
+
+from why3_runner import normalize_whyml
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count used for budgeting prompts (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def error_signature(error: str) -> str:
+    """
+    Short, location-independent summary of a Why3 error: the message lines
+    without temporary file paths, used to spot repeated errors.
+    """
+    lines = [line.strip() for line in error.strip().splitlines() if line.strip()]
+    lines = [re.sub(r'File "[^"]*",', "File,", line) for line in lines]
+    lines = [re.sub(r"/\S+\.mlw", "<file>", line) for line in lines]
+    message = [line for line in lines if not line.startswith("File,")] or lines
+    return " | ".join(message)[:300]
+
+
+def code_diff(from_code: str, to_code: str, from_label: str, to_label: str) -> str:
+    diff = difflib.unified_diff(from_code.strip().splitlines(), to_code.strip().splitlines(),
+                                fromfile=from_label, tofile=to_label, n=1, lineterm="")
+    return "\n".join(diff)
+
+
+def truncate_error(error: str, max_lines: int = 20) -> str:
+    lines = error.strip().splitlines()
+    if len(lines) <= max_lines:
+        return error.strip()
+    return "\n".join(lines[:max_lines] + [f"... ({len(lines) - max_lines} more lines)"])
+
+
+def build_error_history(attempts: list, errors: list, keep_full: int = 2, token_budget: int = 6000) -> tuple:
+    """
+    Builds the error history for the correction prompt. Identical attempts
+    (same normalised code and error) are collapsed, the last keep_full distinct
+    attempts are shown in full, and older ones shrink to a diff against the
+    following attempt plus their error signature. Oldest entries are dropped
+    until the history fits in token_budget.
+    Returns (history_text, stats) where stats counts how each attempt was shown.
+    """
+    pairs = list(zip(attempts, errors))
+    stats = {"attempts": len(pairs), "full": 0, "diff": 0, "duplicate": 0, "omitted": 0}
+
+    # Collapse repeats of an earlier attempt onto the first occurrence
+    first_seen = {}
+    duplicates = {}
+    distinct = []
+    for i, (attempt, error) in enumerate(pairs):
+        key = (normalize_whyml(attempt), error_signature(error))
+        if key in first_seen:
+            duplicates.setdefault(first_seen[key], []).append(i + 1)
+            stats["duplicate"] += 1
+        else:
+            first_seen[key] = i
+            distinct.append(i)
+
+    entries = []
+    for position, i in enumerate(distinct):
+        attempt, error = pairs[i]
+        header = f"--- ATTEMPT {i+1} ---\n"
+        if i in duplicates:
+            repeats = duplicates[i]
+            header += f"(attempt{'s' if len(repeats) > 1 else ''} {', '.join(map(str, repeats))} repeated this exact code and error)\n"
+        if position >= len(distinct) - keep_full:
+            body = f"CODE:\n```whyml\n{attempt.strip()}\n```\n"
+            body += f"ERROR:\n```text\n{truncate_error(error)}\n```\n\n"
+            entries.append(("full", header + body))
+        else:
+            following = distinct[position + 1]
+            diff = code_diff(pairs[following][0], attempt, f"attempt {following+1}", f"attempt {i+1}")
+            body = f"CODE (diff against attempt {following+1}):\n```diff\n{diff}\n```\n"
+            body += f"ERROR SIGNATURE: {error_signature(error)}\n\n"
+            entries.append(("diff", header + body))
+
+    # Drop the oldest compact entries first, then the oldest full ones, but always keep the latest
+    while len(entries) > 1 and estimate_tokens("".join(text for _, text in entries)) > token_budget:
+        entries.pop(0)
+        stats["omitted"] += 1
+
+    for kind, _ in entries:
+        stats[kind] += 1
+
+    history = ""
+    if stats["omitted"]:
+        history += f"({stats['omitted']} older distinct attempts omitted to fit the prompt budget)\n\n"
+    history += "".join(text for _, text in entries)
+    return history, stats
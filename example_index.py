@@ -0,0 +1,254 @@
+import ast
+import glob
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+from cache import make_key
+from utils import has_specification
+from type_inference import annotate_types, HIGH
+from config import (
+    FEW_SHOT_ENABLED,
+    FEW_SHOT_EXAMPLES,
+    FEW_SHOT_MIN_SIMILARITY,
+    FEW_SHOT_MAX_CHARS,
+    FEW_SHOT_SHAPE_WEIGHT,
+    FEW_SHOT_PROMPT,
+    EXAMPLE_SEED_DIR,
+    EXAMPLE_INDEX_PATH,
+)
+
+# Whether prompts include examples, and whether verified runs are added to (and read
+# from) the learned examples; without learning only the test_code seeds are used
+examples_enabled = FEW_SHOT_ENABLED
+learn_examples = True
+
+# Names of entries never used as examples, e.g. the test_code case being benchmarked
+held_out_examples = set()
+
+# AST nodes that say nothing about the shape of the code
+IGNORED_NODES = {"Module", "Load", "Store", "Del", "arguments", "alias"}
+
+
+def set_examples(enabled: bool = True, learn: bool = True):
+    """Turn few-shot examples on or off, and learning from verified runs"""
+    global examples_enabled, learn_examples
+    examples_enabled = enabled
+    learn_examples = learn
+
+
+def set_held_out_examples(names):
+    """Leave the named entries (test_code case directories or function names) out of prompts"""
+    global held_out_examples
+    held_out_examples = set(names)
+
+
+def shape_features(source: str) -> Counter:
+    """
+    AST-shape fingerprint: counts of node types and of parent>child node type
+    pairs, plus the annotated parameter and return types and self-recursion.
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return Counter()
+    features = Counter()
+    for node in ast.walk(tree):
+        name = type(node).__name__
+        if name in IGNORED_NODES:
+            continue
+        features[name] += 1
+        for child in ast.iter_child_nodes(node):
+            if type(child).__name__ not in IGNORED_NODES:
+                features[f"{name}>{type(child).__name__}"] += 1
+        if isinstance(node, ast.arg) and node.annotation is not None:
+            features[f"param:{ast.unparse(node.annotation)}"] += 1
+        if isinstance(node, ast.FunctionDef):
+            if node.returns is not None:
+                features[f"returns:{ast.unparse(node.returns)}"] += 1
+            if any(isinstance(call, ast.Call) and isinstance(call.func, ast.Name) and call.func.id == node.name
+                   for call in ast.walk(node)):
+                features["recursion"] += 1
+    return features
+
+
+def token_features(source: str) -> Counter:
+    """Bag of lowercase words in the source, with identifiers split at underscores and case changes"""
+    words = re.findall(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])", source)
+    return Counter(word.lower() for word in words)
+
+
+def cosine(a: Counter, b: Counter, weights: dict) -> float:
+    """Cosine similarity of the two bags, each feature scaled by its weight"""
+    if not a or not b:
+        return 0.0
+    dot = sum(count * b[key] * weights.get(key, 1.0) ** 2 for key, count in a.items() if key in b)
+    norm_a = math.sqrt(sum((count * weights.get(key, 1.0)) ** 2 for key, count in a.items()))
+    norm_b = math.sqrt(sum((count * weights.get(key, 1.0)) ** 2 for key, count in b.items()))
+    return dot / (norm_a * norm_b)
+
+
+def idf_weights(bags: list) -> dict:
+    """Inverse document frequency: features found in most entries count for little"""
+    counts = Counter(key for bag in bags for key in bag)
+    return {key: math.log((len(bags) + 1) / (count + 1)) + 1 for key, count in counts.items()}
+
+
+def read_text(path: str) -> str:
+    with open(path, "r") as f:
+        return f.read()
+
+
+def parses(source: str) -> bool:
+    try:
+        ast.parse(source)
+        return True
+    except SyntaxError:
+        return False
+
+
+def function_name(source: str) -> str:
+    match = re.search(r"^def\s+(\w+)", source, re.MULTILINE)
+    return match.group(1) if match else "run"
+
+
+def python_key(source: str) -> str:
+    return make_key(re.sub(r"\s+", " ", source).strip())
+
+
+class ExampleIndex:
+    """
+    Verified (typed Python, WhyML) pairs searchable by similarity of the
+    Python code. Seeded from the test_code cases and grown with every
+    verified run, which is appended to a JSONL file. Loaded on first use.
+    """
+
+    def __init__(self, seed_dir: str, path: str):
+        self.seed_dir = seed_dir
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = None
+        self._learned_loaded = False
+
+    def _entry(self, name: str, python: str, whyml: str, origin: str) -> dict:
+        return {
+            "name": name,
+            "python": python,
+            "whyml": whyml,
+            "origin": origin,
+            "key": python_key(python),
+            "shape": shape_features(python),
+            "tokens": token_features(python),
+        }
+
+    def _seed_entries(self) -> list:
+        entries = []
+        for directory in sorted(glob.glob(os.path.join(self.seed_dir, "*", ""))):
+            # The standard_*.py input if it parses, else the case's other Python file
+            inputs = sorted(glob.glob(os.path.join(directory, "standard_*.py")))
+            inputs += [path for path in sorted(glob.glob(os.path.join(directory, "*.py"))) if path not in inputs]
+            python = next((source for source in map(read_text, inputs) if parses(source)), None)
+            references = sorted(glob.glob(os.path.join(directory, "*.mlw")))
+            if python is None or not references:
+                continue
+            with open(references[0], "r") as f:
+                whyml = f.read()
+            # Typed like the translator's input, so the two are compared on equal terms
+            annotated, confidence = annotate_types(python)
+            entries.append(self._entry(os.path.basename(os.path.normpath(directory)),
+                                       annotated if confidence == HIGH else python, whyml, "seed"))
+        return entries
+
+    def _learned_entries(self) -> list:
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, "r") as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    entries.append(self._entry(row["name"], row["python"], row["whyml"], "learned"))
+        return entries
+
+    def entries(self) -> list:
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._seed_entries()
+            if learn_examples and not self._learned_loaded:
+                known = {entry["key"] for entry in self._entries}
+                self._entries += [entry for entry in self._learned_entries() if entry["key"] not in known]
+                self._learned_loaded = True
+            if learn_examples:
+                return list(self._entries)
+            return [entry for entry in self._entries if entry["origin"] == "seed"]
+
+    def add(self, python: str, whyml: str, name: str = ""):
+        """
+        Adds a verified pair, unless the same Python code is already in the
+        index or the WhyML has no specification (and so proved nothing)
+        """
+        if not learn_examples or not python.strip() or not has_specification(whyml):
+            return
+        self.entries()
+        entry = self._entry(name or function_name(python), python, whyml, "learned")
+        with self._lock:
+            if any(existing["key"] == entry["key"] for existing in self._entries):
+                return
+            self._entries.append(entry)
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"name": entry["name"], "python": python, "whyml": whyml}) + "\n")
+
+    def nearest(self, python: str, k: int = FEW_SHOT_EXAMPLES, exclude=()) -> list:
+        """
+        Up to k entries most similar to the Python code, scored by a weighted
+        cosine similarity of AST shape and tokens with IDF-weighted features.
+        Entries for the very same code and entries named in exclude are left out.
+        """
+        key = python_key(python)
+        shape = shape_features(python)
+        tokens = token_features(python)
+        entries = self.entries()
+        shape_weights = idf_weights([entry["shape"] for entry in entries])
+        token_weights = idf_weights([entry["tokens"] for entry in entries])
+        scored = []
+        for entry in entries:
+            if entry["key"] == key or entry["name"] in exclude or len(entry["whyml"]) > FEW_SHOT_MAX_CHARS:
+                continue
+            score = (FEW_SHOT_SHAPE_WEIGHT * cosine(shape, entry["shape"], shape_weights)
+                     + (1 - FEW_SHOT_SHAPE_WEIGHT) * cosine(tokens, entry["tokens"], token_weights))
+            if score >= FEW_SHOT_MIN_SIMILARITY:
+                scored.append((score, entry))
+        scored.sort(key=lambda item: -item[0])
+        return [dict(entry, similarity=round(score, 3)) for score, entry in scored[:k]]
+
+
+# Shared by every pipeline
+example_index = ExampleIndex(EXAMPLE_SEED_DIR, EXAMPLE_INDEX_PATH)
+
+
+def few_shot_examples(python: str) -> list:
+    """The nearest verified examples for the Python code, or [] when examples are off"""
+    if not examples_enabled:
+        return []
+    return example_index.nearest(python, exclude=held_out_examples)
+
+
+def format_examples(examples: list) -> str:
+    """Examples as prompt text, empty when there are none"""
+    if not examples:
+        return ""
+    return FEW_SHOT_PROMPT + "".join(f"\n\nExample {i} ({example['name']}):\nPython:\n{example['python'].strip()}\n\n"
+                                     f"Verified WhyML:\n{example['whyml'].strip()}"
+                                     for i, example in enumerate(examples, start=1))
+
+
+def remember_translation(python: str, whyml: str, name: str = ""):
+    """Adds a verified translation to the index, so later runs can use it as an example"""
+    if examples_enabled:
+        example_index.add(python, whyml, name)
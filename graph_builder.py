@@ -1,41 +1,124 @@
+import os
 from langgraph.graph import StateGraph, START, END
 from state import State
+from cache import make_key
+from config import GRAPH_RECURSION_LIMIT, GRAPH_VISUALIZATION_PATH, GRAPH_VISUALIZATION_KEY_PATH
+from tracing import traced_node
+from results_store import recorded_node
 from graph_nodes import (
     chatbot,
     whyml_translator,
+    whyml_checker,
     whyml_executor,
     error_corrector,
+    gap_classifier,
+    differential_tester,
+    should_prove,
+    should_test,
     should_retry
 )
 
-def build_graph():
+def build_graph(checkpointer=None):
     """
-    Builds and compiles the LangGraph state machine.
+    Builds and compiles the LangGraph state machine. With a checkpointer,
+    the state is saved after every step so interrupted runs can be resumed.
     """
     graph_builder = StateGraph(State)
 
-    # Add all the nodes to the graph
-    graph_builder.add_node("chatbot", chatbot)
-    graph_builder.add_node("whyml_translator", whyml_translator)
-    graph_builder.add_node("whyml_executor", whyml_executor)
-    graph_builder.add_node("error_corrector", error_corrector)
+    # Add all the nodes to the graph. Their attempts go to the results store,
+    # and they are timed and profiled when tracing is on
+    graph_builder.add_node("chatbot", traced_node("chatbot", recorded_node("chatbot", chatbot)))
+    graph_builder.add_node("whyml_translator", traced_node("whyml_translator", recorded_node("whyml_translator", whyml_translator)))
+    graph_builder.add_node("whyml_checker", traced_node("whyml_checker", recorded_node("whyml_checker", whyml_checker)))
+    graph_builder.add_node("whyml_executor", traced_node("whyml_executor", recorded_node("whyml_executor", whyml_executor)))
+    graph_builder.add_node("error_corrector", traced_node("error_corrector", recorded_node("error_corrector", error_corrector)))
+    graph_builder.add_node("differential_tester", traced_node("differential_tester", recorded_node("differential_tester", differential_tester)))
+    graph_builder.add_node("gap_classifier", traced_node("gap_classifier", recorded_node("gap_classifier", gap_classifier)))
 
     # Define the graph's execution flow (edges)
     graph_builder.add_edge(START, "chatbot")
     graph_builder.add_edge("chatbot", "whyml_translator")
-    graph_builder.add_edge("whyml_translator", "whyml_executor")
+    graph_builder.add_edge("whyml_translator", "whyml_checker")
 
-    # Add a conditional edge for the retry loop
+    # Only well-formed code reaches the prover
+    graph_builder.add_conditional_edges(
+        "whyml_checker",
+        should_prove,
+        {
+            "prove": "whyml_executor",
+            "retry": "error_corrector",
+            "classify": "gap_classifier",
+            "end": END
+        }
+    )
+
+    # Add a conditional edge for the retry loop. Proved code is first run
+    # against the Python function, and a mismatch is retried like a failed proof
     graph_builder.add_conditional_edges(
         "whyml_executor",
+        should_test,
+        {
+            "test": "differential_tester",
+            "retry": "error_corrector",
+            "classify": "gap_classifier",
+            "end": END
+        }
+    )
+    graph_builder.add_conditional_edges(
+        "differential_tester",
         should_retry,
         {
             "retry": "error_corrector",
+            "classify": "gap_classifier",
             "end": END
         }
     )
-    graph_builder.add_edge("error_corrector", "whyml_executor")
+    graph_builder.add_edge("error_corrector", "whyml_checker")
+
+    # Capability gaps are only reported, so classification is a side branch
+    # running alongside the corrector rather than a step before it
+    graph_builder.add_edge("gap_classifier", END)
 
     # Compile the graph
-    graph = graph_builder.compile()
-    return graph
\ No newline at end of file
+    graph = graph_builder.compile(checkpointer=checkpointer).with_config(recursion_limit=GRAPH_RECURSION_LIMIT)
+    return graph
+
+
+def graph_structure_key(graph) -> str:
+    """Hash of the graph's nodes and edges, unchanged unless the workflow itself changes"""
+    drawable = graph.get_graph()
+    edges = sorted((edge.source, edge.target, str(edge.data or ""), edge.conditional) for edge in drawable.edges)
+    return make_key(sorted(drawable.nodes), edges)
+
+
+def save_graph_visualization(graph, path: str = GRAPH_VISUALIZATION_PATH,
+                             key_path: str = GRAPH_VISUALIZATION_KEY_PATH) -> bool:
+    """
+    Renders the graph to a PNG with the local graphviz install (no remote
+    rendering service). Nothing is drawn if the image at path already shows
+    this structure. Returns whether the image was redrawn.
+    """
+    key = graph_structure_key(graph)
+    if os.path.exists(path) and os.path.exists(key_path):
+        with open(key_path, "r") as f:
+            if f.read().strip() == key:
+                return False
+
+    import graphviz
+
+    drawable = graph.get_graph()
+    dot = graphviz.Digraph()
+    for node in drawable.nodes.values():
+        dot.node(node.id, node.name)
+    for edge in drawable.edges:
+        dot.edge(edge.source, edge.target, label=str(edge.data) if edge.data else None,
+                 style="dashed" if edge.conditional else "solid")
+    with open(path, "wb") as f:
+        f.write(dot.pipe(format="png"))
+
+    directory = os.path.dirname(key_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(key_path, "w") as f:
+        f.write(key)
+    return True
@@ -1,20 +1,70 @@
-import os
 import re
 import subprocess
-import tempfile
-import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 
 from state import State
-from utils import clean_whyml_code, classify_capability_gap
+from utils import clean_whyml_code, strip_thinking, classify_capability_gap, find_structural_problems, whyml_module_complete
+from llm_client import invoke_llm, invoke_llm_candidates
+from llm_scheduler import PRIORITY_FIX, PRIORITY_CONTINUE, PRIORITY_NEW
+from why3_runner import prove_whyml, type_check_whyml
+from tracing import in_context
+from type_inference import annotate_types, HIGH
+from python_to_whyml import translate_to_whyml
+from error_history import build_error_history, estimate_tokens
+import differential
+from differential import differential_test, describe_checks, mismatch_report
+from example_index import few_shot_examples, format_examples, remember_translation
 from config import (
-    llm,
+    LOCAL_TYPING,
+    TEMPLATE_TRANSLATION,
+    TEMPLATE_ADD_SPECS,
+    TEMPLATE_SPEC_PROMPT,
+    ERROR_HISTORY_FULL_ATTEMPTS,
+    ERROR_HISTORY_TOKEN_BUDGET,
     TYPING_PROMPT,
     WHYML_PROMPT,
     ERROR_FIX_PROMPT,
-    SAMPLE_WHYML_FILE,
+    LLM_DEADLINES,
+    CANDIDATE_COUNT,
+    CANDIDATE_TEMPERATURE_RANGE,
+    CANDIDATE_CORRECTIONS,
+    WHY3_TIMEOUT,
 )
 
+# Best-of-N settings, changed from the command line with set_candidates
+candidate_count = CANDIDATE_COUNT
+candidate_corrections = CANDIDATE_CORRECTIONS
+
+
+def set_candidates(count: int, corrections: bool = False):
+    """Request count candidate translations at once (1 disables best-of-N mode)"""
+    global candidate_count, candidate_corrections
+    candidate_count = max(1, count)
+    candidate_corrections = corrections
+
+
+def candidate_temperatures() -> list:
+    """Sampling temperatures for the candidates, spread evenly over CANDIDATE_TEMPERATURE_RANGE"""
+    low, high = CANDIDATE_TEMPERATURE_RANGE
+    if candidate_count == 1:
+        return [low]
+    step = (high - low) / (candidate_count - 1)
+    return [round(low + i * step, 2) for i in range(candidate_count)]
+
+
+def request_whyml(messages: list, deadline: float, best_of_n: bool, priority: int = PRIORITY_CONTINUE) -> list:
+    """
+    Asks the LLM for WhyML, streaming until the module is complete.
+    In best-of-N mode one response is requested per candidate temperature.
+    Returns the responses; raises TimeoutError if none arrived in time.
+    """
+    if best_of_n and candidate_count > 1:
+        return invoke_llm_candidates(messages, candidate_temperatures(), deadline=deadline,
+                                     stop_when=whyml_module_complete, priority=priority)
+    return [invoke_llm(messages, deadline=deadline, stop_when=whyml_module_complete, priority=priority)]
+
 
 def chatbot(state: State):
     system_msg = SystemMessage(content=TYPING_PROMPT)
@@ -22,17 +72,34 @@ def chatbot(state: State):
     user_content = state["messages"][-1].content
     human_msg = HumanMessage(content=user_content)
 
-    response = llm.invoke([system_msg, human_msg])
+    # Simple functions can be typed locally; anything less than fully typed goes to the LLM
+    annotated, confidence = annotate_types(user_content) if LOCAL_TYPING else (user_content, None)
+    if confidence == HIGH:
+        print("Type hints inferred locally, skipping the LLM.")
+        response = AIMessage(content=annotated)
+    else:
+        try:
+            # Starting a new file waits behind the LLM calls of runs already in progress
+            response = invoke_llm([system_msg, human_msg], deadline=LLM_DEADLINES["chatbot"], priority=PRIORITY_NEW)
+        except TimeoutError as e:
+            # Translate the untyped source rather than giving up on the run
+            print(f"Adding type hints timed out ({e}), continuing with the original code.")
+            response = AIMessage(content=user_content)
 
     # Store original and typed Python
     return {
         "messages": [response],
+        "run_id": uuid.uuid4().hex,
         "retry_count": 0,
         "original_python": user_content,
         "typed_python": response.content,
         "whyml_attempts": [],
         "errors": [],
-        "capability_gaps": []
+        "capability_gaps": [],
+        "provers": [],
+        "proof_session": {},
+        "semantic_checks": [],
+        "prompt_stats": []
     }
 
 
@@ -43,56 +110,128 @@ def whyml_translator(state: State):
     result = {
         "messages": [],
         "conversion_timeout": False,
+        "whyml_candidates": [],
     }
 
-    def convert():
-        try:
-            # Create system message for WhyML conversion
-            system_msg = SystemMessage(content=WHYML_PROMPT)
-            # Get the typed Python code from previous step
-            typed_code = state["messages"][-1].content
-            human_msg = HumanMessage(content=typed_code)
-
-            # Invoke LLM for WhyML conversion
-            response = llm.invoke([system_msg, human_msg])
-
-            # Clean the response to ensure no markdown formatting
-            cleaned_content = clean_whyml_code(response.content)
-            result["messages"] = [AIMessage(content=cleaned_content)]
-        except Exception as e:
+    # Get the typed Python code from previous step
+    typed_code = state["messages"][-1].content
+
+    # Inputs in the common subset are translated deterministically
+    template_whyml = translate_to_whyml(typed_code) if TEMPLATE_TRANSLATION else None
+    if template_whyml:
+        print("Translated with templates, skipping the LLM translation.")
+        result["messages"] = [AIMessage(content=template_whyml)]
+        if not TEMPLATE_ADD_SPECS:
+            return result
+
+    # Verified translations of the most similar functions, shown after the instructions
+    examples = few_shot_examples(typed_code)
+    if examples:
+        print(f"Few-shot examples: {', '.join(example['name'] for example in examples)}")
+    examples_text = f"\n\n{format_examples(examples)}" if examples else ""
+
+    if template_whyml:
+        # The LLM only adds specifications and invariants to the template output
+        system_msg = SystemMessage(content=TEMPLATE_SPEC_PROMPT + examples_text)
+        human_msg = HumanMessage(content=f"Python function:\n{typed_code}\n\nWhyML module:\n{template_whyml}")
+    else:
+        # Create system message for WhyML conversion
+        system_msg = SystemMessage(content=WHYML_PROMPT + examples_text)
+        human_msg = HumanMessage(content=typed_code)
+
+    deadline = LLM_DEADLINES["whyml_translator"]
+    try:
+        # Stream the conversion, stopping as soon as the whole module has arrived
+        responses = request_whyml([system_msg, human_msg], deadline, best_of_n=True)
+        # Clean the responses to ensure no markdown formatting
+        candidates = list(dict.fromkeys(clean_whyml_code(response.content) for response in responses))
+        result["messages"] = [AIMessage(content=candidates[0])]
+        if len(candidates) > 1:
+            print(f"Generated {len(candidates)} distinct candidate translations.")
+            result["whyml_candidates"] = candidates
+    except TimeoutError:
+        if template_whyml:
+            print("Adding specifications timed out, using the template translation as is.")
+        else:
+            print(f"WhyML conversion timed out after {deadline} seconds!")
+            result["conversion_timeout"] = True
+            result["messages"] = [AIMessage(content="")]
+    except Exception as e:
+        if not template_whyml:
             result["messages"] = [HumanMessage(content=f"Conversion error: {str(e)}")]
 
-    # Run conversion in a thread with timeout
-    thread = threading.Thread(target=convert)
-    thread.daemon = True
-    thread.start()
-    thread.join(timeout=20)  # 20 second timeout
+    return result
 
-    if thread.is_alive():
-        print("WhyML conversion timed out after 20 seconds!")
-        result["conversion_timeout"] = True
-        result["messages"] = [HumanMessage(content="TIMEOUT: Using sample file instead")]
 
-    return result
+def preflight_error(whyml_code: str):
+    """Error found by the structural and `--type-only` checks, or None if the code passed"""
+    problems = find_structural_problems(whyml_code)
+    if problems:
+        return "Structural check failed:\n" + "\n".join(problems)
+    try:
+        result = type_check_whyml(whyml_code)
+    except (subprocess.TimeoutExpired, FileNotFoundError):
+        # Leave it to the executor to report why3 problems.
+        return None
+    if result.returncode == 0:
+        return None
+    return result.stderr or result.stdout
 
 
-def whyml_executor(state: State):
-    print("whyml_executor function called!")
+def whyml_checker(state: State):
+    """
+    Pre-flight check run before proving: local structural checks plus a
+    `why3 prove --type-only` parse/type check. Code that fails is recorded as a
+    failed attempt and sent straight back to error_corrector without starting
+    a prover. In best-of-N mode all candidates are checked in parallel and only
+    those that pass go on to the prover.
+    """
+    print("whyml_checker function called!")
 
     if state.get("conversion_timeout", False):
-        print("Using sample WhyML file due to timeout...")
-        try:
-            with open(SAMPLE_WHYML_FILE, 'r') as f:
-                whyml_code = f.read()
-            print(f"Loaded sample file: {SAMPLE_WHYML_FILE}")
-        except FileNotFoundError:
-            return {
-                "messages": [HumanMessage(content=f"Sample file '{SAMPLE_WHYML_FILE}' not found. Please create it or update the path.")],
-                "execution_success": False
-            }
+        candidates = [state["messages"][-1].content]
+        errors = [f"Timeout: no WhyML translation was produced within {LLM_DEADLINES['whyml_translator']}s"]
     else:
-        # The WhyML code was already cleaned in the previous node.
-        whyml_code = state["messages"][-1].content
+        candidates = state.get("whyml_candidates") or [state["messages"][-1].content]
+        with ThreadPoolExecutor(max_workers=len(candidates)) as pool:
+            errors = list(pool.map(in_context(preflight_error), candidates))
+
+    passed = [candidate for candidate, error in zip(candidates, errors) if error is None]
+    if passed:
+        if len(candidates) > 1:
+            print(f"{len(passed)} of {len(candidates)} candidates passed the pre-flight check.")
+        return {"messages": [], "check_passed": True, "whyml_candidates": passed if len(candidates) > 1 else []}
+
+    print("Pre-flight check failed, skipping the prover.")
+    if len(candidates) > 1:
+        print(f"None of the {len(candidates)} candidates passed.")
+    return {
+        "messages": [HumanMessage(content=f"WhyML Pre-flight Check Failed:\n{errors[0]}")],
+        "check_passed": False,
+        "execution_success": False,
+        "whyml_code": candidates[0],
+        "error_message": errors[0],
+        "whyml_candidates": [],
+        "whyml_attempts": state.get("whyml_attempts", []) + candidates,
+        "errors": state.get("errors", []) + errors,
+    }
+
+
+def proof_error(result: subprocess.CompletedProcess) -> str:
+    """Error of a failed proof: why3 reports prover verdicts on stdout and other problems on stderr"""
+    parts = [text.strip() for text in (result.stderr, result.stdout) if text and text.strip()]
+    return "\n".join(parts) or f"why3 exited with return code {result.returncode}"
+
+
+def whyml_executor(state: State):
+    print("whyml_executor function called!")
+
+    candidates = state.get("whyml_candidates") or []
+    if len(candidates) > 1:
+        return prove_candidates(state, candidates)
+
+    # The WhyML code was already cleaned in the previous node.
+    whyml_code = candidates[0] if candidates else state["messages"][-1].content
 
     #  Append and update list of steps.
     whyml_attempts = state.get("whyml_attempts", [])
@@ -102,53 +241,45 @@ def whyml_executor(state: State):
     state_update = {
         "whyml_code": whyml_code,
         "whyml_attempts": whyml_attempts,
+        "whyml_candidates": [],
     }
 
-    # Create a temporary .mlw file
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.mlw', delete=False) as f:
-        f.write(whyml_code)
-        temp_filename = f.name
-
     try:
         # Execute WhyML using why3 command
-        result = subprocess.run(['why3', 'prove', '-P', 'alt-ergo', temp_filename],
-                                capture_output=True, text=True, timeout=30)
+        # Per-goal verdicts of earlier attempts, reused for unchanged goals in split mode
+        proof_session = dict(state.get("proof_session") or {})
+        result, prover = prove_whyml(whyml_code, proof_session)
+        state_update["proof_session"] = proof_session
+        state_update["provers"] = state.get("provers", []) + [prover]
 
         output = f"WhyML Execution Result:\n"
-        if state.get("conversion_timeout", False):
-            output += f"(Using sample file: {SAMPLE_WHYML_FILE})\n"
+        if prover:
+            output += f"Prover: {prover}\n"
         output += f"Return code: {result.returncode}\n"
         output += f"stdout:\n{result.stdout}\n"
         output += f"stderr:\n{result.stderr}"
 
         # Check if execution was successful (return code 0)
         state_update["execution_success"] = (result.returncode == 0)
-        state_update["error_message"] = result.stderr if result.returncode != 0 else ""
+        if result.returncode == 0 and not differential.differential_testing:
+            remember_translation(state.get("typed_python", ""), whyml_code)
+        state_update["error_message"] = proof_error(result) if result.returncode != 0 else ""
 
         # Store error if failed
         if result.returncode != 0:
             errors = state.get("errors", [])
-            errors.append(result.stderr)
+            errors.append(state_update["error_message"])
             state_update["errors"] = errors
 
-            # Classify capability gap
-            capability_gaps = state.get("capability_gaps", [])
-            gap_type = classify_capability_gap(result.stderr)
-            capability_gaps.append(gap_type)
-            state_update["capability_gaps"] = capability_gaps
-
         response_msg = HumanMessage(content=output)
 
     except subprocess.TimeoutExpired:
-        response_msg = HumanMessage(content="WhyML execution timed out after 30 seconds")
+        response_msg = HumanMessage(content=f"WhyML execution timed out after {WHY3_TIMEOUT} seconds")
         state_update["execution_success"] = False
         state_update["error_message"] = "Timeout"
         errors = state.get("errors", [])
         errors.append("Timeout")
         state_update["errors"] = errors
-        capability_gaps = state.get("capability_gaps", [])
-        capability_gaps.append("N/A")
-        state_update["capability_gaps"] = capability_gaps
 
     except FileNotFoundError:
         response_msg = HumanMessage(content="why3 command not found. Please ensure WhyML is installed and in PATH")
@@ -157,9 +288,6 @@ def whyml_executor(state: State):
         errors = state.get("errors", [])
         errors.append("why3 not found")
         state_update["errors"] = errors
-        capability_gaps = state.get("capability_gaps", [])
-        capability_gaps.append("EKnow")
-        state_update["capability_gaps"] = capability_gaps
 
     except Exception as e:
         response_msg = HumanMessage(content=f"Error executing WhyML: {str(e)}")
@@ -168,19 +296,120 @@ def whyml_executor(state: State):
         errors = state.get("errors", [])
         errors.append(str(e))
         state_update["errors"] = errors
-        capability_gaps = state.get("capability_gaps", [])
-        capability_gaps.append("Unknown")
-        state_update["capability_gaps"] = capability_gaps
-
-    finally:
-        # Clean up temporary file
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
 
     state_update["messages"] = [response_msg]
     return state_update
 
 
+def prove_candidates(state: State, candidates: list):
+    """
+    Best-of-N: proves all candidates in parallel and keeps the first one
+    verified. Provers still running on the other candidates are not waited
+    for. If none is verified, every candidate is recorded as a failed attempt.
+    """
+    print(f"Proving {len(candidates)} candidates in parallel...")
+    proof_session = dict(state.get("proof_session") or {})
+
+    def prove(whyml_code):
+        try:
+            result, prover = prove_whyml(whyml_code, proof_session)
+            return result, prover, proof_error(result) if result.returncode != 0 else ""
+        except subprocess.TimeoutExpired:
+            return None, None, "Timeout"
+        except FileNotFoundError:
+            return None, None, "why3 not found"
+        except Exception as e:
+            return None, None, str(e)
+
+    pool = ThreadPoolExecutor(max_workers=len(candidates))
+    futures = {pool.submit(in_context(prove), code): i for i, code in enumerate(candidates)}
+    outcomes = {}
+    winner = None
+    for future in as_completed(futures):
+        i = futures[future]
+        outcomes[i] = future.result()
+        result = outcomes[i][0]
+        if result is not None and result.returncode == 0:
+            winner = i
+            break
+    pool.shutdown(wait=False, cancel_futures=True)
+
+    state_update = {
+        "whyml_candidates": [],
+        "proof_session": proof_session,
+    }
+    if winner is not None:
+        result, prover, _ = outcomes[winner]
+        print(f"Candidate {winner + 1} of {len(candidates)} verified first.")
+        if not differential.differential_testing:
+            remember_translation(state.get("typed_python", ""), candidates[winner])
+        state_update.update({
+            "whyml_code": candidates[winner],
+            "whyml_attempts": state.get("whyml_attempts", []) + [candidates[winner]],
+            "provers": state.get("provers", []) + [prover],
+            "execution_success": True,
+            "error_message": "",
+        })
+        output = f"WhyML Execution Result (candidate {winner + 1} of {len(candidates)}):\n"
+        if prover:
+            output += f"Prover: {prover}\n"
+        output += f"Return code: {result.returncode}\n"
+        output += f"stdout:\n{result.stdout}\n"
+        output += f"stderr:\n{result.stderr}"
+        state_update["messages"] = [HumanMessage(content=output)]
+        return state_update
+
+    errors = [outcomes[i][2] for i in range(len(candidates))]
+    state_update.update({
+        "whyml_code": candidates[0],
+        "whyml_attempts": state.get("whyml_attempts", []) + candidates,
+        "provers": state.get("provers", []) + [outcomes[i][1] for i in range(len(candidates))],
+        "execution_success": False,
+        "error_message": errors[0],
+        "errors": state.get("errors", []) + errors,
+    })
+    output = f"None of the {len(candidates)} candidates was verified.\n"
+    for i, error in enumerate(errors):
+        output += f"Candidate {i + 1} error:\n{error}\n"
+    state_update["messages"] = [HumanMessage(content=output)]
+    return state_update
+
+
+def differential_tester(state: State):
+    """
+    Runs the proved WhyML and the original Python on the same generated inputs.
+    A difference fails the attempt, which goes back to the corrector with the
+    mismatching inputs as its error.
+    """
+    print("differential_tester function called!")
+
+    checks = differential_test(state.get("original_python", ""), state.get("typed_python", ""),
+                               state.get("whyml_code", ""))
+    failed = [check for check in checks if check["status"] == "failed"]
+    semantic_check = {
+        "attempt": len(state.get("whyml_attempts", [])),
+        "status": "failed" if failed else "passed" if any(c["status"] == "passed" for c in checks) else "skipped",
+        "inputs": sum(check["inputs"] for check in checks),
+        "mismatches": sum(len(check["mismatches"]) for check in checks),
+        "functions": [{key: check[key] for key in ("function", "status", "inputs", "reason")} for check in checks],
+    }
+    state_update = {"semantic_checks": state.get("semantic_checks", []) + [semantic_check]}
+    output = describe_checks(checks)
+    if failed:
+        error = mismatch_report(failed)
+        state_update.update({
+            "execution_success": False,
+            "error_message": error,
+            "errors": state.get("errors", []) + [error],
+        })
+        output = f"{output}\n{error}"
+    else:
+        # Proved and, where it could be tested, computing what the Python code computes
+        remember_translation(state.get("typed_python", ""), state.get("whyml_code", ""))
+    state_update["messages"] = [HumanMessage(content=output)]
+    return state_update
+
+
 def error_corrector(state: State):
     """
     Analyzes the history of errors and prompts the LLM to fix the root cause,
@@ -213,22 +442,51 @@ def error_corrector(state: State):
     errors = state.get("errors", [])
 
     # Building a clean, formatted history string so that the errors can be properly used by the LLM to minimise hallucinations.
-    error_history_str = ""
-    for i, (attempt, error) in enumerate(zip(attempts, errors)):
-        error_history_str += f"--- ATTEMPT {i+1} ---\n"
-        error_history_str += f"CODE:\n```whyml\n{attempt.strip()}\n```\n"
-        error_history_str += f"ERROR:\n```text\n{error.strip()}\n```\n\n"
+    # Repeated attempts are collapsed and older ones shrink to diffs so the prompt stays bounded.
+    error_history_str, history_stats = build_error_history(
+        attempts, errors,
+        keep_full=ERROR_HISTORY_FULL_ATTEMPTS,
+        token_budget=ERROR_HISTORY_TOKEN_BUDGET
+    )
 
     # Use the single, more directive prompt with the full history.
     final_prompt = ERROR_ANALYSIS_PROMPT.format(
         typed_python=state.get('typed_python', ''),
         error_history=error_history_str
     )
+    # Verified translations of similar functions show idioms that Why3 accepts
+    examples = few_shot_examples(state.get('typed_python', ''))
+    if examples:
+        final_prompt += f"\n{format_examples(examples)}\n"
 
-    # Invoke the LLM.
-    response = llm.invoke([HumanMessage(content=final_prompt)])
+    # Invoke the LLM, stopping the stream once the corrected module is complete.
+    try:
+        responses = request_whyml([HumanMessage(content=final_prompt)], LLM_DEADLINES["error_corrector"],
+                                  best_of_n=candidate_corrections, priority=PRIORITY_FIX)
+    except TimeoutError as e:
+        # Empty output is flagged by the pre-flight check and counts as a failed attempt
+        print(f"Error correction timed out: {e}")
+        responses = [AIMessage(content="")]
+    response = responses[0]
     response_content = response.content
 
+    # Prompt size and token accounting for this retry
+    usage = getattr(response, "usage_metadata", None) or {}
+    prompt_stat = {
+        "retry": state.get("retry_count", 0) + 1,
+        "prompt_chars": len(final_prompt),
+        "estimated_prompt_tokens": estimate_tokens(final_prompt),
+        "input_tokens": usage.get("input_tokens"),
+        "output_tokens": usage.get("output_tokens"),
+        "examples": [example["name"] for example in examples],
+        **{f"history_{key}": value for key, value in history_stats.items()},
+    }
+    print(f"Correction prompt: {prompt_stat['prompt_chars']} chars (~{prompt_stat['estimated_prompt_tokens']} tokens), "
+          f"input tokens {prompt_stat['input_tokens']}, output tokens {prompt_stat['output_tokens']}; "
+          f"history of {history_stats['attempts']} attempts: {history_stats['full']} full, "
+          f"{history_stats['diff']} as diffs, {history_stats['duplicate']} duplicates, "
+          f"{history_stats['omitted']} omitted; {len(examples)} few-shot examples")
+
     # Extract the "thinking" part for debugging and insight.
     thinking_match = re.search(r'<thinking>(.*?)</thinking>', response_content, re.DOTALL)
     thinking_text = thinking_match.group(1).strip() if thinking_match else "No thinking block found."
@@ -237,30 +495,73 @@ def error_corrector(state: State):
     print(thinking_text)
     print("--------------------")
 
-    # Clean the response to get only the executable WhyML code.
-    corrected_whyml_code = clean_whyml_code(response_content)
-    if corrected_whyml_code.strip().startswith("ml"):
-        print("Defensive cleaning: Removed erroneous 'ml' prefix.")
-        corrected_whyml_code = corrected_whyml_code.strip()[2:].strip()
+    # Clean the responses to get only the executable WhyML code.
+    candidates = []
+    for candidate in responses:
+        # The reasoning is kept in full_responses; code blocks inside it must not be taken for the answer
+        corrected_whyml_code = clean_whyml_code(strip_thinking(candidate.content))
+        if corrected_whyml_code.strip().startswith("ml"):
+            print("Defensive cleaning: Removed erroneous 'ml' prefix.")
+            corrected_whyml_code = corrected_whyml_code.strip()[2:].strip()
+        if corrected_whyml_code not in candidates:
+            candidates.append(corrected_whyml_code)
+    if len(candidates) > 1:
+        print(f"Generated {len(candidates)} distinct candidate corrections.")
 
     # Preserve the full, detailed response from the LLM for the state.
     full_responses = state.get("full_responses", []) + [response_content]
 
     # Return the updated state for the graph.
     return {
-        "messages": [AIMessage(content=corrected_whyml_code)],
+        "messages": [AIMessage(content=candidates[0])],
+        "whyml_candidates": candidates if len(candidates) > 1 else [],
         "retry_count": state.get("retry_count", 0) + 1,
         "conversion_timeout": False,
-        "full_responses": full_responses
+        "full_responses": full_responses,
+        "prompt_stats": state.get("prompt_stats", []) + [prompt_stat]
     }
 
 
-def should_retry(state: State) -> str:
-    """Decide whether to retry or end based on execution success and retry count"""
+# Errors recorded by the pipeline itself rather than reported by Why3
+FIXED_CAPABILITY_GAPS = {"why3 not found": "EKnow"}
+
+
+def gap_classifier(state: State):
+    """
+    Classifies the errors recorded since the last classification. Runs as a
+    branch alongside error_corrector, so the corrector does not wait for it.
+    """
+    print("gap_classifier function called!")
+
+    capability_gaps = state.get("capability_gaps", [])
+    new_errors = state.get("errors", [])[len(capability_gaps):]
+    new_gaps = [FIXED_CAPABILITY_GAPS.get(error) or classify_capability_gap(error) for error in new_errors]
+    return {"capability_gaps": capability_gaps + new_gaps}
+
+
+def should_prove(state: State):
+    """Decide whether checked code goes to the prover, back to the corrector, or ends the run"""
+    if state.get("check_passed", False):
+        return "prove"
+    return should_retry(state)
+
+
+def should_test(state: State):
+    """Decide whether proved code is tested against the Python function, retried or ends the run"""
+    if state.get("execution_success", False) and differential.differential_testing:
+        return "test"
+    return should_retry(state)
+
+
+def should_retry(state: State):
+    """
+    Decide whether to retry or end based on execution success and retry count.
+    Failures are also sent to gap_classifier, which runs alongside the corrector.
+    """
     if state.get("execution_success", False):
         return "end"
     elif state.get("retry_count", 0) >= 10:  # Max 10 retries
         print("Max retries reached. Ending.")
-        return "end"
+        return "classify"
     else:
-        return "retry"
\ No newline at end of file
+        return ["retry", "classify"]
\ No newline at end of file
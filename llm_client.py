@@ -0,0 +1,251 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import AIMessage
+
+from cache import SQLiteCache, make_key
+from cassette import active_cassette
+from tracing import span, in_context
+from error_history import estimate_tokens
+from llm_scheduler import scheduler, PRIORITY_CONTINUE, is_retryable, retry_after, backoff_delay
+from config import (
+    get_llm,
+    LLM_MODEL,
+    LLM_TEMPERATURE,
+    LLM_OUTPUT_TOKENS_ESTIMATE,
+    LLM_MAX_RETRIES,
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_PATH,
+    LLM_CACHE_MAX_ENTRIES,
+    LLM_CACHE_MAX_AGE_DAYS,
+)
+
+# Responses keyed by model, temperature and the full message list
+llm_cache = SQLiteCache(LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES,
+                        max_age_days=LLM_CACHE_MAX_AGE_DAYS, enabled=LLM_CACHE_ENABLED)
+
+
+# Every LLM request runs on this one event loop, in its own daemon thread. The model's async
+# HTTP client is bound to the loop it was first used on and keeps its connections open
+# between requests, so a fresh loop per call breaks the client instead of reusing it
+_loop = None
+_loop_lock = threading.Lock()
+
+# Calls, cache hits, replays, tokens and seconds of all LLM requests since the last reset
+_usage = Counter()
+_usage_lock = threading.Lock()
+
+
+def llm_usage() -> dict:
+    """LLM request counters since the last reset_llm_usage()"""
+    with _usage_lock:
+        return dict(_usage)
+
+
+def reset_llm_usage():
+    with _usage_lock:
+        _usage.clear()
+
+
+def _count_usage(source: str, response: dict, seconds: float):
+    usage = response.get("usage_metadata") or {}
+    with _usage_lock:
+        _usage[source] += 1
+        _usage["input_tokens"] += usage.get("input_tokens") or 0
+        _usage["output_tokens"] += usage.get("output_tokens") or 0
+        _usage["seconds"] += seconds
+
+
+def set_llm_concurrency(limit: int):
+    """Change the maximum number of concurrent LLM calls"""
+    scheduler.set_concurrency(limit)
+
+
+def set_llm_cache_enabled(enabled: bool):
+    """Turn the LLM response cache on or off"""
+    llm_cache.enabled = enabled
+
+
+def llm_cache_key(messages: list, temperature: float = None) -> str:
+    """Cache and cassette key of a request, computed without creating the model"""
+    temperature = LLM_TEMPERATURE if temperature is None else temperature
+    return make_key(LLM_MODEL, temperature, [(m.type, m.content) for m in messages])
+
+
+def model_with_temperature(temperature: float = None):
+    """The shared model, or a copy of it sampling at the given temperature"""
+    llm = get_llm()
+    if temperature is None or temperature == getattr(llm, "temperature", None):
+        return llm
+    return llm.model_copy(update={"temperature": temperature})
+
+
+def message_text(message) -> str:
+    """Plain text of a message whose content is a string or a list of content blocks"""
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") if isinstance(block, dict) else str(block) for block in content)
+
+
+async def _stream(model, messages: list, stop_when=None):
+    """Streams the response, stopping early once stop_when(text so far) is true"""
+    response = None
+    stream = model.astream(messages)
+    try:
+        async for chunk in stream:
+            response = chunk if response is None else response + chunk
+            if stop_when is not None and stop_when(message_text(response)):
+                break
+    finally:
+        # Closes the HTTP stream, so nothing keeps running (or billing) in the background
+        await stream.aclose()
+    return response
+
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """The shared LLM event loop, started on first use"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True).start()
+        return _loop
+
+
+def _run(coroutine, timeout: float = None):
+    """
+    Runs a coroutine on the shared LLM event loop and waits for its result from
+    synchronous code. After timeout seconds the coroutine is cancelled, which
+    closes its stream, and TimeoutError is raised.
+    """
+    future = asyncio.run_coroutine_threadsafe(coroutine, _event_loop())
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise TimeoutError(f"LLM call cancelled after {timeout} seconds")
+
+
+def invoke_llm(messages: list, deadline: float = None, stop_when=None, temperature: float = None,
+               priority: int = PRIORITY_CONTINUE):
+    """
+    Invoke the shared language model, answering from the on-disk cache when the
+    same request was made before. Otherwise the request waits for its turn in
+    the scheduler (see llm_scheduler.py) by priority and rate limit budget,
+    and is retried with backoff after rate limits, overload and server errors.
+
+    The response is streamed. If it takes longer than deadline seconds the
+    request is cancelled and TimeoutError is raised. If stop_when is given, the
+    stream is closed as soon as stop_when(text received so far) returns True.
+    temperature overrides the model's sampling temperature for this call.
+    With an active cassette, the exchange is recorded, or replayed without
+    calling the model.
+    """
+    with span("llm", "invoke", temperature=temperature, deadline=deadline) as trace:
+        start = time.perf_counter()
+        key = llm_cache_key(messages, temperature)
+        cassette = active_cassette()
+
+        if cassette is not None and cassette.replaying:
+            response, source = cassette.play("llm", key), "replayed"
+            if "timeout" in response:
+                raise TimeoutError(f"LLM call cancelled after {response['timeout']} seconds")
+        else:
+            response, source = llm_cache.get(key), "cache_hits"
+        if response is None:
+            try:
+                chunk = _send(model_with_temperature(temperature), messages, deadline, stop_when, priority, trace)
+            except TimeoutError:
+                if cassette is not None:
+                    cassette.record("llm", key, {"timeout": deadline})
+                raise
+            response, source = {
+                "content": message_text(chunk) if chunk is not None else "",
+                "usage_metadata": getattr(chunk, "usage_metadata", None),
+                "response_metadata": getattr(chunk, "response_metadata", {}) or {},
+            }, "calls"
+            llm_cache.put(key, response)
+        if cassette is not None and not cassette.replaying:
+            cassette.record("llm", key, response)
+
+        _count_usage(source, response, time.perf_counter() - start)
+        usage = response.get("usage_metadata") or {}
+        trace.update(source=source, chars=len(response["content"]),
+                     input_tokens=usage.get("input_tokens"), output_tokens=usage.get("output_tokens"))
+        return AIMessage(content=response["content"],
+                         usage_metadata=response.get("usage_metadata"),
+                         response_metadata=response.get("response_metadata", {}))
+
+
+def _send(model, messages: list, deadline: float, stop_when, priority: int, trace: dict):
+    """
+    Streams one request through the scheduler, retrying retryable errors with
+    jittered backoff. The deadline covers the whole call: waiting for a slot,
+    every attempt and the backoffs between them. Raises TimeoutError once it
+    has passed, or when the next backoff would end after it.
+    """
+    end = None if deadline is None else time.monotonic() + deadline
+
+    def remaining():
+        return None if end is None else max(0.0, end - time.monotonic())
+
+    ticket = scheduler.ticket(priority)
+    input_tokens = sum(estimate_tokens(message_text(message)) for message in messages)
+    trace["slot_wait"] = 0.0
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            with scheduler.request(ticket, input_tokens, LLM_OUTPUT_TOKENS_ESTIMATE, timeout=remaining()) as slot:
+                trace["slot_wait"] = round(trace["slot_wait"] + slot["wait"], 6)
+                try:
+                    chunk = _run(_stream(model, messages, stop_when), timeout=remaining())
+                except TimeoutError:
+                    raise
+                except Exception as e:
+                    if attempt == LLM_MAX_RETRIES or not is_retryable(e):
+                        raise
+                    error = e
+                else:
+                    usage = getattr(chunk, "usage_metadata", None) or {}
+                    slot["input_tokens"] = usage.get("input_tokens")
+                    slot["output_tokens"] = usage.get("output_tokens")
+                    return chunk
+        except TimeoutError:
+            raise TimeoutError(f"LLM call cancelled after {deadline} seconds") from None
+        # Every request waits, not just this one, so the provider sees the load drop at once
+        delay = backoff_delay(attempt, retry_after(error))
+        scheduler.pause(delay)
+        with _usage_lock:
+            _usage["backoff_seconds"] += delay
+        if end is not None and time.monotonic() + delay >= end:
+            raise TimeoutError(f"LLM call cancelled after {deadline} seconds: "
+                               f"retrying in {delay:.1f}s would pass the deadline") from error
+        print(f"LLM request failed ({type(error).__name__}: {error}), retrying in {delay:.1f}s")
+        with _usage_lock:
+            _usage["retries"] += 1
+        trace["retries"] = attempt + 1
+
+
+def invoke_llm_candidates(messages: list, temperatures: list, deadline: float = None, stop_when=None,
+                          priority: int = PRIORITY_CONTINUE) -> list:
+    """
+    Requests one response per temperature concurrently, for best-of-N generation.
+    Returns the responses that arrived in time, in temperature order, and
+    raises TimeoutError if none did.
+    """
+    def invoke(temperature):
+        try:
+            return invoke_llm(messages, deadline=deadline, stop_when=stop_when, temperature=temperature,
+                              priority=priority)
+        except TimeoutError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=len(temperatures)) as pool:
+        responses = list(pool.map(in_context(invoke), temperatures))
+    responses = [response for response in responses if response is not None]
+    if not responses:
+        raise TimeoutError(f"All {len(temperatures)} LLM calls cancelled after {deadline} seconds")
+    return responses
@@ -0,0 +1,187 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from config import (
+    MAX_CONCURRENT_LLM_CALLS,
+    LLM_REQUESTS_PER_MINUTE,
+    LLM_INPUT_TOKENS_PER_MINUTE,
+    LLM_OUTPUT_TOKENS_PER_MINUTE,
+    LLM_BACKOFF_BASE,
+    LLM_BACKOFF_MAX,
+)
+
+# Request priorities, lowest first: corrections of files already in progress go
+# before the remaining steps of a run, which go before starting new files
+PRIORITY_FIX = 0
+PRIORITY_CONTINUE = 1
+PRIORITY_NEW = 2
+
+# HTTP statuses worth retrying: rate limited, server errors and Anthropic's "overloaded"
+RETRYABLE_STATUS = {429, 500, 502, 503, 504, 529}
+RETRYABLE_ERRORS = {"RateLimitError", "OverloadedError", "InternalServerError", "APIConnectionError", "APITimeoutError"}
+
+
+class TokenBucket:
+    """
+    Budget of per_minute units refilled continuously. Taking more than is
+    left makes the level negative, which later requests wait out.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount (at most the capacity) is available"""
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+
+class LLMScheduler:
+    """
+    Admits LLM requests one at a time in priority order (FIFO within a
+    priority) once a concurrency slot is free and the request, input token
+    and output token budgets can cover the request's estimate. After a
+    response, the estimate is replaced by the real usage. A rate limit or
+    overload pauses every request until the backoff has passed.
+    """
+
+    def __init__(self, concurrency: int, requests_per_minute: int = 0,
+                 input_tokens_per_minute: int = 0, output_tokens_per_minute: int = 0):
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._order = itertools.count()
+        self._active = 0
+        self._paused_until = 0.0
+        self.concurrency = max(1, concurrency)
+        self.set_rate_limits(requests_per_minute, input_tokens_per_minute, output_tokens_per_minute)
+
+    def set_rate_limits(self, requests_per_minute: int = 0, input_tokens_per_minute: int = 0,
+                        output_tokens_per_minute: int = 0):
+        """Per-minute budgets; 0 leaves that budget unlimited"""
+        limits = {"requests": requests_per_minute, "input_tokens": input_tokens_per_minute,
+                  "output_tokens": output_tokens_per_minute}
+        with self._cond:
+            self.buckets = {name: TokenBucket(limit) for name, limit in limits.items() if limit}
+            self._cond.notify_all()
+
+    def set_concurrency(self, limit: int):
+        with self._cond:
+            self.concurrency = max(1, limit)
+            self._cond.notify_all()
+
+    def ticket(self, priority: int) -> tuple:
+        """Place in the queue; a retried request keeps its place by reusing its ticket"""
+        return (priority, next(self._order))
+
+    def _wait_time(self, amounts: dict, now: float) -> float:
+        wait = self._paused_until - now
+        for name, bucket in self.buckets.items():
+            bucket.refill(now)
+            wait = max(wait, bucket.wait_time(amounts.get(name, 0)))
+        return wait
+
+    def acquire(self, ticket: tuple, amounts: dict, timeout: float = None) -> float:
+        """
+        Blocks until the request may be sent and takes its budget. Returns the
+        seconds waited, or raises TimeoutError after timeout seconds.
+        """
+        start = time.monotonic()
+        end = None if timeout is None else start + timeout
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if end is not None and now >= end:
+                        raise TimeoutError(f"No LLM request slot within {timeout} seconds")
+                    remaining = None if end is None else end - now
+                    if self._waiting[0] == ticket and self._active < self.concurrency:
+                        wait = self._wait_time(amounts, now)
+                        if wait <= 0:
+                            break
+                        self._cond.wait(timeout=wait if remaining is None else min(wait, remaining))
+                    else:
+                        self._cond.wait(timeout=remaining)
+            except BaseException:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiting)
+            self._active += 1
+            for name, bucket in self.buckets.items():
+                bucket.level -= amounts.get(name, 0)
+            self._cond.notify_all()
+        return time.monotonic() - start
+
+    def release(self, estimated: dict, used: dict):
+        """Frees the slot and corrects the token budgets from estimated to used amounts"""
+        with self._cond:
+            self._active -= 1
+            for name, bucket in self.buckets.items():
+                if used.get(name) is not None:
+                    bucket.level += estimated.get(name, 0) - used[name]
+            self._cond.notify_all()
+
+    def pause(self, seconds: float):
+        """Holds back every request for the given time, e.g. after a rate limit"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    @contextmanager
+    def request(self, ticket: tuple, input_tokens: int, output_tokens: int, timeout: float = None):
+        """
+        Holds a slot for one request, waiting at most timeout seconds for it. The
+        yielded dict holds the seconds waited ("wait") and takes the actual
+        "input_tokens" and "output_tokens".
+        """
+        estimated = {"requests": 1, "input_tokens": input_tokens, "output_tokens": output_tokens}
+        used = {"wait": self.acquire(ticket, estimated, timeout)}
+        try:
+            yield used
+        finally:
+            self.release(estimated, used)
+
+
+def status_code(error: Exception):
+    return getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+
+
+def is_retryable(error: Exception) -> bool:
+    """True for rate limits, overload and transient server or connection errors"""
+    return (status_code(error) in RETRYABLE_STATUS or type(error).__name__ in RETRYABLE_ERRORS
+            or "overloaded" in str(error).lower())
+
+
+def retry_after(error: Exception):
+    """Seconds the provider asked to wait (retry-after header), or None"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, requested: float = None) -> float:
+    """Full-jitter exponential backoff, never shorter than what the provider asked for"""
+    delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+    if requested is not None:
+        delay = max(delay, requested + random.uniform(0, LLM_BACKOFF_BASE))
+    return delay
+
+
+# Every LLM request of the process goes through this scheduler
+scheduler = LLMScheduler(MAX_CONCURRENT_LLM_CALLS, LLM_REQUESTS_PER_MINUTE,
+                         LLM_INPUT_TOKENS_PER_MINUTE, LLM_OUTPUT_TOKENS_PER_MINUTE)
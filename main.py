@@ -1,10 +1,24 @@
+import argparse
+import os
 import sys
 from langchain_core.messages import HumanMessage
-from graph_builder import build_graph
-from utils import create_output_table
+from graph_builder import build_graph, save_graph_visualization
+from utils import create_output_table, classification_stats
+from batch import run_batch
+from graph_nodes import set_candidates
+from differential import set_differential_testing
+from example_index import set_examples
+import decomposition
+from decomposition import split_functions, run_decomposed, set_decompose_functions
+from llm_client import set_llm_concurrency, set_llm_cache_enabled, llm_cache, llm_usage
+from why3_runner import set_why3_concurrency, set_why3_workers, set_proof_cache_enabled, set_prover_portfolio, set_split_goals, proof_cache
+from tracing import start_tracing, print_trace_summary
+from results_store import record_run, set_results_store
+from checkpoints import open_checkpointer, run_config, run_status, set_fresh_runs
+from config import MAX_CONCURRENT_LLM_CALLS, MAX_CONCURRENT_WHY3, CHECKPOINTS_ENABLED, GRAPH_VISUALIZATION_PATH
 
 
-def stream_graph_updates(user_input: str, graph):
+def stream_graph_updates(user_input: str, graph, label: str = "input"):
     """
     Streams the execution of the graph, prints live updates,
     and accumulates the final state.
@@ -13,14 +27,23 @@ def stream_graph_updates(user_input: str, graph):
     print(user_input)
     print("-" * 50)
 
+    # Runs are checkpointed under a hash of the input
+    config = run_config(graph, user_input)
+    status, saved_state = run_status(graph, config)
+    if status == "finished":
+        print("This input was already processed; showing the saved result (use --fresh to run it again).")
+        create_output_table(saved_state)
+        return
+
     # Initialize a dictionary to hold the final, accumulated state
-    final_state = {}
+    final_state = saved_state
+    graph_input = {"messages": [HumanMessage(content=user_input)]}
+    if status == "resumed":
+        print("Resuming the interrupted run from its last completed step.")
+        graph_input = None
 
     # Stream the graph execution
-    for event in graph.stream(
-        {"messages": [HumanMessage(content=user_input)]},
-        stream_mode="updates"
-    ):
+    for event in graph.stream(graph_input, config, stream_mode="updates"):
         # The 'event' dictionary's key is the name of the node that just ran
         node_name = list(event.keys())[0]
         # The 'value' is the dictionary of outputs from that node
@@ -31,51 +54,186 @@ def stream_graph_updates(user_input: str, graph):
             print("Well Typed Python Output: ")
         elif node_name == "whyml_translator":
             print("WhyML Specification: ")
+        elif node_name == "whyml_checker":
+            print("WhyML Pre-flight Check: ")
         elif node_name == "whyml_executor":
             retry_count = final_state.get("retry_count", 0)
             if retry_count > 0:
                 print(f"WhyML Execution Output (Retry {retry_count}): ")
             else:
                 print("WhyML Execution Output: ")
+        elif node_name == "differential_tester":
+            print("Differential Test against the Python Code: ")
         elif node_name == "error_corrector":
             print("Error Correction - Fixed WhyML: ")
+        elif node_name == "gap_classifier":
+            print("Capability Gap Classification: ")
 
-        print(node_output["messages"][-1].content)
+        if node_name == "gap_classifier":
+            # Only the gaps of errors recorded since the last classification are new
+            print("\n".join(node_output["capability_gaps"][len(final_state.get("capability_gaps", [])):]))
+        else:
+            # The pre-flight check only adds a message when it fails
+            messages = node_output.get("messages") or []
+            print(messages[-1].content if messages else "Passed")
         print("-"*20)
 
         # Update the final state with the latest outputs
         final_state.update(node_output)
 
     # Create the final output table from the accumulated state
+    record_run(final_state, label)
     create_output_table(final_state)
+    print_run_stats()
+
+
+def run_decomposed_file(input_file_path: str, units: list, graph):
+    """Runs each function of a multi-function file as its own pipeline and saves the assembled module"""
+    rows, whyml = run_decomposed(units, graph, label=input_file_path)
+    output_path = os.path.splitext(os.path.basename(input_file_path))[0] + ".mlw"
+    with open(output_path, "w") as f:
+        f.write(whyml)
+
+    verified = sum(row["Verified"] for row in rows)
+    print(f"\n{verified}/{len(rows)} functions verified")
+    for row in rows:
+        if not row["Verified"]:
+            print(f"{row['Function']}: {row['Last Error'].strip()[:200]}")
+    print(f"Assembled WhyML saved to: {output_path}")
+    print_run_stats()
+
+
+def print_run_stats():
+    stats = classification_stats()
+    classified = sum(stats.values())
+    if classified:
+        local = stats.get("rule", 0)
+        print(f"Capability gaps: {local}/{classified} classified by local rules ({local / classified:.0%}), "
+              f"{stats.get('llm', 0)} by LLM, {classified - local - stats.get('llm', 0)} by fallback")
+    usage = llm_usage()
+    if usage.get("retries"):
+        print(f"LLM retries: {usage['retries']} after rate limits, overload or server errors "
+              f"({usage['backoff_seconds']:.1f}s of backoff)")
+    if llm_cache.enabled:
+        stats = llm_cache.stats()
+        print(f"LLM cache: {stats['hits']} hits, {stats['misses']} misses (hit rate {stats['hit_rate']:.0%})")
+    if proof_cache.enabled:
+        stats = proof_cache.stats()
+        print(f"Proof cache: {stats['hits']} hits, {stats['misses']} misses (hit rate {stats['hit_rate']:.0%})")
+    print_trace_summary()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert Python functions into verified WhyML.")
+    parser.add_argument("input_file", nargs="?", help="path to a Python file")
+    parser.add_argument("--batch", metavar="DIR|GLOB",
+                        help="process every Python file in a directory or matching a glob concurrently")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="maximum number of files processed at once in batch mode (default: all)")
+    parser.add_argument("--llm-concurrency", type=int, default=MAX_CONCURRENT_LLM_CALLS,
+                        help="maximum number of LLM calls in flight")
+    parser.add_argument("--why3-concurrency", type=int, default=MAX_CONCURRENT_WHY3,
+                        help="maximum number of why3 processes running at once")
+    parser.add_argument("--why3-workers", type=int, metavar="N",
+                        help="why3 processes kept started and waiting per command (default: 2, 0 to start on demand)")
+    parser.add_argument("--portfolio", metavar="PROVERS",
+                        help="comma-separated provers to run in parallel, keeping the first that proves every goal")
+    parser.add_argument("--split-goals", action="store_true",
+                        help="split each module into its verification conditions and prove them in parallel")
+    parser.add_argument("--candidates", type=int, metavar="N",
+                        help="request N candidate translations at once and keep the first one verified")
+    parser.add_argument("--candidate-corrections", action="store_true",
+                        help="with --candidates, also request N candidates for each error correction")
+    parser.add_argument("--no-differential", action="store_true",
+                        help="accept proved WhyML without running it against the Python code")
+    parser.add_argument("--no-examples", action="store_true",
+                        help="leave verified example translations out of the translation and correction prompts")
+    parser.add_argument("--no-decompose", action="store_true",
+                        help="translate a file with several functions as a single module")
+    parser.add_argument("--fresh", action="store_true",
+                        help="discard saved runs of the inputs instead of resuming them")
+    parser.add_argument("--no-checkpoint", action="store_true",
+                        help="do not save graph state, so interrupted runs cannot be resumed")
+    parser.add_argument("--trace", nargs="?", const="trace.jsonl", metavar="FILE",
+                        help="append a JSONL event per node, LLM call and why3 run to FILE (default: trace.jsonl)")
+    parser.add_argument("--profile", nargs="?", const="profiles", metavar="DIR",
+                        help="save cProfile output per node to DIR (default: profiles)")
+    parser.add_argument("--results", metavar="FILE",
+                        help="append attempts and runs to this JSONL results store (default: whyml_results.jsonl)")
+    parser.add_argument("--no-results", action="store_true",
+                        help="do not record attempts and runs in the results store")
+    parser.add_argument("--visualize", action="store_true",
+                        help="save a diagram of the graph, rendered locally with graphviz, if it changed")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="bypass the on-disk LLM response and proof result caches")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    # Build the graph
-    graph = build_graph()
+    args = parse_args()
+    set_llm_concurrency(args.llm_concurrency)
+    set_why3_concurrency(args.why3_concurrency)
+    if args.why3_workers is not None:
+        set_why3_workers(args.why3_workers)
+    if args.portfolio:
+        set_prover_portfolio([p.strip() for p in args.portfolio.split(",") if p.strip()])
+    if args.split_goals:
+        set_split_goals(True)
+    if args.candidates:
+        set_candidates(args.candidates, corrections=args.candidate_corrections)
+    if args.no_differential:
+        set_differential_testing(False)
+    if args.no_examples:
+        set_examples(False)
+    if args.no_decompose:
+        set_decompose_functions(False)
+    if args.no_cache:
+        set_llm_cache_enabled(False)
+        set_proof_cache_enabled(False)
 
-    # Attempt to save a visualization of the graph
-    try:
-        png_data = graph.get_graph().draw_mermaid_png()
-        with open("graph_visualization.png", "wb") as f:
-            f.write(png_data)
-        print("\nGraph visualization saved to 'graph_visualization.png'.")
-    except Exception as e:
-        print(f"\nCould not save graph visualization: {e}")
+    if args.trace or args.profile:
+        start_tracing(args.trace, args.profile)
+    if args.results or args.no_results:
+        set_results_store(args.results, enabled=not args.no_results)
+    if args.fresh:
+        set_fresh_runs(True)
+
+    # Build the graph, saving its state after every step unless disabled
+    checkpointer = open_checkpointer() if CHECKPOINTS_ENABLED and not args.no_checkpoint else None
+    graph = build_graph(checkpointer)
+
+    # Attempt to save a visualization of the graph, if asked for
+    if args.visualize:
+        try:
+            if save_graph_visualization(graph):
+                print(f"\nGraph visualization saved to '{GRAPH_VISUALIZATION_PATH}'.")
+            else:
+                print(f"\nGraph visualization in '{GRAPH_VISUALIZATION_PATH}' is up to date.")
+        except Exception as e:
+            print(f"\nCould not save graph visualization: {e}")
+
+    if args.batch:
+        run_batch(args.batch, graph, max_workers=args.workers)
+        print_run_stats()
+        sys.exit(0)
 
     # Process input from a file specified as a command-line argument
-    if len(sys.argv) < 2:
-        print("\nUsage: python main.py <path_to_python_file.py>")
+    if not args.input_file:
+        print("\nUsage: python main.py <path_to_python_file.py> | --batch <dir|glob>")
         sys.exit(1)
     
     try:
-        input_file_path = sys.argv[1]
+        input_file_path = args.input_file
         with open(input_file_path, 'r') as f:
             user_input = f.read()
         
         print(f"\nProcessing file: {input_file_path}")
         print("-" * 50)
-        stream_graph_updates(user_input, graph)
+        units = split_functions(user_input) if decomposition.decompose_functions else []
+        if units:
+            run_decomposed_file(input_file_path, units, graph)
+        else:
+            stream_graph_updates(user_input, graph, label=input_file_path)
     
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -87,4 +245,4 @@ if __name__ == "__main__":
         return 0.0
     return total / count"""
         print("\nRunning a default example instead...")
-        stream_graph_updates(user_input, graph)
\ No newline at end of file
+        stream_graph_updates(user_input, graph, label="default example")
\ No newline at end of file
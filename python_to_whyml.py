@@ -0,0 +1,417 @@
+import ast
+
+# Words reserved by WhyML that cannot be used as identifiers
+WHYML_KEYWORDS = {
+    "abstract", "absurd", "alias", "any", "as", "assert", "assume", "at", "axiom", "begin",
+    "break", "by", "check", "clone", "coinductive", "constant", "continue", "diverges", "do",
+    "done", "downto", "else", "end", "ensures", "epsilon", "exception", "exists", "export",
+    "false", "float", "for", "forall", "fun", "function", "ghost", "goal", "if", "import", "in",
+    "inductive", "invariant", "label", "lemma", "let", "match", "meta", "module", "mutable",
+    "not", "old", "partial", "predicate", "private", "pure", "raise", "raises", "reads", "rec",
+    "ref", "requires", "return", "returns", "scope", "so", "then", "theory", "to", "true", "try",
+    "type", "use", "val", "variant", "while", "with", "writes",
+}
+
+# Python type annotations supported by the templates, and their WhyML types
+SIMPLE_TYPES = {"int": "int", "bool": "bool"}
+
+COMPARE_OPS = {ast.Eq: "=", ast.NotEq: "<>", ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">="}
+ARITH_OPS = {ast.Add: "+", ast.Sub: "-", ast.Mult: "*"}
+DIVISION_OPS = {ast.FloorDiv: "div", ast.Mod: "mod"}
+
+
+class Unsupported(Exception):
+    """Raised when the input is outside the subset the templates can translate"""
+
+
+def whyml_identifier(name: str) -> str:
+    """WhyML identifier for a Python name: lowercase first letter, no keyword clashes"""
+    if name[0].isupper():
+        name = name.lower()
+    if name in WHYML_KEYWORDS:
+        name += "_"
+    return name
+
+
+def module_name(name: str) -> str:
+    """WhyML module name for a Python function name, e.g. binary_search -> BinarySearch"""
+    return "".join(part[:1].upper() + part[1:] for part in name.split("_") if part) or "Main"
+
+
+def whyml_type(annotation) -> str:
+    """WhyML type for a supported Python annotation"""
+    if isinstance(annotation, ast.Name) and annotation.id in SIMPLE_TYPES:
+        return SIMPLE_TYPES[annotation.id]
+    if isinstance(annotation, ast.Constant) and annotation.value is None:
+        return "unit"
+    if isinstance(annotation, ast.Subscript) and isinstance(annotation.value, ast.Name) \
+            and annotation.value.id in ("list", "List") \
+            and isinstance(annotation.slice, ast.Name) and annotation.slice.id in SIMPLE_TYPES:
+        return f"array {SIMPLE_TYPES[annotation.slice.id]}"
+    raise Unsupported(f"type {ast.unparse(annotation)}")
+
+
+def assigned_names(stmts: list) -> set:
+    """Variables assigned anywhere in the statements, including nested blocks (not list elements)"""
+    names = set()
+    for stmt in stmts:
+        for node in ast.walk(stmt):
+            if isinstance(node, (ast.Assign, ast.AugAssign, ast.AnnAssign)):
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                for target in targets:
+                    elements = target.elts if isinstance(target, (ast.Tuple, ast.List)) else [target]
+                    names.update(element.id for element in elements if isinstance(element, ast.Name))
+    return names
+
+
+class FunctionTranslator:
+    """Translates one typed Python function into a WhyML `let` definition"""
+
+    def __init__(self, node: ast.FunctionDef, signatures: dict, imports: set):
+        self.node = node
+        self.signatures = signatures
+        self.imports = imports
+        self.types = {}
+        self.declared = set()
+        self.temp_count = 0
+        self.params, self.return_type = signatures[node.name]
+        for arg, arg_type in zip(node.args.args, self.params):
+            self.types[arg.arg] = arg_type
+            self.declared.add(arg.arg)
+        self.recursive = any(isinstance(n, ast.Call) and isinstance(n.func, ast.Name) and n.func.id == node.name
+                             for n in ast.walk(node))
+        self.loops = any(isinstance(n, ast.While) for n in ast.walk(node))
+
+    def translate(self) -> str:
+        name = whyml_identifier(self.node.name)
+        params = " ".join(f"({whyml_identifier(arg.arg)}: {arg_type})"
+                          for arg, arg_type in zip(self.node.args.args, self.params)) or "()"
+        header = f"  let {'rec ' if self.recursive else ''}{name} {params} : {self.return_type}"
+        if self.recursive or self.loops:
+            header += "\n    diverges"
+
+        body = [stmt for stmt in self.node.body
+                if not (isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant))]
+        prelude = []
+        # Parameters are immutable in WhyML; shadow the ones the body assigns
+        for arg in self.node.args.args:
+            if arg.arg in assigned_names(body):
+                if self.types[arg.arg].startswith("array"):
+                    raise Unsupported(f"reassigned list parameter {arg.arg}")
+                prelude.append(f"let ref {whyml_identifier(arg.arg)} = {whyml_identifier(arg.arg)} in")
+        # Locals first assigned inside a nested block are declared up front
+        top_level = set(self.declared)
+        for stmt in body:
+            if isinstance(stmt, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+                top_level |= assigned_names([stmt])
+            else:
+                for name_ in sorted(assigned_names([stmt]) - top_level):
+                    prelude.append(self.hoist(name_, stmt))
+                    top_level.add(name_)
+
+        lines = prelude + self.block(body, top_level=True)
+        indented = "\n".join("    " + line for line in lines)
+        return f"{header}\n  =\n{indented}"
+
+    def hoist(self, name: str, scope) -> str:
+        value_type = None
+        for node in ast.walk(scope):
+            if isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name) and node.target.id == name:
+                value_type = whyml_type(node.annotation)
+            elif isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == name for t in node.targets):
+                value_type = self.expr_type(node.value)
+            if value_type:
+                break
+        defaults = {"int": "0", "bool": "false"}
+        if value_type not in defaults:
+            raise Unsupported(f"cannot declare {name}")
+        self.types[name] = value_type
+        self.declared.add(name)
+        return f"let ref {whyml_identifier(name)} = {defaults[value_type]} in"
+
+    def block(self, stmts: list, top_level: bool = False) -> list:
+        """WhyML lines for a statement sequence, joined with `;`"""
+        if not stmts:
+            return ["()"]
+        lines = []
+        for index, stmt in enumerate(stmts):
+            last = index == len(stmts) - 1
+            stmt_lines = self.stmt(stmt, final=top_level and last)
+            if stmt_lines[-1].endswith(" in"):
+                lines.extend(stmt_lines)
+                if last:
+                    lines.append("()")
+            else:
+                if not last:
+                    stmt_lines[-1] += ";"
+                lines.extend(stmt_lines)
+        return lines
+
+    def stmt(self, stmt, final: bool = False) -> list:
+        if isinstance(stmt, ast.Return):
+            if stmt.value is None:
+                return ["()"] if final else ["return"]
+            value = self.expr(stmt.value)
+            return [value] if final else [f"return {value}"]
+        if isinstance(stmt, ast.AnnAssign) and isinstance(stmt.target, ast.Name) and stmt.value is not None:
+            self.types.setdefault(stmt.target.id, whyml_type(stmt.annotation))
+            return self.assign_name(stmt.target.id, stmt.value)
+        if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1:
+            target = stmt.targets[0]
+            if isinstance(target, ast.Name):
+                return self.assign_name(target.id, stmt.value)
+            if isinstance(target, ast.Subscript):
+                return [f"{self.subscript(target)} <- {self.expr(stmt.value)}"]
+            if isinstance(target, ast.Tuple) and isinstance(stmt.value, ast.Tuple):
+                return self.tuple_assign(target, stmt.value)
+        if isinstance(stmt, ast.AugAssign):
+            current = ast.BinOp(left=stmt.target, op=stmt.op, right=stmt.value)
+            if isinstance(stmt.target, ast.Name) and stmt.target.id in self.declared:
+                return [f"{whyml_identifier(stmt.target.id)} <- {self.expr(current)}"]
+            if isinstance(stmt.target, ast.Subscript):
+                return [f"{self.subscript(stmt.target)} <- {self.expr(current)}"]
+        if isinstance(stmt, ast.If):
+            lines = [f"if {self.condition(stmt.test)} then begin"]
+            lines += ["  " + line for line in self.block(stmt.body)]
+            if stmt.orelse:
+                lines.append("end else begin")
+                lines += ["  " + line for line in self.block(stmt.orelse)]
+            lines.append("end")
+            return lines
+        if isinstance(stmt, ast.While) and not stmt.orelse:
+            lines = [f"while {self.condition(stmt.test)} do"]
+            lines += ["  " + line for line in self.block(stmt.body)]
+            return lines + ["done"]
+        if isinstance(stmt, ast.For) and not stmt.orelse and isinstance(stmt.target, ast.Name):
+            return self.for_loop(stmt)
+        if isinstance(stmt, ast.Assert):
+            return [f"assert {{ {self.condition(stmt.test)} }}"]
+        if isinstance(stmt, ast.Pass):
+            return ["()"]
+        raise Unsupported(ast.unparse(stmt).splitlines()[0])
+
+    def assign_name(self, name: str, value) -> list:
+        value_code = self.expr(value)
+        if name in self.declared:
+            return [f"{whyml_identifier(name)} <- {value_code}"]
+        value_type = self.types.get(name) or self.expr_type(value)
+        if value_type is None or value_type.startswith("array"):
+            raise Unsupported(f"local {name}")
+        self.types[name] = value_type
+        self.declared.add(name)
+        return [f"let ref {whyml_identifier(name)} = {value_code} in"]
+
+    def tuple_assign(self, target: ast.Tuple, value: ast.Tuple) -> list:
+        if len(target.elts) != len(value.elts):
+            raise Unsupported("tuple assignment")
+        # arr[i], arr[j] = arr[j], arr[i]
+        if len(target.elts) == 2 and all(isinstance(e, ast.Subscript) for e in target.elts + value.elts):
+            (a, b), (c, d) = target.elts, value.elts
+            same = ast.unparse(a) == ast.unparse(d) and ast.unparse(b) == ast.unparse(c)
+            if same and isinstance(a.value, ast.Name) and isinstance(b.value, ast.Name) and a.value.id == b.value.id:
+                self.imports.add("array.ArraySwap")
+                return [f"swap {whyml_identifier(a.value.id)} {self.expr(a.slice)} {self.expr(b.slice)}"]
+        # Simultaneous assignment: evaluate every value before assigning
+        if not all(isinstance(e, ast.Name) and e.id in self.declared for e in target.elts):
+            raise Unsupported("tuple assignment")
+        temps = []
+        lines = ["begin"]
+        for element in value.elts:
+            self.temp_count += 1
+            temp = f"tmp{self.temp_count}"
+            temps.append(temp)
+            lines.append(f"  let {temp} = {self.expr(element)} in")
+        lines += [f"  {whyml_identifier(e.id)} <- {temp};" for e, temp in zip(target.elts, temps)]
+        lines[-1] = lines[-1].rstrip(";")
+        return lines + ["end"]
+
+    def for_loop(self, stmt: ast.For) -> list:
+        name = stmt.target.id
+        if name in assigned_names(stmt.body):
+            raise Unsupported(f"loop variable {name} reassigned")
+        if name in self.declared:
+            # Python leaves the last element in the variable; the WhyML loop index is a new binding
+            raise Unsupported(f"loop variable {name} shadows a local")
+        iterator = stmt.iter
+        prefix = []
+        if isinstance(iterator, ast.Call) and isinstance(iterator.func, ast.Name) and iterator.func.id == "range" \
+                and 1 <= len(iterator.args) <= 2 and not iterator.keywords:
+            start = self.expr(iterator.args[0]) if len(iterator.args) == 2 else "0"
+            stop = self.expr(iterator.args[-1])
+            index = whyml_identifier(name)
+            self.types[name] = "int"
+        elif isinstance(iterator, ast.Name) and self.types.get(iterator.id, "").startswith("array"):
+            # for x in arr  ->  for i = 0 to length arr - 1 do let x = arr[i] in ...
+            self.imports.add("array.Array")
+            array = whyml_identifier(iterator.id)
+            index = f"i_{whyml_identifier(name)}"
+            start, stop = "0", f"length {array}"
+            self.types[name] = self.types[iterator.id].split()[-1]
+            prefix = [f"  let {whyml_identifier(name)} = {array}[{index}] in"]
+        else:
+            raise Unsupported(f"loop over {ast.unparse(iterator)}")
+
+        self.declared.add(name)
+        lines = [f"for {index} = {start} to {stop} - 1 do"] + prefix
+        lines += ["  " + line for line in self.block(stmt.body)]
+        # Out of scope after the loop, so code reading it afterwards falls back to the LLM
+        self.declared.discard(name)
+        del self.types[name]
+        return lines + ["done"]
+
+    def condition(self, test) -> str:
+        if self.expr_type(test) != "bool":
+            raise Unsupported(f"non-boolean condition {ast.unparse(test)}")
+        return self.expr(test)
+
+    def subscript(self, node: ast.Subscript) -> str:
+        if isinstance(node.slice, ast.Slice):
+            raise Unsupported("slicing")
+        self.imports.add("array.Array")
+        return f"{self.expr(node.value)}[{self.expr(node.slice)}]"
+
+    def expr_type(self, e):
+        """WhyML type of a Python expression (int, bool, array ...), or None if unknown"""
+        if isinstance(e, ast.Constant):
+            if isinstance(e.value, bool):
+                return "bool"
+            return "int" if isinstance(e.value, int) else None
+        if isinstance(e, ast.Name):
+            return self.types.get(e.id)
+        if isinstance(e, (ast.Compare, ast.BoolOp)) or (isinstance(e, ast.UnaryOp) and isinstance(e.op, ast.Not)):
+            return "bool"
+        if isinstance(e, (ast.BinOp, ast.UnaryOp)):
+            return "int"
+        if isinstance(e, ast.Subscript):
+            value_type = self.expr_type(e.value)
+            return value_type.split()[-1] if value_type and value_type.startswith("array") else None
+        if isinstance(e, ast.Call) and isinstance(e.func, ast.Name):
+            if e.func.id in ("len", "abs", "min", "max"):
+                return "int"
+            if e.func.id in self.signatures:
+                return self.signatures[e.func.id][1]
+        if isinstance(e, ast.IfExp):
+            return self.expr_type(e.body)
+        return None
+
+    def expr(self, e) -> str:
+        if isinstance(e, ast.Constant):
+            if isinstance(e.value, bool):
+                return "true" if e.value else "false"
+            if isinstance(e.value, int):
+                return str(e.value) if e.value >= 0 else f"({e.value})"
+        elif isinstance(e, ast.Name):
+            if e.id in self.types:
+                return whyml_identifier(e.id)
+        elif isinstance(e, ast.BinOp):
+            left, right = self.expr(e.left), self.expr(e.right)
+            if self.expr_type(e.left) != "int" or self.expr_type(e.right) != "int":
+                raise Unsupported(f"non-integer arithmetic {ast.unparse(e)}")
+            if type(e.op) in ARITH_OPS:
+                return f"({left} {ARITH_OPS[type(e.op)]} {right})"
+            if type(e.op) in DIVISION_OPS:
+                # Python floors; Euclidean division only agrees for positive divisors
+                if not (isinstance(e.right, ast.Constant) and type(e.right.value) is int and e.right.value > 0):
+                    raise Unsupported(f"division by a possibly negative divisor {ast.unparse(e)}")
+                self.imports.add("int.EuclideanDivision")
+                return f"({DIVISION_OPS[type(e.op)]} {left} {right})"
+        elif isinstance(e, ast.UnaryOp):
+            operand = self.expr(e.operand)
+            if isinstance(e.op, ast.USub) and self.expr_type(e.operand) == "int":
+                return f"(- {operand})"
+            if isinstance(e.op, ast.Not) and self.expr_type(e.operand) == "bool":
+                return f"(not {operand})"
+        elif isinstance(e, ast.BoolOp):
+            if all(self.expr_type(value) == "bool" for value in e.values):
+                op = " && " if isinstance(e.op, ast.And) else " || "
+                return "(" + op.join(self.expr(value) for value in e.values) + ")"
+        elif isinstance(e, ast.Compare):
+            parts = []
+            left = e.left
+            for op, right in zip(e.ops, e.comparators):
+                if type(op) not in COMPARE_OPS or self.expr_type(left) != "int" or self.expr_type(right) != "int":
+                    raise Unsupported(f"comparison {ast.unparse(e)}")
+                parts.append(f"{self.expr(left)} {COMPARE_OPS[type(op)]} {self.expr(right)}")
+                left = right
+            return "(" + " && ".join(parts) + ")"
+        elif isinstance(e, ast.Subscript):
+            return self.subscript(e)
+        elif isinstance(e, ast.IfExp):
+            return f"(if {self.condition(e.test)} then {self.expr(e.body)} else {self.expr(e.orelse)})"
+        elif isinstance(e, ast.Call) and isinstance(e.func, ast.Name) and not e.keywords:
+            return self.call(e)
+        raise Unsupported(ast.unparse(e))
+
+    def call(self, e: ast.Call) -> str:
+        name = e.func.id
+        args = [self.expr(arg) for arg in e.args]
+        if name == "len" and len(args) == 1:
+            self.imports.add("array.Array")
+            return f"(length {args[0]})"
+        if name == "abs" and len(args) == 1:
+            self.imports.add("int.Abs")
+            return f"(abs {args[0]})"
+        if name in ("min", "max") and len(args) == 2:
+            self.imports.add("int.MinMax")
+            return f"({name} {args[0]} {args[1]})"
+        if name in self.signatures and len(args) == len(self.signatures[name][0]):
+            return f"({whyml_identifier(name)} {' '.join(args) or '()'})"
+        raise Unsupported(f"call to {name}")
+
+
+def translate_to_whyml(source: str):
+    """
+    Translates typed Python in the supported subset (int/bool/list parameters,
+    integer arithmetic, while/for-range loops, recursion, early returns) into a
+    WhyML module without specifications. Returns None when the input is outside
+    the subset, so the caller can fall back to the LLM.
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return None
+
+    functions = []
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef):
+            functions.append(node)
+        elif not isinstance(node, (ast.Import, ast.ImportFrom)) and \
+                not (isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant)):
+            return None
+    if not functions:
+        return None
+
+    try:
+        signatures = {}
+        for node in functions:
+            args = node.args
+            if args.vararg or args.kwarg or args.kwonlyargs or args.defaults or node.decorator_list:
+                raise Unsupported("signature")
+            if any(arg.annotation is None for arg in args.args):
+                raise Unsupported("missing annotation")
+            returns = whyml_type(node.returns) if node.returns is not None else "unit"
+            if returns.startswith("array"):
+                raise Unsupported("list return type")
+            signatures[node.name] = ([whyml_type(arg.annotation) for arg in args.args], returns)
+
+        # WhyML needs callees defined before callers (mutual recursion is not supported)
+        defined = set()
+        for node in functions:
+            for call in ast.walk(node):
+                if isinstance(call, ast.Call) and isinstance(call.func, ast.Name) \
+                        and call.func.id in signatures and call.func.id != node.name and call.func.id not in defined:
+                    raise Unsupported("call to a later function")
+            defined.add(node.name)
+
+        imports = {"int.Int"}
+        definitions = [FunctionTranslator(node, signatures, imports).translate() for node in functions]
+    except Unsupported:
+        return None
+
+    if any(t.startswith("array") for params, _ in signatures.values() for t in params):
+        imports.add("array.Array")
+
+    order = ["int.Int", "int.Abs", "int.MinMax", "int.EuclideanDivision", "array.Array", "array.ArraySwap"]
+    uses = "\n".join(f"  use {name}" for name in order if name in imports)
+    body = "\n\n".join(definitions)
+    return f"module {module_name(functions[0].name)}\n\n{uses}\n\n{body}\n\nend"
@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import threading
+import time
+from functools import wraps
+
+import differential
+from cache import make_key
+from error_history import error_signature
+from config import RESULTS_ENABLED, RESULTS_PATH
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; the thread lock still serialises this process
+    fcntl = None
+
+# Serialises writers within this process; flock serialises processes sharing the file
+_write_lock = threading.Lock()
+
+# Whether nodes append their attempts to the store, and where
+results_enabled = RESULTS_ENABLED
+results_path = RESULTS_PATH
+
+
+def set_results_store(path: str = None, enabled: bool = True):
+    """Change the results file, or turn recording off"""
+    global results_enabled, results_path
+    results_enabled = enabled
+    if path:
+        results_path = path
+
+
+def input_id(source: str) -> str:
+    """Stable id of an input, the same for every run on it"""
+    return make_key("run", source)[:16]
+
+
+def append_results(rows: list, path: str = None):
+    """
+    Appends rows to the JSONL store in a single write under an exclusive lock,
+    so concurrent threads and processes never interleave lines.
+    """
+    if not rows:
+        return
+    path = path or results_path
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    data = "".join(json.dumps(row, default=str) + "\n" for row in rows)
+    with _write_lock, open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.write(data)
+            f.flush()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def attempt_rows(name: str, state: dict, update: dict, before: dict, seconds: float) -> list:
+    """
+    Long-format rows for what a node added to the state: one "attempt" row per
+    new WhyML attempt, one "semantic_check" row per differential test and one
+    "capability_gap" row per new classification.
+    A proved attempt is "proved" while a differential test is still to decide
+    it (see attempt_statuses), and "verified" when differential testing is off.
+    before holds the list lengths from before the node ran.
+    """
+    proved = "proved" if differential.differential_testing else "verified"
+    base = {
+        "run_id": state.get("run_id"),
+        "input_id": input_id(state.get("original_python", "")),
+        "node": name,
+        "retry": state.get("retry_count", 0),
+        "time": time.time(),
+        "node_seconds": round(seconds, 3),
+    }
+    rows = []
+
+    attempts = (update.get("whyml_attempts") or [])[before["whyml_attempts"]:]
+    errors = (update.get("errors") or [])[before["errors"]:]
+    provers = (update.get("provers") or [])[before["provers"]:]
+    for i, code in enumerate(attempts):
+        error = errors[i] if i < len(errors) else ""
+        rows.append({
+            **base,
+            "event": "attempt",
+            "attempt": before["whyml_attempts"] + i + 1,
+            "status": "failed" if error else proved,
+            "stage": "check" if name == "whyml_checker" else "proof",
+            "prover": provers[i] if i < len(provers) else None,
+            "error": error,
+            "error_signature": error_signature(error) if error else "",
+            "whyml": code,
+        })
+
+    for check in (update.get("semantic_checks") or [])[before["semantic_checks"]:]:
+        error = errors[0] if check["status"] == "failed" and errors else ""
+        rows.append({
+            **base,
+            "event": "semantic_check",
+            "attempt": check["attempt"],
+            "status": check["status"],
+            "inputs": check["inputs"],
+            "mismatches": check["mismatches"],
+            "error": error,
+            "error_signature": error_signature(error) if error else "",
+        })
+
+    gaps = (update.get("capability_gaps") or [])[before["capability_gaps"]:]
+    for i, gap in enumerate(gaps):
+        rows.append({
+            **base,
+            "event": "capability_gap",
+            "attempt": before["capability_gaps"] + i + 1,
+            "capability_gap": gap,
+        })
+    return rows
+
+
+def recorded_node(name: str, node):
+    """Wraps a graph node so the attempts and classifications it adds are appended to the store"""
+    @wraps(node)
+    def wrapper(state):
+        if not results_enabled:
+            return node(state)
+        # Lengths are taken first: some nodes append to the state's lists in place
+        before = {key: len(state.get(key) or []) for key in ("whyml_attempts", "errors", "provers",
+                                                             "semantic_checks", "capability_gaps")}
+        start = time.perf_counter()
+        update = node(state)
+        append_results(attempt_rows(name, state, update, before, time.perf_counter() - start))
+        return update
+    return wrapper
+
+
+def record_run(final_state: dict, label: str):
+    """Appends the "run" row summarising a finished run of the input called label"""
+    if not results_enabled or not final_state:
+        return
+    append_results([{
+        "event": "run",
+        "run_id": final_state.get("run_id"),
+        "input_id": input_id(final_state.get("original_python", "")),
+        "input": label,
+        "time": time.time(),
+        "verified": final_state.get("execution_success", False),
+        "attempts": len(final_state.get("whyml_attempts", [])),
+        "retries": final_state.get("retry_count", 0),
+        "winning_prover": (final_state.get("provers") or [None])[-1] if final_state.get("execution_success") else None,
+        "final_whyml": final_state.get("whyml_code", ""),
+    }])
+
+
+def load_results(path: str = None):
+    """The store as a pandas DataFrame (pandas is only needed for reporting)"""
+    import pandas as pd
+
+    path = path or results_path
+    with open(path, "r") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return pd.DataFrame(rows)
+
+
+def attempt_statuses(df):
+    """
+    The attempt rows with the final status of each attempt: a "proved" attempt
+    becomes "failed" if its differential test found a mismatch and "verified"
+    if the test passed or was skipped. Attempts whose test never ran stay "proved".
+    """
+    attempts = df[df["event"] == "attempt"].copy()
+    if "status" not in attempts or not (attempts["status"] == "proved").any():
+        return attempts
+    checks = df[df["event"] == "semantic_check"]
+    outcome = {(run_id, attempt): "failed" if status == "failed" else "verified"
+               for run_id, attempt, status in zip(checks["run_id"], checks["attempt"], checks["status"])}
+    attempts["status"] = [outcome.get((run_id, attempt), status) if status == "proved" else status
+                          for run_id, attempt, status in zip(attempts["run_id"], attempts["attempt"],
+                                                             attempts["status"])]
+    return attempts
+
+
+def print_summary(path: str = None, top: int = 10):
+    """Success rate, attempts per run, capability gaps and the most common errors in the store"""
+    df = load_results(path)
+    runs = df[df["event"] == "run"] if "event" in df else df.iloc[0:0]
+    attempts = attempt_statuses(df) if "event" in df else df.iloc[0:0]
+    gaps = df[df["event"] == "capability_gap"] if "event" in df else df.iloc[0:0]
+    semantic = df[df["event"] == "semantic_check"] if "event" in df else df.iloc[0:0]
+
+    print("=" * 120)
+    print(f"RESULTS SUMMARY ({path or results_path})")
+    print("=" * 120)
+    if not runs.empty:
+        latest = runs.sort_values("time").groupby("input_id").tail(1)
+        print(f"Runs: {len(runs)} over {len(latest)} inputs; "
+              f"latest run verified for {int(latest['verified'].sum())}/{len(latest)} inputs")
+        print(f"Attempts per run: mean {runs['attempts'].mean():.1f}, max {int(runs['attempts'].max())}")
+    if not attempts.empty:
+        print(f"Attempts: {len(attempts)}, of which {int((attempts['status'] == 'failed').sum())} failed "
+              f"({int(((attempts['status'] == 'failed') & (attempts['stage'] == 'check')).sum())} in the pre-flight check)")
+        failed = attempts[attempts["status"] == "failed"]
+        if not failed.empty:
+            print("\nMost common errors:")
+            print(failed["error_signature"].value_counts().head(top).to_string())
+    if not semantic.empty:
+        print(f"Differential tests: {len(semantic)}, of which {int((semantic['status'] == 'failed').sum())} "
+              f"found proved code computing different results from the Python code")
+    if not gaps.empty:
+        print("\nCapability gaps:")
+        print(gaps["capability_gap"].str.split().str[0].value_counts().to_string())
+    print("=" * 120)
+
+
+def print_query(path: str = None, input_text: str = None, status: str = None, limit: int = 50):
+    """Prints attempt rows, optionally only for inputs whose label contains input_text and/or with a status"""
+    import pandas as pd
+
+    df = load_results(path)
+    attempts = attempt_statuses(df)
+    if input_text:
+        runs = df[(df["event"] == "run") & df["input"].fillna("").str.contains(input_text, regex=False)]
+        attempts = attempts[attempts["input_id"].isin(runs["input_id"])]
+    if status:
+        attempts = attempts[attempts["status"] == status]
+
+    pd.set_option('display.max_colwidth', 60)
+    pd.set_option('display.width', None)
+    columns = ["run_id", "attempt", "node", "retry", "status", "stage", "prover", "error_signature"]
+    print(attempts[columns].tail(limit).to_string(index=False))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Query the append-only WhyML results store.")
+    parser.add_argument("--path", default=RESULTS_PATH, help=f"results file (default: {RESULTS_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    summary = commands.add_parser("summary", help="success rate, attempts, capability gaps and common errors")
+    summary.add_argument("--top", type=int, default=10, help="number of common errors to show")
+    query = commands.add_parser("query", help="list attempts")
+    query.add_argument("--input", help="only inputs whose file name contains this text")
+    query.add_argument("--status", choices=["failed", "proved", "verified"],
+                       help="only attempts with this final status (proved: not yet differentially tested)")
+    query.add_argument("--limit", type=int, default=50, help="show at most this many of the latest attempts")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "summary":
+        print_summary(args.path, top=args.top)
+    else:
+        print_query(args.path, input_text=args.input, status=args.status, limit=args.limit)
@@ -0,0 +1,343 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from langchain_core.messages import HumanMessage
+
+from graph_builder import build_graph
+import decomposition
+from decomposition import split_functions, run_decomposed
+from checkpoints import open_checkpointer, run_config, run_status, run_lock, set_fresh_runs
+from results_store import record_run
+from llm_client import set_llm_concurrency
+from why3_runner import set_why3_concurrency
+from config import (
+    SERVER_HOST,
+    SERVER_PORT,
+    SERVER_WORKERS,
+    SERVER_QUEUE_SIZE,
+    SERVER_MAX_JOBS,
+    MAX_CONCURRENT_LLM_CALLS,
+    MAX_CONCURRENT_WHY3,
+    CHECKPOINTS_ENABLED,
+)
+
+def node_event(node_name: str, node_output: dict, state: dict) -> dict:
+    """Event for one node update, with the text stream_graph_updates prints for it"""
+    if node_name == "gap_classifier":
+        # Only the gaps of errors recorded since the last classification are new
+        text = "\n".join(node_output["capability_gaps"][len(state.get("capability_gaps", [])):])
+    else:
+        messages = node_output.get("messages") or []
+        text = messages[-1].content if messages else "Passed"
+    return {"event": "node", "node": node_name, "retry": state.get("retry_count", 0), "output": text}
+
+
+def state_result(state: dict) -> dict:
+    """JSON summary of a finished run"""
+    errors = state.get("errors", [])
+    provers = state.get("provers") or [None]
+    return {
+        "verified": state.get("execution_success", False),
+        "attempts": len(state.get("whyml_attempts", [])),
+        "retries": state.get("retry_count", 0),
+        "winning_prover": provers[-1] if state.get("execution_success") else None,
+        "last_error": errors[-1] if errors else "",
+        "whyml": state.get("whyml_code", ""),
+    }
+
+
+def convert(graph, source: str, label: str, publish) -> dict:
+    """
+    Runs one conversion to completion on the calling thread, passing every
+    node update to publish(event). Updates of multi-function sources name the
+    function they belong to. Returns the result summary.
+    """
+    units = split_functions(source) if decomposition.decompose_functions else []
+    if units:
+        def publish_update(function, node_name, node_output, state):
+            publish({**node_event(node_name, node_output, state), "function": function})
+
+        rows, whyml = run_decomposed(units, graph, label=label, on_update=publish_update)
+        for row in rows:
+            publish({"event": "function", "function": row["Function"], "run": row["Run"],
+                     "verified": row["Verified"], "attempts": row["Number of Tries"],
+                     "last_error": row["Last Error"]})
+        return {
+            "verified": all(row["Verified"] for row in rows),
+            "attempts": sum(row["Number of Tries"] for row in rows),
+            "functions": {row["Function"]: row["Verified"] for row in rows},
+            "whyml": whyml,
+        }
+
+    # Jobs on the same source share a checkpoint, so they run one after another
+    with run_lock(source):
+        config = run_config(graph, source)
+        status, state = run_status(graph, config)
+        publish({"event": "run", "run": status})
+        if status == "finished":
+            return state_result(state)
+        graph_input = None if status == "resumed" else {"messages": [HumanMessage(content=source)]}
+        for update in graph.stream(graph_input, config, stream_mode="updates"):
+            for node_name, node_output in update.items():
+                publish(node_event(node_name, node_output, state))
+                state.update(node_output)
+        record_run(state, label)
+        return state_result(state)
+
+
+class Job:
+    """One submitted conversion and the events it has produced so far"""
+
+    def __init__(self, source: str, label: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.source = source
+        self.label = label
+        self.status = "queued"
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.events = []
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def publish(self, event: dict):
+        """Adds an event and wakes the clients streaming this job (event loop thread only)"""
+        self.events.append({"job": self.id, "time": round(time.time(), 3), **event})
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    @property
+    def changed(self) -> asyncio.Event:
+        """Event set by the next publish"""
+        return self._changed
+
+    def summary(self) -> dict:
+        return {
+            "job": self.id,
+            "label": self.label,
+            "status": self.status,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "events": len(self.events),
+            "result": self.result,
+        }
+
+
+class JobServer:
+    """
+    Conversions submitted over HTTP are queued and run by a fixed number of
+    workers on a graph compiled once. A full queue rejects new jobs with
+    503, so clients back off instead of piling up work.
+    """
+
+    def __init__(self, graph, workers: int = SERVER_WORKERS, queue_size: int = SERVER_QUEUE_SIZE,
+                 max_jobs: int = SERVER_MAX_JOBS):
+        self.graph = graph
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.jobs = OrderedDict()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+
+    def submit(self, source: str, label: str):
+        """Queues a job, or returns None if the queue is full"""
+        job = Job(source, label)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            return None
+        self.jobs[job.id] = job
+        job.publish({"event": "queued", "position": self.queue.qsize()})
+        self._forget_old_jobs()
+        return job
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(0, len(self.jobs) - self.max_jobs)]:
+            del self.jobs[job_id]
+
+    async def work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            job.status = "running"
+            job.started = time.time()
+            job.publish({"event": "started"})
+
+            def publish(event, job=job):
+                loop.call_soon_threadsafe(job.publish, event)
+
+            try:
+                job.result = await loop.run_in_executor(self.executor, convert, self.graph,
+                                                        job.source, job.label, publish)
+                job.status = "done"
+                event = {"event": "done", "result": job.result}
+            except Exception as e:
+                job.status = "failed"
+                event = {"event": "failed", "error": f"{type(e).__name__}: {e}"}
+            job.finished = time.time()
+            # Node updates were scheduled from the worker thread before its result, so they come first
+            job.publish(event)
+            self.queue.task_done()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            method, path, body = await read_request(reader)
+            await self.route(method, path, body, writer)
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            await send_json(writer, 400, {"error": str(e) or "bad request"})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method: str, path: str, body: bytes, writer):
+        parts = [part for part in urlsplit(path).path.split("/") if part]
+        if method == "GET" and parts == ["health"]:
+            await send_json(writer, 200, {"status": "ok", "queued": self.queue.qsize(),
+                                          "running": sum(job.status == "running" for job in self.jobs.values()),
+                                          "workers": self.workers})
+        elif method == "POST" and parts == ["jobs"]:
+            await self.post_job(body, writer)
+        elif method == "GET" and parts == ["jobs"]:
+            await send_json(writer, 200, [job.summary() for job in self.jobs.values()])
+        elif method == "GET" and len(parts) == 2 and parts[0] == "jobs" and parts[1] in self.jobs:
+            await send_json(writer, 200, self.jobs[parts[1]].summary())
+        elif method == "GET" and len(parts) == 3 and parts[0] == "jobs" and parts[1] in self.jobs \
+                and parts[2] == "events":
+            await self.stream_events(self.jobs[parts[1]], writer)
+        else:
+            await send_json(writer, 404, {"error": f"no route for {method} {path}"})
+
+    async def post_job(self, body: bytes, writer):
+        """Accepts {"source": ..., "label": ...} as JSON, or the Python source as the raw body"""
+        text = body.decode("utf-8")
+        try:
+            payload = json.loads(text)
+        except json.JSONDecodeError:
+            payload = {"source": text}
+        if not isinstance(payload, dict) or not str(payload.get("source", "")).strip():
+            await send_json(writer, 400, {"error": "no Python source in the request"})
+            return
+        job = self.submit(payload["source"], payload.get("label") or "job")
+        if job is None:
+            await send_json(writer, 503, {"error": "job queue is full, retry later"},
+                            headers={"Retry-After": "5"})
+            return
+        await send_json(writer, 202, job.summary(), headers={"Location": f"/jobs/{job.id}"})
+
+    async def stream_events(self, job: Job, writer):
+        """Sends the job's events as NDJSON, past ones first, until the job has finished"""
+        writer.write(response_head(200, "application/x-ndjson"))
+        sent = 0
+        while True:
+            changed = job.changed
+            while sent < len(job.events):
+                writer.write((json.dumps(job.events[sent], default=str) + "\n").encode())
+                sent += 1
+            await writer.drain()
+            if job.done and sent == len(job.events):
+                return
+            await changed.wait()
+
+    async def serve(self, host: str = SERVER_HOST, port: int = SERVER_PORT, socket_path: str = None):
+        workers = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+        if socket_path:
+            server = await asyncio.start_unix_server(self.handle, path=socket_path)
+            print(f"Serving on unix socket {socket_path}")
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            print(f"Serving on http://{host}:{port}")
+        print(f"{self.workers} workers, queue of {self.queue.maxsize} jobs")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def read_request(reader: asyncio.StreamReader) -> tuple:
+    """(method, path, body) of one HTTP/1.1 request"""
+    request_line = (await reader.readline()).decode("latin-1").strip()
+    if not request_line:
+        raise ValueError("empty request")
+    method, path, _ = request_line.split(" ", 2)
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path, body
+
+
+STATUS_TEXT = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 503: "Service Unavailable"}
+
+
+def response_head(status: int, content_type: str, length: int = None, headers: dict = None) -> bytes:
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT[status]}", f"Content-Type: {content_type}", "Connection: close"]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def send_json(writer, status: int, payload, headers: dict = None):
+    body = (json.dumps(payload, default=str) + "\n").encode()
+    writer.write(response_head(status, "application/json", len(body), headers) + body)
+    await writer.drain()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve Python to WhyML conversions over HTTP.")
+    parser.add_argument("--host", default=SERVER_HOST, help=f"address to listen on (default: {SERVER_HOST})")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help=f"port to listen on (default: {SERVER_PORT})")
+    parser.add_argument("--socket", metavar="PATH", help="listen on a unix socket instead of a TCP port")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS,
+                        help=f"conversions run at once (default: {SERVER_WORKERS})")
+    parser.add_argument("--queue-size", type=int, default=SERVER_QUEUE_SIZE,
+                        help=f"jobs waiting before new ones are rejected (default: {SERVER_QUEUE_SIZE})")
+    parser.add_argument("--llm-concurrency", type=int, default=MAX_CONCURRENT_LLM_CALLS,
+                        help="maximum number of LLM calls in flight")
+    parser.add_argument("--why3-concurrency", type=int, default=MAX_CONCURRENT_WHY3,
+                        help="maximum number of why3 processes running at once")
+    parser.add_argument("--fresh", action="store_true",
+                        help="discard saved runs of submitted inputs instead of reusing them")
+    parser.add_argument("--no-checkpoint", action="store_true",
+                        help="do not save graph state, so interrupted runs cannot be resumed")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    set_llm_concurrency(args.llm_concurrency)
+    set_why3_concurrency(args.why3_concurrency)
+    if args.fresh:
+        set_fresh_runs(True)
+
+    # The graph is compiled once and shared by every job
+    checkpointer = open_checkpointer() if CHECKPOINTS_ENABLED and not args.no_checkpoint else None
+    job_server = JobServer(build_graph(checkpointer), workers=max(1, args.workers),
+                           queue_size=max(1, args.queue_size))
+    if args.socket and os.path.exists(args.socket):
+        os.remove(args.socket)
+    try:
+        asyncio.run(job_server.serve(args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        print("\nServer stopped.")
@@ -3,14 +3,21 @@ from langgraph.graph.message import add_messages
 
 class State(TypedDict):
     messages: Annotated[list, add_messages]
+    run_id: str = ""
     conversion_timeout: bool = False
+    check_passed: bool = False
     execution_success: bool = False
     retry_count: int = 0
     whyml_code: str = ""
+    whyml_candidates: list = []
     error_message: str = ""
     original_python: str = ""
     typed_python: str = ""
     whyml_attempts: list = []
     errors: list = []
     capability_gaps: list = []
-    full_responses: list = []
\ No newline at end of file
+    provers: list = []
+    proof_session: dict = {}
+    semantic_checks: list = []
+    full_responses: list = []
+    prompt_stats: list = []
\ No newline at end of file
@@ -0,0 +1,60 @@
+import threading
+
+import batch
+import decomposition
+
+
+def write(path, text="def f(x):\n    return x\n"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return str(path)
+
+
+def test_directories_are_searched_recursively_and_globs_expanded(tmp_path):
+    a = write(tmp_path / "a.py")
+    b = write(tmp_path / "sub" / "b.py")
+    write(tmp_path / "notes.txt")
+    assert batch.collect_input_files(str(tmp_path)) == [a, b]
+    assert batch.collect_input_files(str(tmp_path / "*.py")) == [a]
+    assert batch.collect_input_files(str(tmp_path / "missing")) == []
+
+
+def test_files_run_concurrently_and_rows_are_sorted(tmp_path, monkeypatch):
+    files = [write(tmp_path / f"{name}.py", f"# {name}\n") for name in ("c", "a", "b")]
+    # Every pipeline waits for the others, so this only finishes if they overlap
+    barrier = threading.Barrier(len(files), timeout=10)
+
+    def invoke(graph, source):
+        barrier.wait()
+        if "b" in source:
+            raise RuntimeError("boom")
+        return {"execution_success": "a" in source, "whyml_attempts": ["x"], "errors": ["e"], "whyml_code": "m"}, "new"
+
+    tables = []
+    monkeypatch.setattr(decomposition, "decompose_functions", False)
+    monkeypatch.setattr(batch, "invoke_resumable", invoke)
+    monkeypatch.setattr(batch, "record_run", lambda state, label: None)
+    monkeypatch.setattr(batch, "create_batch_table", tables.append)
+    rows = batch.run_batch(str(tmp_path), graph=None)
+
+    assert [row["File"] for row in rows] == sorted(files)
+    assert tables == [rows]
+    a, b, c = rows
+    assert (a["Verified"], a["Number of Tries"], a["Last Error"]) == (True, 1, "e")
+    assert (b["Verified"], b["Last Error"]) == (False, "Pipeline error: boom")
+    assert c["Verified"] is False
+
+
+def test_finished_runs_are_not_recorded_again(tmp_path, monkeypatch):
+    write(tmp_path / "a.py")
+    recorded = []
+    monkeypatch.setattr(decomposition, "decompose_functions", False)
+    monkeypatch.setattr(batch, "invoke_resumable", lambda graph, source: ({"execution_success": True}, "finished"))
+    monkeypatch.setattr(batch, "record_run", lambda state, label: recorded.append(label))
+    monkeypatch.setattr(batch, "create_batch_table", lambda rows: None)
+    assert batch.run_batch(str(tmp_path), graph=None)[0]["Run"] == "finished"
+    assert recorded == []
+
+
+def test_empty_target_runs_nothing(tmp_path):
+    assert batch.run_batch(str(tmp_path), graph=None) == []
@@ -0,0 +1,49 @@
+import os
+
+import benchmark
+import example_index
+import llm_client
+import results_store
+import why3_runner
+
+
+def make_case(root, name: str, files: list):
+    case = root / name
+    case.mkdir(parents=True)
+    for file in files:
+        (case / file).write_text("def f(x: int) -> int:\n    return x\n")
+
+
+def test_cases_are_directories_with_a_standard_input(tmp_path):
+    make_case(tmp_path, "02_abs", ["standard_abs.py", "abs.mlw"])
+    make_case(tmp_path, "01_id", ["standard_id.py", "standard_id_2.py"])
+    make_case(tmp_path, "03_notes", ["notes.py"])
+    assert benchmark.collect_cases(str(tmp_path)) == [
+        ("01_id", str(tmp_path / "01_id" / "standard_id.py"), None),
+        ("02_abs", str(tmp_path / "02_abs" / "standard_abs.py"), str(tmp_path / "02_abs" / "abs.mlw")),
+    ]
+
+
+def test_every_test_code_case_has_an_input_and_a_reference():
+    cases = benchmark.collect_cases(os.path.join(os.path.dirname(benchmark.__file__), "test_code"))
+    assert cases
+    assert all(reference for _, _, reference in cases)
+
+
+def test_replay_without_a_cassette_recording_reports_the_miss(tmp_path, monkeypatch):
+    make_case(tmp_path / "cases", "01_id", ["standard_id.py"])
+    (tmp_path / "cassettes").mkdir()
+    (tmp_path / "cassettes" / "01_id.json").write_text("{}")
+    monkeypatch.chdir(tmp_path)
+    # run_benchmark switches these off for the whole process
+    monkeypatch.setattr(llm_client.llm_cache, "enabled", llm_client.llm_cache.enabled)
+    monkeypatch.setattr(why3_runner.proof_cache, "enabled", why3_runner.proof_cache.enabled)
+    monkeypatch.setattr(example_index, "learn_examples", example_index.learn_examples)
+    monkeypatch.setattr(results_store, "results_enabled", False)
+
+    rows = benchmark.run_benchmark("cases", mode="replay", cassette_dir="cassettes")
+    assert [row["Case"] for row in rows] == ["01_id"]
+    assert rows[0]["Verified"] is False
+    assert "No recorded" in rows[0]["Error"]
+    assert (tmp_path / "benchmark_results.csv").exists()
+    assert example_index.held_out_examples == set()
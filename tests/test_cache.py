@@ -0,0 +1,50 @@
+import time
+
+from cache import SQLiteCache, make_key
+
+
+def test_make_key_is_stable_and_order_independent():
+    assert make_key("a", {"x": 1, "y": 2}) == make_key("a", {"y": 2, "x": 1})
+    assert make_key("a", 1) != make_key("a", "1 ")
+
+
+def test_round_trip_and_stats(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"))
+    assert cache.get("k") is None
+    cache.put("k", {"content": "module M end"})
+    assert cache.get("k") == {"content": "module M end"}
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    cache.put("a", 1)
+    time.sleep(0.01)
+    cache.put("b", 2)
+    time.sleep(0.01)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    time.sleep(0.01)
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_expired_entries_are_misses_and_evicted(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), max_age_days=1 / (24 * 3600))
+    cache.put("old", 1)
+    time.sleep(1.1)
+    assert cache.get("old") is None
+    cache.put("new", 2)
+    conn = cache._connect()
+    try:
+        assert [row[0] for row in conn.execute("SELECT key FROM cache")] == ["new"]
+    finally:
+        conn.close()
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), enabled=False)
+    cache.put("k", 1)
+    cache.enabled = True
+    assert cache.get("k") is None
@@ -0,0 +1,68 @@
+import subprocess
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+import llm_client
+import why3_runner
+from cassette import Cassette, CassetteMiss, use_cassette
+
+
+@pytest.fixture
+def cassette_path(tmp_path):
+    yield str(tmp_path / "cassettes" / "case.json")
+    use_cassette(None)
+
+
+def test_recorded_responses_replay_in_order_and_repeat_the_last(cassette_path):
+    recording = Cassette(cassette_path, "record")
+    recording.record("llm", "k", {"content": "first"})
+    recording.record("llm", "k", {"content": "second"})
+    recording.save()
+
+    replay = Cassette(cassette_path)
+    assert replay.replaying
+    assert [replay.play("llm", "k")["content"] for _ in range(3)] == ["first", "second", "second"]
+    with pytest.raises(CassetteMiss):
+        replay.play("prove", "k")
+
+
+def test_why3_outcomes_replay_without_running_why3(cassette_path):
+    proved = subprocess.CompletedProcess(["why3", "prove"], 0, "Valid", "")
+    recording = Cassette(cassette_path, "record")
+    use_cassette(recording)
+    assert why3_runner.recorded_why3("prove", "a", lambda: (proved, "z3")) == (proved, "z3")
+
+    def timeout():
+        raise subprocess.TimeoutExpired("why3", 1)
+    with pytest.raises(subprocess.TimeoutExpired):
+        why3_runner.recorded_why3("prove", "b", timeout)
+    recording.save()
+
+    def not_run():
+        raise AssertionError("why3 was run during replay")
+    use_cassette(Cassette(cassette_path))
+    result, prover = why3_runner.recorded_why3("prove", "a", not_run)
+    assert (result.args, result.returncode, result.stdout, prover) == (["why3", "prove"], 0, "Valid", "z3")
+    with pytest.raises(subprocess.TimeoutExpired):
+        why3_runner.recorded_why3("prove", "b", not_run)
+    with pytest.raises(CassetteMiss):
+        why3_runner.recorded_why3("type_check", "a", not_run)
+
+
+def test_llm_timeouts_are_recorded_and_replayed(cassette_path, monkeypatch):
+    def cancelled(*args):
+        raise TimeoutError("cancelled")
+    monkeypatch.setattr(llm_client.llm_cache, "enabled", False)
+    monkeypatch.setattr(llm_client, "model_with_temperature", lambda temperature: None)
+    monkeypatch.setattr(llm_client, "_send", cancelled)
+    messages = [HumanMessage(content="slow")]
+    recording = Cassette(cassette_path, "record")
+    use_cassette(recording)
+    with pytest.raises(TimeoutError):
+        llm_client.invoke_llm(messages, deadline=5)
+    recording.save()
+
+    use_cassette(Cassette(cassette_path))
+    with pytest.raises(TimeoutError, match="after 5 seconds"):
+        llm_client.invoke_llm(messages, deadline=5)
@@ -0,0 +1,111 @@
+import sqlite3
+import threading
+import time
+from typing import TypedDict
+
+from langchain_core.messages import AIMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph import StateGraph, START, END
+
+import checkpoints
+import differential
+import why3_runner
+from state import State
+
+
+class RunState(TypedDict, total=False):
+    source: str
+    runs: int
+    execution_success: bool
+
+
+def build(calls: list):
+    def convert(state):
+        calls.append(state["source"])
+        return {"runs": state.get("runs", 0) + 1, "execution_success": "good" in state["source"]}
+
+    builder = StateGraph(RunState)
+    builder.add_node("convert", convert)
+    builder.add_edge(START, "convert")
+    builder.add_edge("convert", END)
+    return builder.compile(checkpointer=SqliteSaver(sqlite3.connect(":memory:", check_same_thread=False)))
+
+
+def run(graph, source: str) -> tuple:
+    config = checkpoints.run_config(graph, source)
+    status, values = checkpoints.run_status(graph, config)
+    if status == "finished":
+        return status, values
+    return status, graph.invoke({"source": source}, config)
+
+
+def test_run_key_depends_on_the_settings(monkeypatch):
+    graph = build([])
+    key = checkpoints.run_config(graph, "def f(): pass")["configurable"]["thread_id"]
+    monkeypatch.setattr(differential, "differential_testing", not differential.differential_testing)
+    assert checkpoints.run_config(graph, "def f(): pass")["configurable"]["thread_id"] != key
+    monkeypatch.undo()
+    monkeypatch.setattr(why3_runner, "prover_portfolio", ["alt-ergo", "z3"])
+    assert checkpoints.run_config(graph, "def f(): pass")["configurable"]["thread_id"] != key
+
+
+def test_verified_runs_are_reused():
+    calls = []
+    graph = build(calls)
+    assert run(graph, "good")[0] == "new"
+    status, values = run(graph, "good")
+    assert status == "finished" and values["runs"] == 1
+    assert calls == ["good"]
+
+
+def test_unverified_runs_are_tried_again_from_scratch():
+    calls = []
+    graph = build(calls)
+    run(graph, "bad")
+    status, values = run(graph, "bad")
+    assert status == "new"
+    assert values["runs"] == 1  # a fresh run, not a continuation of the saved one
+    assert calls == ["bad", "bad"]
+
+
+def test_without_a_checkpointer_every_run_is_new():
+    graph = StateGraph(RunState)
+    graph.add_node("convert", lambda state: {})
+    graph.add_edge(START, "convert")
+    compiled = graph.compile()
+    assert checkpoints.run_config(compiled, "x") is None
+    assert checkpoints.run_status(compiled, None) == ("new", {})
+
+
+def test_run_locks_are_shared_per_source_and_dropped_when_unused():
+    lock = checkpoints.run_lock("def f(): pass")
+    assert checkpoints.run_lock("def f(): pass") is lock
+    assert checkpoints.run_lock("def g(): pass") is not lock
+    key = checkpoints.make_key("run", "def f(): pass")
+    del lock
+    assert key not in checkpoints._run_locks
+
+
+def test_runs_of_the_same_source_take_turns():
+    running = []
+    overlaps = []
+
+    def slow(state):
+        running.append(1)
+        overlaps.append(len(running) > 1)
+        time.sleep(0.05)
+        running.pop()
+        return {"messages": [AIMessage(content="done")], "execution_success": False}
+
+    builder = StateGraph(State)
+    builder.add_node("slow", slow)
+    builder.add_edge(START, "slow")
+    builder.add_edge("slow", END)
+    graph = builder.compile(checkpointer=SqliteSaver(sqlite3.connect(":memory:", check_same_thread=False)))
+
+    threads = [threading.Thread(target=checkpoints.invoke_resumable, args=(graph, "same")) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert overlaps == [False, False, False]
@@ -0,0 +1,75 @@
+from decomposition import rename_module, split_functions
+
+SOURCE = '''"""Geometry helpers."""
+import math
+from typing import List
+
+SCALE = 10
+OFFSET = SCALE * 2
+UNUSED = 5
+
+
+def square(x: int) -> int:
+    return x * x
+
+
+def scaled(x: int) -> int:
+    return square(x) * SCALE + OFFSET
+
+
+def norm(xs: List[float]) -> float:
+    return math.sqrt(sum(x * x for x in xs))
+
+
+print(norm([3.0, 4.0]))
+
+if __name__ == "__main__":
+    print(scaled(2))
+'''
+
+
+def units():
+    return dict(split_functions(SOURCE))
+
+
+def test_one_unit_per_function_with_its_callees():
+    split = units()
+    assert list(split) == ["square", "scaled", "norm"]
+    assert "def square" in split["scaled"]
+    assert "def scaled" not in split["square"]
+
+
+def test_units_keep_only_the_imports_and_constants_they_use():
+    split = units()
+    assert split["square"] == "def square(x: int) -> int:\n    return x * x\n"
+    # OFFSET is kept, and so is SCALE, which OFFSET is computed from
+    assert split["scaled"].startswith("SCALE = 10\n\nOFFSET = SCALE * 2\n\ndef square")
+    assert "import math" in split["norm"] and "from typing import List" in split["norm"]
+    assert "SCALE" not in split["norm"]
+
+
+def test_module_level_code_is_left_out():
+    for unit in units().values():
+        assert "__main__" not in unit
+        assert "print(" not in unit
+        assert "UNUSED" not in unit
+        assert "Geometry helpers" not in unit
+
+
+def test_single_function_or_unparsable_sources_are_not_split():
+    assert split_functions("def f(x):\n    return x\n") == []
+    assert split_functions("def f(:\n") == []
+
+
+def test_rename_module_only_renames_the_leading_declaration():
+    whyml = '''(* module Old (* nested *) is described here *)
+module Old
+  use int.Int
+  let f (x: int) : int
+    ensures { result = x } (* the module returns x *)
+  = let s = "module Fake" in x
+end'''
+    renamed = rename_module(whyml, "Square")
+    assert renamed.startswith("(* module Old (* nested *) is described here *)\nmodule Square\n")
+    assert '"module Fake"' in renamed and "(* the module returns x *)" in renamed
+    assert rename_module("use int.Int", "Square") == "use int.Int"
@@ -0,0 +1,80 @@
+import differential
+
+WHYML = """module Max
+  use int.Int
+  use array.Array
+
+  (* requires { this is a comment } *)
+  let max_array (a: array int) : int
+    requires { length a > 0 }
+    requires { a[0] >= 0 /\\ length a <= 100 }
+    ensures { forall i. 0 <= i < length a -> result >= a[i] }
+  =
+    let m = ref a[0] in
+    for i = 1 to length a - 1 do
+      invariant { !m >= 0 }
+      if a[i] > !m then m := a[i]
+    done;
+    !m
+
+  let rec function fact (n: int) : int
+    requires { n >= 0 }
+    variant { n }
+  = if n = 0 then 1 else n * fact (n - 1)
+
+  let total (a: array int) : int = 0
+end
+"""
+
+
+def test_requires_clauses_reads_only_the_named_function():
+    assert [clause.strip() for clause in differential.requires_clauses(WHYML, "max_array")] == [
+        "length a > 0", "a[0] >= 0 /\\ length a <= 100"]
+    assert [clause.strip() for clause in differential.requires_clauses(WHYML, "fact")] == ["n >= 0"]
+
+
+def test_requires_clauses_stops_at_the_body():
+    assert differential.requires_clauses(WHYML, "total") == []
+
+
+def test_requires_clauses_of_an_undefined_function():
+    assert differential.requires_clauses(WHYML, "missing") is None
+
+
+def test_python_condition_translates_simple_clauses():
+    assert differential.python_condition("length a > 0") == "len(a) > 0"
+    assert differential.python_condition("a[0] >= 0 /\\ n <> 1") == "a[0] >= 0  and  n != 1"
+    assert differential.python_condition("n = 0 \\/ b = true") == "n == 0  or  b == True"
+    assert eval(differential.python_condition("0 <= n <= length a"), {"n": 2, "a": [1, 2]})
+
+
+def test_python_condition_rejects_what_python_cannot_evaluate():
+    assert differential.python_condition("forall i. 0 <= i < length a -> a[i] >= 0") is None
+    assert differential.python_condition("mod n 2 = 0") is None
+    assert differential.python_condition("n >= old n") is None
+    assert differential.python_condition("n >=") is None
+
+
+def test_whyml_literal():
+    assert differential.whyml_literal(-3, "int") == "(-3)"
+    assert differential.whyml_literal(True, "bool") == "true"
+    assert differential.whyml_literal([1, -2], "array int") == (
+        "(let a = Array.make 2 0 in a[0] <- 1; a[1] <- (-2); a)")
+
+
+def test_generate_inputs_is_stable_and_starts_with_edge_values():
+    inputs = differential.generate_inputs(["int", "array int"], 20, "seed")
+    assert inputs == differential.generate_inputs(["int", "array int"], 20, "seed")
+    assert len(inputs) == len({repr(args) for args in inputs}) == 20
+    assert inputs[0] == (0, [])
+    assert differential.generate_inputs([], 20, "seed") == [()]
+
+
+def test_preconditions_are_evaluated_without_builtins(monkeypatch):
+    calls = []
+    monkeypatch.setattr("builtins.print", lambda *args: calls.append(args))
+    whyml = "module M\n  let f (n: int) : int\n    requires { print(n) = None }\n  = n\nend\n"
+    check = differential.check_function(whyml, "M", "f", ["n"], ["int"], lambda n: n)
+    assert check["status"] == "skipped"
+    assert check["reason"] == "precondition cannot be evaluated in Python"
+    assert calls == []
@@ -0,0 +1,50 @@
+from error_history import build_error_history, error_signature
+
+
+def module(body: str) -> str:
+    return f"module M\n  use int.Int\n  let f (x: int) : int\n    ensures {{ result >= 0 }}\n  = {body}\nend"
+
+
+def test_error_signature_drops_file_locations():
+    a = 'File "/tmp/tmpab12.mlw", line 3, characters 4-9:\nunbound symbol \'y\''
+    b = 'File "/tmp/tmpzz99.mlw", line 7, characters 1-2:\nunbound symbol \'y\''
+    assert error_signature(a) == error_signature(b) == "unbound symbol 'y'"
+
+
+def test_latest_attempts_are_shown_in_full_and_older_ones_as_diffs():
+    attempts = [module("x"), module("x + 0"), module("abs x")]
+    errors = ["error one", "error two", "error three"]
+    history, stats = build_error_history(attempts, errors, keep_full=2)
+    assert stats == {"attempts": 3, "full": 2, "diff": 1, "duplicate": 0, "omitted": 0}
+    assert "CODE (diff against attempt 2):" in history
+    assert "ERROR SIGNATURE: error one" in history
+    assert history.index("--- ATTEMPT 1 ---") < history.index("--- ATTEMPT 3 ---")
+
+
+def test_identical_attempts_are_collapsed():
+    same = module("x")
+    reformatted = same.replace("  = x", "  =   x  (* again *)")
+    history, stats = build_error_history([same, reformatted, module("abs x")], ["boom", "boom", "other"])
+    assert stats["duplicate"] == 1
+    assert "(attempt 2 repeated this exact code and error)" in history
+    assert "--- ATTEMPT 2 ---" not in history
+
+
+def test_same_code_with_a_different_error_is_kept():
+    _, stats = build_error_history([module("x"), module("x")], ["boom", "different"])
+    assert stats["duplicate"] == 0 and stats["full"] == 2
+
+
+def test_oldest_entries_are_dropped_to_fit_the_budget_but_the_latest_is_kept():
+    attempts = [module(" + ".join(["x"] * (50 + i))) for i in range(6)]
+    errors = [f"error {i}\n" + "detail\n" * 10 for i in range(6)]
+    history, stats = build_error_history(attempts, errors, keep_full=2, token_budget=150)
+    assert stats["omitted"] >= 1
+    assert history.startswith(f"({stats['omitted']} older distinct attempts omitted")
+    assert "--- ATTEMPT 6 ---" in history
+    assert stats["full"] + stats["diff"] + stats["omitted"] == 6
+
+
+def test_long_errors_are_truncated():
+    history, _ = build_error_history([module("x")], ["\n".join(f"line {i}" for i in range(50))])
+    assert "... (30 more lines)" in history
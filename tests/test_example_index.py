@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+import example_index
+from config import EXAMPLE_SEED_DIR
+from example_index import ExampleIndex
+
+MINIMUM = os.path.join(EXAMPLE_SEED_DIR, "05_array_minimum", "standard_find_minimum.py")
+
+SPEC_WHYML = "module M\n  let f (x: int) : int\n    ensures { result = x + 1 }\n  = x + 1\nend\n"
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(example_index, "learn_examples", True)
+    return ExampleIndex(EXAMPLE_SEED_DIR, str(tmp_path / "examples.jsonl"))
+
+
+def typed_minimum() -> str:
+    # The chatbot's typed source differs from the seed's, e.g. in annotations and comments
+    with open(MINIMUM) as f:
+        source = f.read()
+    return source.replace("def find_minimum(arr):", "def find_minimum(arr: list[int]) -> int:").replace("#", "# note:")
+
+
+def test_similar_code_finds_its_seed(index):
+    names = [example["name"] for example in index.nearest(typed_minimum())]
+    assert names[0] == "05_array_minimum"
+
+
+def test_held_out_cases_are_never_returned(index):
+    examples = index.nearest(typed_minimum(), k=20, exclude={"05_array_minimum"})
+    assert "05_array_minimum" not in [example["name"] for example in examples]
+
+
+def test_identical_code_is_never_returned(index):
+    seed = next(entry for entry in index.entries() if entry["name"] == "05_array_minimum")
+    assert "05_array_minimum" not in [example["name"] for example in index.nearest(seed["python"], k=20)]
+
+
+def test_few_shot_examples_leave_out_the_held_out_cases(index, monkeypatch):
+    monkeypatch.setattr(example_index, "example_index", index)
+    monkeypatch.setattr(example_index, "examples_enabled", True)
+    monkeypatch.setattr(example_index, "held_out_examples", set())
+    assert "05_array_minimum" in [example["name"] for example in example_index.few_shot_examples(typed_minimum())]
+    example_index.set_held_out_examples(["05_array_minimum"])
+    assert "05_array_minimum" not in [example["name"] for example in example_index.few_shot_examples(typed_minimum())]
+
+
+def test_verified_translations_are_learned_and_reloaded(index, tmp_path, monkeypatch):
+    python = "def increment(x: int) -> int:\n    return x + 1\n"
+    index.add(python, SPEC_WHYML)
+    index.add(python, SPEC_WHYML)
+    index.add("def twice(x: int) -> int:\n    return 2 * x\n", "module M let twice (x: int) : int = 2 * x end")
+
+    reloaded = ExampleIndex(EXAMPLE_SEED_DIR, index.path)
+    learned = [entry["name"] for entry in reloaded.entries() if entry["origin"] == "learned"]
+    assert learned == ["increment"]  # once, and not the one without a specification
+    assert reloaded.nearest("def increment(y: int) -> int:\n    return y + 1\n")[0]["name"] == "increment"
+
+    monkeypatch.setattr(example_index, "learn_examples", False)
+    fresh = ExampleIndex(EXAMPLE_SEED_DIR, index.path)
+    assert {entry["origin"] for entry in fresh.entries()} == {"seed"}
+
+
+def test_format_examples():
+    assert example_index.format_examples([]) == ""
+    text = example_index.format_examples([{"name": "inc", "python": "def f(): pass\n", "whyml": SPEC_WHYML}])
+    assert "Example 1 (inc):" in text and "ensures { result = x + 1 }" in text
@@ -0,0 +1,36 @@
+import sys
+
+import pytest
+
+from graph_builder import build_graph, graph_structure_key, save_graph_visualization
+
+
+def branches(graph, source: str) -> set:
+    return {edge.target for edge in graph.get_graph().edges if edge.source == source}
+
+
+def test_gap_classifier_is_a_side_branch_ending_the_run():
+    graph = build_graph()
+    for node in ("whyml_checker", "whyml_executor", "differential_tester"):
+        assert {"error_corrector", "gap_classifier"} <= branches(graph, node)
+    assert branches(graph, "gap_classifier") == {"__end__"}
+    # Nothing waits for the classifier: the corrector loops straight back to the checker
+    assert branches(graph, "error_corrector") == {"whyml_checker"}
+
+
+def test_graph_structure_key_is_stable_between_builds():
+    assert graph_structure_key(build_graph()) == graph_structure_key(build_graph())
+
+
+def test_visualization_is_not_redrawn_for_an_unchanged_graph(tmp_path, monkeypatch):
+    graph = build_graph()
+    image, key = tmp_path / "graph.png", tmp_path / "cache" / "graph.key"
+    image.write_bytes(b"png")
+    key.parent.mkdir()
+    key.write_text(graph_structure_key(graph))
+    # Rendering would need graphviz; an up-to-date image must not touch it
+    monkeypatch.setitem(sys.modules, "graphviz", None)
+    assert save_graph_visualization(graph, str(image), str(key)) is False
+    key.write_text("stale")
+    with pytest.raises(ImportError):
+        save_graph_visualization(graph, str(image), str(key))
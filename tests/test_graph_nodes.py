@@ -0,0 +1,65 @@
+import subprocess
+
+import graph_nodes
+
+TIMEOUT = "Goal f'vc.\nProver result is: Timeout (5.00s, 1233 steps).\n"
+
+
+def completed(returncode: int, stdout: str = "", stderr: str = "") -> subprocess.CompletedProcess:
+    return subprocess.CompletedProcess(["why3", "prove"], returncode, stdout, stderr)
+
+
+def test_failed_proofs_with_empty_stderr_are_not_winners(monkeypatch):
+    # why3 reports prover verdicts on stdout, so a failing proof can have empty stderr
+    monkeypatch.setattr(graph_nodes, "prove_whyml", lambda code, session: (completed(1, TIMEOUT), "alt-ergo"))
+    update = graph_nodes.prove_candidates({"whyml_attempts": [], "errors": []}, ["module A end", "module B end"])
+    assert update["execution_success"] is False
+    assert update["errors"] == [TIMEOUT.strip(), TIMEOUT.strip()]
+    assert "Prover result is: Timeout" in update["error_message"]
+
+
+def test_the_candidate_that_proves_wins(monkeypatch):
+    def prove(code, session):
+        return (completed(0, "Prover result is: Valid."), "z3") if "B" in code else (completed(1, TIMEOUT), "z3")
+    monkeypatch.setattr(graph_nodes, "prove_whyml", prove)
+    monkeypatch.setattr(graph_nodes.differential, "differential_testing", True)
+    update = graph_nodes.prove_candidates({"whyml_attempts": [], "errors": []}, ["module A end", "module B end"])
+    assert update["execution_success"] is True
+    assert update["whyml_code"] == "module B end"
+
+
+def test_single_candidate_failure_records_the_verdict(monkeypatch):
+    monkeypatch.setattr(graph_nodes, "prove_whyml", lambda code, session: (completed(1, TIMEOUT), "alt-ergo"))
+    state = {"messages": [graph_nodes.AIMessage(content="module A end")], "whyml_attempts": [], "errors": []}
+    update = graph_nodes.whyml_executor(state)
+    assert update["execution_success"] is False
+    assert update["errors"] == [TIMEOUT.strip()]
+
+
+def test_proof_error_falls_back_to_the_return_code():
+    assert graph_nodes.proof_error(completed(2)) == "why3 exited with return code 2"
+    assert graph_nodes.proof_error(completed(1, "out", "err")) == "err\nout"
+
+
+def test_executor_timeout_reports_the_configured_limit(monkeypatch):
+    def prove(code, session):
+        raise subprocess.TimeoutExpired("why3", graph_nodes.WHY3_TIMEOUT)
+    monkeypatch.setattr(graph_nodes, "prove_whyml", prove)
+    state = {"messages": [graph_nodes.AIMessage(content="module A end")], "whyml_attempts": [], "errors": []}
+    update = graph_nodes.whyml_executor(state)
+    assert update["errors"] == ["Timeout"]
+    assert update["messages"][-1].content == f"WhyML execution timed out after {graph_nodes.WHY3_TIMEOUT} seconds"
+
+
+def test_failures_go_to_the_corrector_and_the_classifier_together():
+    assert graph_nodes.should_retry({"execution_success": False, "retry_count": 1}) == ["retry", "classify"]
+    assert graph_nodes.should_retry({"execution_success": False, "retry_count": 10}) == "classify"
+    assert graph_nodes.should_retry({"execution_success": True}) == "end"
+
+
+def test_classifier_only_classifies_errors_since_its_last_run(monkeypatch):
+    classified = []
+    monkeypatch.setattr(graph_nodes, "classify_capability_gap", lambda error: classified.append(error) or "PSyn")
+    state = {"errors": ["first", "why3 not found", "third"], "capability_gaps": ["SSem"]}
+    assert graph_nodes.gap_classifier(state) == {"capability_gaps": ["SSem", "EKnow", "PSyn"]}
+    assert classified == ["third"]
@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+
+from langchain_core.messages import HumanMessage
+
+import llm_client
+from cassette import Cassette, use_cassette
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REPLAY = """
+import sys
+from langchain_core.messages import HumanMessage
+from cassette import Cassette, use_cassette
+from llm_client import invoke_llm
+use_cassette(Cassette(sys.argv[1], "replay"))
+print(invoke_llm([HumanMessage(content="hello")]).content)
+print("langchain_anthropic" in sys.modules)
+"""
+
+
+def recorded_cassette(tmp_path, messages, content: str, temperature: float = None) -> str:
+    path = tmp_path / "cassette.json"
+    key = llm_client.llm_cache_key(messages, temperature)
+    path.write_text(json.dumps({f"llm:{key}": [{"content": content, "usage_metadata": None}]}))
+    return str(path)
+
+
+def test_replay_does_not_import_the_model_client(tmp_path):
+    path = recorded_cassette(tmp_path, [HumanMessage(content="hello")], "module M end")
+    result = subprocess.run([sys.executable, "-c", REPLAY, path], cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == ["module", "M", "end", "False"]
+
+
+def test_cache_hits_and_replays_never_create_the_model(tmp_path, monkeypatch):
+    def no_model():
+        raise AssertionError("the model was created")
+    monkeypatch.setattr(llm_client, "get_llm", no_model)
+    messages = [HumanMessage(content="hi")]
+    use_cassette(Cassette(recorded_cassette(tmp_path, messages, "replayed", 0.7), "replay"))
+    try:
+        assert llm_client.invoke_llm(messages, temperature=0.7).content == "replayed"
+    finally:
+        use_cassette(None)
+
+    monkeypatch.setattr(llm_client.llm_cache, "get", lambda key: {"content": "cached"})
+    assert llm_client.invoke_llm(messages).content == "cached"
+
+
+def test_cache_key_depends_on_the_temperature():
+    messages = [HumanMessage(content="hi")]
+    assert llm_client.llm_cache_key(messages) == llm_client.llm_cache_key(messages, llm_client.LLM_TEMPERATURE)
+    assert llm_client.llm_cache_key(messages) != llm_client.llm_cache_key(messages, 0.9)
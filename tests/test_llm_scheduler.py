@@ -0,0 +1,74 @@
+import threading
+import time
+
+import pytest
+
+import llm_client
+from llm_scheduler import LLMScheduler, TokenBucket, PRIORITY_FIX, PRIORITY_NEW
+
+
+def test_token_bucket_waits_out_what_was_overdrawn():
+    bucket = TokenBucket(60)  # one unit per second
+    assert bucket.wait_time(60) == 0.0
+    bucket.level -= 62
+    assert bucket.wait_time(1) == pytest.approx(3.0)
+    bucket.refill(bucket.updated + 2.0)
+    assert bucket.level == pytest.approx(0.0)
+    assert bucket.wait_time(1000) == pytest.approx(60.0)  # never more than the capacity
+
+
+def test_waiting_requests_are_admitted_in_priority_order():
+    scheduler = LLMScheduler(concurrency=1)
+    first = scheduler.ticket(PRIORITY_NEW)
+    scheduler.acquire(first, {})
+    admitted = []
+
+    def request(ticket):
+        scheduler.acquire(ticket, {})
+        admitted.append(ticket[0])
+        scheduler.release({}, {})
+
+    tickets = [scheduler.ticket(PRIORITY_NEW), scheduler.ticket(PRIORITY_FIX), scheduler.ticket(PRIORITY_NEW)]
+    threads = [threading.Thread(target=request, args=(ticket,)) for ticket in tickets]
+    for thread in threads:
+        thread.start()
+    while len(scheduler._waiting) < len(tickets):
+        time.sleep(0.01)
+    scheduler.release({}, {})
+    for thread in threads:
+        thread.join(timeout=5)
+    assert admitted == [PRIORITY_FIX, PRIORITY_NEW, PRIORITY_NEW]
+
+
+def test_acquire_gives_up_after_its_timeout_and_leaves_the_queue():
+    scheduler = LLMScheduler(concurrency=1)
+    scheduler.acquire(scheduler.ticket(PRIORITY_NEW), {})
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        scheduler.acquire(scheduler.ticket(PRIORITY_FIX), {}, timeout=0.1)
+    assert time.monotonic() - start < 1
+    assert scheduler._waiting == []
+
+
+class Overloaded(Exception):
+    status_code = 529
+
+
+def test_retries_stop_at_the_deadline(monkeypatch):
+    monkeypatch.setattr(llm_client, "scheduler", LLMScheduler(concurrency=1))
+    monkeypatch.setattr(llm_client, "backoff_delay", lambda attempt, requested: 0.2)
+    timeouts = []
+
+    def fail(coroutine, timeout=None):
+        coroutine.close()
+        timeouts.append(timeout)
+        raise Overloaded("overloaded")
+    monkeypatch.setattr(llm_client, "_run", fail)
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        llm_client._send(None, [], 0.5, None, PRIORITY_NEW, {})
+    assert time.monotonic() - start < 1
+    # Each attempt only gets the time left until the deadline
+    assert 1 < len(timeouts) <= 3
+    assert all(later < earlier for earlier, later in zip(timeouts, timeouts[1:]))
@@ -0,0 +1,57 @@
+from python_to_whyml import translate_to_whyml
+from utils import find_structural_problems, has_specification
+
+
+def test_simple_function_is_translated():
+    whyml = translate_to_whyml("def absolute_value(n: int) -> int:\n    if n < 0:\n        return -n\n    return n\n")
+    assert whyml.startswith("module AbsoluteValue")
+    assert "let absolute_value (n: int) : int" in whyml
+    assert whyml.rstrip().endswith("end")
+
+
+def test_division_by_a_positive_literal_uses_euclidean_division():
+    whyml = translate_to_whyml("def half(x: int) -> int:\n    return x // 2 + x % 3\n")
+    assert "use int.EuclideanDivision" in whyml
+    assert "(div x 2)" in whyml and "(mod x 3)" in whyml
+
+
+def test_division_by_a_variable_or_negative_divisor_is_left_to_the_llm():
+    # Euclidean division differs from Python's floor division for negative divisors
+    gcd = ("def gcd(a: int, b: int) -> int:\n    if b == 0:\n        return a\n"
+           "    else:\n        return gcd(b, a % b)\n")
+    assert translate_to_whyml(gcd) is None
+    assert translate_to_whyml("def f(x: int) -> int:\n    return x // -2\n") is None
+    assert translate_to_whyml("def f(x: int, y: int) -> int:\n    return x // y\n") is None
+
+
+def test_loops_and_recursion_are_marked_diverges():
+    source = "def fact(n: int) -> int:\n    if n == 0:\n        return 1\n    return n * fact(n - 1)\n"
+    whyml = translate_to_whyml(source)
+    assert "let rec fact" in whyml and "diverges" in whyml
+
+
+def test_template_output_has_no_specification_and_fails_the_preflight_check():
+    whyml = translate_to_whyml("def total(arr: list[int]) -> int:\n    t = 0\n"
+                               "    for e in arr:\n        t += e\n    return t\n")
+    assert whyml is not None
+    assert not has_specification(whyml)
+    assert any(problem.startswith("No specification") for problem in find_structural_problems(whyml))
+    specified = whyml.replace(": int\n", ": int\n    ensures { result >= 0 }\n", 1)
+    assert has_specification(specified)
+
+
+def test_inputs_outside_the_subset_are_not_translated():
+    assert translate_to_whyml("def f(x: float) -> float:\n    return x / 2\n") is None
+    assert translate_to_whyml("def f(x):\n    return x\n") is None
+    assert translate_to_whyml("def f(xs: list[int]) -> list[int]:\n    return xs\n") is None
+    assert translate_to_whyml("print(1)\n") is None
+
+
+def test_loop_variable_is_out_of_scope_after_the_loop():
+    # Python keeps the last element in the variable; the WhyML loop index is gone after `done`
+    assert translate_to_whyml("def last(n: int) -> int:\n    for i in range(n):\n        pass\n    return i\n") is None
+    assert translate_to_whyml("def f(n: int) -> int:\n    i = 0\n    for i in range(n):\n"
+                              "        pass\n    return i\n") is None
+    twice = ("def twice(n: int) -> int:\n    t = 0\n    for i in range(n):\n        t += i\n"
+             "    for i in range(n):\n        t += i\n    return t\n")
+    assert translate_to_whyml(twice) is not None
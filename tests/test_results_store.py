@@ -0,0 +1,102 @@
+import json
+import threading
+
+import pytest
+
+import differential
+import results_store
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    path = str(tmp_path / "results.jsonl")
+    monkeypatch.setattr(results_store, "results_enabled", True)
+    monkeypatch.setattr(results_store, "results_path", path)
+    return path
+
+
+def rows(path: str) -> list:
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def executor(code: str, error: str = ""):
+    def node(state):
+        update = {"whyml_attempts": state.get("whyml_attempts", []) + [code], "provers": ["z3"]}
+        if error:
+            update["errors"] = state.get("errors", []) + [error]
+        return update
+    return results_store.recorded_node("whyml_executor", node)
+
+
+def differential_check(status: str):
+    def node(state):
+        check = {"attempt": len(state["whyml_attempts"]), "status": status, "inputs": 10,
+                 "mismatches": 1 if status == "failed" else 0}
+        update = {"semantic_checks": state.get("semantic_checks", []) + [check]}
+        if status == "failed":
+            update["errors"] = state.get("errors", []) + ["Semantic mismatch: f(1) returned 2, expected 3"]
+        return update
+    return results_store.recorded_node("differential_tester", node)
+
+
+def run(steps: list, run_id: str = "r1") -> dict:
+    state = {"run_id": run_id, "original_python": "def f(x): return x", "whyml_attempts": [], "errors": []}
+    for step in steps:
+        state.update(step(state))
+    return state
+
+
+def test_attempts_and_checks_are_appended_as_long_rows(store):
+    run([executor("module A end", "Prover result is: Timeout"), executor("module B end"), differential_check("passed")])
+    events = [(row["event"], row.get("attempt"), row.get("status")) for row in rows(store)]
+    assert events == [("attempt", 1, "failed"), ("attempt", 2, "proved"), ("semantic_check", 2, "passed")]
+    assert rows(store)[0]["error_signature"]
+
+
+def test_proved_attempts_take_the_outcome_of_their_differential_test(store):
+    run([executor("module A end"), differential_check("failed"), executor("module B end"), differential_check("passed")], "r1")
+    run([executor("module C end")], "r2")  # interrupted before its test
+    statuses = results_store.attempt_statuses(results_store.load_results(store))
+    assert list(zip(statuses["run_id"], statuses["attempt"], statuses["status"])) == [
+        ("r1", 1, "failed"), ("r1", 2, "verified"), ("r2", 1, "proved")]
+
+
+def test_without_differential_testing_proved_attempts_are_verified(store, monkeypatch):
+    monkeypatch.setattr(differential, "differential_testing", False)
+    run([executor("module A end")])
+    assert rows(store)[0]["status"] == "verified"
+
+
+def test_record_run_summarises_the_final_state(store):
+    state = run([executor("module A end"), differential_check("passed")])
+    state.update(execution_success=True, whyml_code="module A end")
+    results_store.record_run(state, "a.py")
+    row = rows(store)[-1]
+    assert (row["event"], row["input"], row["verified"], row["attempts"], row["winning_prover"]) == \
+        ("run", "a.py", True, 1, "z3")
+
+
+def test_concurrent_writers_never_interleave_lines(store):
+    payload = "x" * 10000
+    threads = [threading.Thread(target=results_store.append_results, args=([{"event": "run", "n": i, "p": payload}],))
+               for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(row["n"] for row in rows(store)) == list(range(20))
+
+
+def test_nothing_is_written_when_recording_is_off(store, monkeypatch):
+    monkeypatch.setattr(results_store, "results_enabled", False)
+    run([executor("module A end")])
+    results_store.record_run({"execution_success": True}, "a.py")
+    assert not (results_store.os.path.exists(store))
+
+
+def test_query_filters_on_the_final_status(store, capsys):
+    run([executor("module A end"), differential_check("failed"), executor("module B end"), differential_check("passed")])
+    results_store.print_query(store, status="verified")
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2 and lines[1].split()[:2] == ["r1", "2"]
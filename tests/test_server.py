@@ -0,0 +1,47 @@
+from typing import Annotated, TypedDict
+
+from langchain_core.messages import AIMessage
+from langgraph.graph import StateGraph, START, END
+from langgraph.graph.message import add_messages
+
+import decomposition
+import server
+
+SOURCE = """def double(x: int) -> int:
+    return 2 * x
+
+
+def quadruple(x: int) -> int:
+    return double(double(x))
+"""
+
+
+class RunState(TypedDict, total=False):
+    messages: Annotated[list, add_messages]
+    execution_success: bool
+    whyml_code: str
+
+
+def build():
+    builder = StateGraph(RunState)
+    builder.add_node("whyml_translator", lambda state: {"messages": [AIMessage(content="module M end")]})
+    builder.add_node("whyml_executor", lambda state: {"execution_success": True, "whyml_code": "module M end"})
+    builder.add_edge(START, "whyml_translator")
+    builder.add_edge("whyml_translator", "whyml_executor")
+    builder.add_edge("whyml_executor", END)
+    return builder.compile()
+
+
+def test_multi_function_jobs_publish_node_updates(monkeypatch):
+    monkeypatch.setattr(decomposition, "record_run", lambda state, label: None)
+    monkeypatch.setattr(decomposition, "decompose_functions", True)
+    events = []
+    result = server.convert(build(), SOURCE, "job", events.append)
+
+    assert result["functions"] == {"double": True, "quadruple": True}
+    nodes = [event for event in events if event["event"] == "node"]
+    for function in ("double", "quadruple"):
+        assert [(event["node"], event["output"]) for event in nodes if event["function"] == function] == [
+            ("whyml_translator", "module M end"), ("whyml_executor", "Passed")]
+    # Per-function results follow the node updates they summarise
+    assert [event["event"] for event in events[-2:]] == ["function", "function"]
@@ -0,0 +1,45 @@
+import io
+import json
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import graph_nodes
+import tracing
+
+
+def trace_records(monkeypatch):
+    sink = io.StringIO()
+    monkeypatch.setattr(tracing, "_sink", sink)
+    return lambda: [json.loads(line) for line in sink.getvalue().splitlines()]
+
+
+def test_events_from_worker_threads_carry_the_node(monkeypatch):
+    records = trace_records(monkeypatch)
+
+    def work(i):
+        with tracing.span("why3", "run", index=i):
+            pass
+
+    def node(state):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(tracing.in_context(work), range(8)))
+        return {}
+
+    tracing.traced_node("whyml_executor", node)({"retry_count": 2})
+    runs = [record for record in records() if record["event"] == "why3"]
+    assert len(runs) == 8
+    assert {(record["node"], record["retry"]) for record in runs} == {("whyml_executor", 2)}
+
+
+def test_candidate_proofs_are_traced_under_the_node(monkeypatch):
+    records = trace_records(monkeypatch)
+
+    def prove(code, session):
+        with tracing.span("why3", "run"):
+            return subprocess.CompletedProcess(["why3"], 0, "Prover result is: Valid.", ""), "z3"
+    monkeypatch.setattr(graph_nodes, "prove_whyml", prove)
+    monkeypatch.setattr(graph_nodes.differential, "differential_testing", False)
+
+    node = tracing.traced_node("whyml_executor", lambda state: graph_nodes.prove_candidates(state, ["module A end"] * 3))
+    node({"whyml_attempts": [], "errors": [], "retry_count": 0})
+    assert {record["node"] for record in records() if record["event"] == "why3"} == {"whyml_executor"}
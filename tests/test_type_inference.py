@@ -0,0 +1,67 @@
+from type_inference import HIGH, NONE, PARTIAL, annotate_types
+
+
+def test_arithmetic_on_int_literals():
+    assert annotate_types("def f(x):\n    return x + 1\n") == ("def f(x: int) -> int:\n    return x + 1", HIGH)
+
+
+def test_loop_over_list_infers_element_type():
+    source = "def s(arr):\n    t = 0\n    for e in arr:\n        t += e\n    return t\n"
+    annotated, confidence = annotate_types(source)
+    assert confidence == HIGH
+    assert annotated.startswith("def s(arr: list[int]) -> int:")
+
+
+def test_recursion_unifies_with_the_signature():
+    source = "def fact(n):\n    if n == 0:\n        return 1\n    return n * fact(n - 1)\n"
+    annotated, confidence = annotate_types(source)
+    assert confidence == HIGH
+    assert annotated.startswith("def fact(n: int) -> int:")
+
+
+def test_existing_annotations_are_kept_and_propagate():
+    annotated, confidence = annotate_types("def h(a, b: float):\n    return a < b\n")
+    assert confidence == HIGH
+    assert annotated.startswith("def h(a: float, b: float) -> bool:")
+
+
+def test_untyped_parameters_give_partial_confidence():
+    assert annotate_types("def g(x):\n    return x\n")[1] == PARTIAL
+    assert annotate_types("def d(x, y):\n    return x / y\n")[1] == PARTIAL
+
+
+def test_optional_return_is_rendered_as_a_union():
+    source = ("def find(xs: list[int], t: int):\n    for i in range(len(xs)):\n"
+              "        if xs[i] == t:\n            return i\n    return None\n")
+    annotated, confidence = annotate_types(source)
+    assert confidence == HIGH
+    assert "-> int | None:" in annotated
+
+
+def test_module_level_code_is_not_trusted():
+    assert annotate_types("def f(x):\n    return x + 1\nprint(f(2))\n")[1] == PARTIAL
+
+
+def test_unparsable_or_function_free_sources():
+    assert annotate_types("def f(:\n") == ("def f(:\n", NONE)
+    assert annotate_types("x = 1\n") == ("x = 1\n", NONE)
+
+
+def test_if_elif_without_else_may_return_none():
+    source = "def sign(x):\n    if x > 0:\n        return 1\n    elif x < 0:\n        return -1\n"
+    annotated, confidence = annotate_types(source)
+    assert annotated.startswith("def sign(x: int) -> int | None:")
+
+
+def test_search_loop_without_final_return_may_return_none():
+    source = ("def index(xs: list[int], t: int):\n    for i in range(len(xs)):\n"
+              "        if xs[i] == t:\n            return i\n")
+    assert "-> int | None:" in annotate_types(source)[0]
+
+
+def test_every_branch_returning_is_not_optional():
+    source = "def sign(x):\n    if x > 0:\n        return 1\n    elif x < 0:\n        return -1\n    else:\n        return 0\n"
+    assert annotate_types(source) == (
+        "def sign(x: int) -> int:\n    if x > 0:\n        return 1\n    elif x < 0:\n        return -1\n    else:\n        return 0",
+        HIGH)
+    assert "-> int:" in annotate_types("def f(x: int):\n    while True:\n        x += 1\n        return x\n")[0]
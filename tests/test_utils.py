@@ -0,0 +1,119 @@
+from utils import clean_whyml_code, classify_capability_gap_locally, find_structural_problems, strip_thinking
+
+MODULE = """module Abs
+  use int.Int
+  let abs (x: int) : int
+    ensures { result >= 0 }
+  = if x < 0 then -x else x
+end"""
+
+
+def test_well_formed_module_has_no_problems():
+    assert find_structural_problems(MODULE) == []
+
+
+def test_empty_output():
+    assert find_structural_problems("  \n") == ["Empty output: no WhyML code was produced"]
+
+
+def test_leftover_markdown_and_thinking_are_reported():
+    problems = find_structural_problems(f"```whyml\n{MODULE}\n```")
+    assert "Leftover markdown formatting in the WhyML code" in problems
+    problems = find_structural_problems(f"<thinking>plan</thinking>\n{MODULE}")
+    assert problems == ["Leftover <thinking> text in the WhyML code"]
+
+
+def test_unbalanced_blocks():
+    assert "Unbalanced blocks: 1 module/begin/match/try/loop/abstract block(s) not closed with `end`" in \
+        find_structural_problems("module M\n  let f () ensures { true } = begin 1\nend")
+    assert any(problem.startswith("Unbalanced blocks: `end` without")
+               for problem in find_structural_problems("module M end end"))
+    assert find_structural_problems("let f () = 1") == ["No `module ... end` block found"]
+
+
+def test_loop_and_abstract_blocks_close_with_end():
+    code = """module Loop
+  use int.Int
+  use ref.Ref
+  let count (n: int) : int
+    requires { n >= 0 }
+    ensures { result = n }
+  = let i = ref 0 in
+    try
+      loop
+        invariant { 0 <= !i <= n }
+        variant { n - !i }
+        if !i = n then raise Exit;
+        i := !i + 1
+      end
+    with Exit -> ()
+    end;
+    abstract ensures { !i = n } () end;
+    !i
+end"""
+    assert find_structural_problems(code) == []
+    assert any(problem.startswith("Unbalanced blocks: 1 ")
+               for problem in find_structural_problems(code.replace("    end;\n", "    ;\n")))
+
+
+def test_corrector_response_passes_once_the_thinking_block_is_stripped():
+    response = f"""<thinking>
+Root cause: the old code used `use int.Integer`, e.g.
+```whyml
+module Wrong end
+```
+Plan: use int.Int.
+</thinking>
+{MODULE}"""
+    code = clean_whyml_code(strip_thinking(response))
+    assert code.strip() == MODULE
+    assert find_structural_problems(code) == []
+
+
+def test_strip_thinking_removes_every_block():
+    assert strip_thinking("<thinking>a</thinking>x<thinking>\nb\n</thinking> y") == "x y"
+
+
+def category(error: str):
+    classification = classify_capability_gap_locally(error)
+    return classification.split()[0] if classification else None
+
+
+def test_common_why3_errors_are_classified_locally():
+    assert category('File "m.mlw", line 2: Library file not found: int/Integer.mlw') == "EKnow"
+    assert category("unbound type symbol 'integer'") == "PTyp"
+    assert category("unbound function or predicate symbol 'length'") == "EKnow"
+    assert category('File "m.mlw", line 4, characters 2-5:\nsyntax error') == "PSyn"
+    assert category("This term has type bool, but is expected to have type int") == "PTyp"
+    assert category("Prover result is: Timeout (5.00s, 1233 steps).") == "PKnow"
+    assert category("Prover result is: Invalid.") == "SSem"
+    assert category("why3 not found") == "EKnow"
+
+
+def test_pipeline_errors_are_classified_locally():
+    assert category("Structural check failed: Empty output: no WhyML code was produced") == "PSyn"
+    assert category("Structural check failed: Leftover <thinking> text in the WhyML code") == "PSyn"
+    assert category("Semantic mismatch: f(-1) returned 1, Python returned -1") == "PSem"
+
+
+def test_specific_rules_win_over_general_ones():
+    # "unbound type" must not fall through to the generic unbound identifier rule
+    assert category("unbound type constructor 'list'") == "PTyp"
+    # a missing library is reported as unbound module, not as an unbound identifier
+    assert category("unbound module 'array.ArrayLength'") == "EKnow"
+
+
+def test_ghost_rule_needs_a_ghost_error():
+    assert category('File "m.mlw", line 7: This ghost expression cannot be used in a non-ghost context') == "SSem"
+    assert category("Function f must be explicitly marked ghost") == "SSem"
+    # A goal mentioning a ghost variable is classified by its verdict
+    assert category("Goal ghost_sum'vc.\nProver result is: Timeout (5.00s).") == "PKnow"
+    assert category("Goal ghost_sum'vc.\nProver result is: Unknown (other) (0.10s).\nghost") == "PKnow"
+
+
+def test_missing_specification_is_classified_locally():
+    assert category("Structural check failed:\nNo specification: add requires/ensures clauses") == "SSyn"
+
+
+def test_unknown_errors_are_left_to_the_llm():
+    assert classify_capability_gap_locally("something entirely different happened") is None
@@ -0,0 +1,209 @@
+import os
+import sys
+import time
+
+import pytest
+
+import why3_runner
+from why3_runner import normalize_whyml, strip_whyml_comments
+from utils import classify_capability_gap_locally
+
+
+def test_formatting_and_comments_do_not_change_the_normal_form():
+    a = """module M
+  use int.Int
+  (* the identity *)
+  let f (x: int) : int = x
+end"""
+    b = "module M use int.Int let f (x: int) : int = (* unchanged *) x end"
+    assert normalize_whyml(a) == normalize_whyml(b)
+
+
+def test_code_changes_do_change_the_normal_form():
+    assert normalize_whyml("let f (x: int) : int = x") != normalize_whyml("let f (x: int) : int = x + 1")
+
+
+def test_nested_comments_are_removed():
+    assert normalize_whyml("a (* outer (* inner *) still comment *) b") == "a b"
+
+
+def test_strings_and_the_multiplication_operator_are_kept():
+    assert strip_whyml_comments('let s = "(* not a comment *)"') == 'let s = "(* not a comment *)"'
+    assert normalize_whyml("let m = (*) 2 3") == "let m = (*) 2 3"
+
+
+FAKE_WHY3 = '''
+import os, sys, time
+args = sys.argv[1:]
+if "split_vc" in args:
+    # One task file per `goal <name> <behaviour>` line of the module
+    out = args[args.index("-o") + 1]
+    for line in open(args[-1]):
+        if line.startswith("goal "):
+            name = line.split()[1]
+            with open(os.path.join(out, name + ".why"), "w") as f:
+                f.write(f'File "input.mlw", line 1, characters 0-9: {line}')
+    sys.exit(0)
+prover = args[args.index("-P") + 1]
+text = sys.stdin.read()
+if f"{prover}:sleep" in text:
+    time.sleep(30)
+if f"{prover}:valid" in text:
+    print("Goal g'vc. Prover result is: Valid (0.01s).")
+    sys.exit(0)
+print("Goal g'vc. Prover result is: Unknown (0.01s).")
+sys.exit(1)
+'''
+
+FAKE_PROVER = '''
+import os, sys
+text = open(sys.argv[-1]).read()
+with open(os.environ["FAKE_PROVER_LOG"], "a") as f:
+    f.write(text.split()[-2] + "\\n")
+print("Timeout" if "timeout" in text else "Valid" if "valid" in text else "I don't know")
+'''
+
+
+@pytest.fixture
+def fake_why3(tmp_path, monkeypatch):
+    """why3 and alt-ergo stand-ins on PATH, with no warm workers and no proof cache"""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name, script in (("why3", FAKE_WHY3), ("alt-ergo", FAKE_PROVER)):
+        path = bin_dir / name
+        path.write_text(f"#!{sys.executable}\n{script}")
+        path.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_PROVER_LOG", str(tmp_path / "prover.log"))
+    monkeypatch.setattr(why3_runner.why3_workers, "size", 0)
+    monkeypatch.setattr(why3_runner.proof_cache, "enabled", False)
+    monkeypatch.setattr(why3_runner, "toolchain_version", lambda prover: "test")
+    return tmp_path / "prover.log"
+
+
+def proved_goals(log) -> list:
+    return sorted(log.read_text().split()) if log.exists() else []
+
+
+def test_split_goals_are_proved_and_merged(fake_why3):
+    result = why3_runner.prove_split("goal g1 valid\ngoal g2 valid\n", "alt-ergo")
+    assert result.returncode == 0
+    assert why3_runner.VERDICT_PATTERN.findall(result.stdout) == ["Valid", "Valid"]
+    assert proved_goals(fake_why3) == ["g1", "g2"]
+
+
+def test_session_reuses_only_proved_goals(fake_why3):
+    session = {}
+    first = why3_runner.prove_split("goal g1 valid\ngoal g2 timeout\n", "alt-ergo", session)
+    assert first.returncode == 1
+    assert "g2. Prover result is: Timeout" in first.stderr
+    assert len(session) == 1
+
+    second = why3_runner.prove_split("goal g1 valid\ngoal g2 timeout\n", "alt-ergo", session)
+    assert "Goal g1. Prover result is: Valid" in second.stdout and "[unchanged, result reused]" in second.stdout
+    # g1 was proved once and reused; the timed-out g2 was tried both times
+    assert proved_goals(fake_why3) == ["g1", "g2", "g2"]
+
+
+def test_timeouts_stored_by_earlier_versions_are_not_reused(fake_why3, tmp_path):
+    # Sessions checkpointed before only proved goals were kept may still hold timeouts
+    task = tmp_path / "g1.why"
+    task.write_text('File "input.mlw", line 1, characters 0-9: goal g1 timeout\n')
+    session = {why3_runner.task_key(str(task), "alt-ergo"): ["Timeout", 10.0]}
+    result = why3_runner.prove_split("goal g1 timeout\n", "alt-ergo", session)
+    assert "[unchanged, result reused]" not in result.stdout
+    assert proved_goals(fake_why3) == ["g1"]
+
+
+def test_missing_split_prover_is_reported_as_such(fake_why3, monkeypatch):
+    monkeypatch.setitem(why3_runner.SPLIT_PROVER_COMMANDS, "alt-ergo", (["no-such-prover", "{file}"], r"Valid"))
+    result = why3_runner.prove_split("goal g1 valid\n", "alt-ergo")
+    assert result.returncode == 1
+    assert result.stderr.startswith("Prover alt-ergo not found")
+    assert classify_capability_gap_locally(result.stderr).startswith("EKnow - Prover is not installed")
+    assert why3_runner.prove_split("goal g1 valid\n", "vampire").stderr.startswith("Prover vampire not found")
+
+
+def test_prover_vanishing_mid_run_fails_the_goal(tmp_path, monkeypatch):
+    monkeypatch.setitem(why3_runner.SPLIT_PROVER_COMMANDS, "alt-ergo", (["no-such-prover", "{file}"], r"Valid"))
+    task = tmp_path / "g1.why"
+    task.write_text("goal g1")
+    assert why3_runner.prove_task(str(task), "alt-ergo")[0] == "Failure"
+
+
+def test_portfolio_returns_the_first_prover_to_prove_everything(fake_why3):
+    start = time.monotonic()
+    result, prover = why3_runner.run_portfolio("slow:sleep fast:valid slow:valid", ["slow", "fast"])
+    assert prover == "fast"
+    assert "Valid" in result.stdout
+    assert time.monotonic() - start < 10  # the sleeping prover was killed, not waited for
+
+
+def test_portfolio_without_a_winner_returns_the_first_listed_result(fake_why3):
+    result, prover = why3_runner.run_portfolio("b:nothing", ["a", "b"])
+    assert prover is None
+    assert result.returncode == 1
+    assert result.args[:4] == ["why3", "prove", "-P", "a"]
+
+
+def test_prove_whyml_races_the_portfolio(fake_why3, monkeypatch):
+    monkeypatch.setattr(why3_runner, "prover_portfolio", ["z3", "cvc5"])
+    monkeypatch.setattr(why3_runner, "split_goals", False)
+    result, prover = why3_runner.prove_whyml("module M end (* cvc5:valid *)")
+    assert (result.returncode, prover) == (0, "cvc5")
+
+
+PROVE = ("prove", "-P", "alt-ergo")
+
+
+def wait_for_idle(pool, count: int):
+    deadline = time.monotonic() + 10
+    while len(pool._idle[PROVE]) != count or pool._starting[PROVE]:
+        assert time.monotonic() < deadline, "the pool was not refilled"
+        time.sleep(0.01)
+
+
+def test_taken_workers_are_replaced_and_read_the_module_from_stdin(fake_why3):
+    pool = why3_runner.Why3WorkerPool(1)
+    try:
+        cold = pool.take(list(PROVE))
+        wait_for_idle(pool, 1)
+        warm = pool._idle[PROVE][0]
+        assert pool.take(list(PROVE)) is warm
+        wait_for_idle(pool, 1)
+        result = why3_runner.communicate(warm, "module M end (* alt-ergo:valid *)", timeout=10)
+        assert result.returncode == 0 and "Valid" in result.stdout
+        assert why3_runner.communicate(cold, "module M end", timeout=10).returncode == 1
+    finally:
+        pool.close()
+    assert not pool._idle[PROVE]
+
+
+def test_dead_idle_workers_are_skipped(fake_why3):
+    pool = why3_runner.Why3WorkerPool(1)
+    try:
+        why3_runner.communicate(pool.take(list(PROVE)), "", timeout=10)
+        wait_for_idle(pool, 1)
+        dead = pool._idle[PROVE][0]
+        dead.kill()
+        dead.wait()
+        pool.set_size(0)  # no replacement is started, so the pool is left empty
+        pool._idle[PROVE].append(dead)
+        proc = pool.take(list(PROVE))
+        assert proc is not dead
+        why3_runner.communicate(proc, "", timeout=10)
+    finally:
+        pool.close()
+
+
+def test_timed_out_workers_are_killed(fake_why3):
+    proc = why3_runner.Why3WorkerPool(0).take(list(PROVE))
+    with pytest.raises(why3_runner.subprocess.TimeoutExpired):
+        why3_runner.communicate(proc, "alt-ergo:sleep", timeout=0.5)
+    assert proc.poll() is not None
+
+
+def test_missing_why3_is_reported_by_take(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", str(tmp_path))
+    with pytest.raises(FileNotFoundError):
+        why3_runner.Why3WorkerPool(0).take(list(PROVE))
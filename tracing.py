@@ -0,0 +1,177 @@
+import cProfile
+import contextvars
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+# Open JSONL trace file, or None when tracing is off
+_sink = None
+_sink_lock = threading.Lock()
+
+# Directory receiving one merged cProfile file per node, or None when profiling is off
+_profile_dir = None
+# Only one cProfile profiler can be active per process, so parallel nodes take turns
+_profiler_lock = threading.Lock()
+_profiles = {}
+_unprofiled = defaultdict(int)
+
+# Per event name: count, total and maximum seconds, and token totals
+_summary = defaultdict(lambda: defaultdict(float))
+
+# Node (and its retry index) that the current LLM or why3 call belongs to
+_current_node = contextvars.ContextVar("current_node", default=(None, None))
+
+
+def start_tracing(path: str = None, profile_dir: str = None):
+    """Write trace events to path (JSONL) and/or cProfile output per node to profile_dir"""
+    global _sink, _profile_dir
+    if path:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        _sink = open(path, "a")
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        _profile_dir = profile_dir
+
+
+def tracing_enabled() -> bool:
+    return _sink is not None or _profile_dir is not None
+
+
+def emit(event: str, name: str, start: float, end: float, **fields):
+    """Writes one event to the trace file and adds it to the summary"""
+    node, retry = _current_node.get()
+    record = {
+        "event": event,
+        "name": name,
+        "start": round(start, 6),
+        "end": round(end, 6),
+        "seconds": round(end - start, 6),
+        "node": node,
+        "retry": retry,
+        "thread": threading.current_thread().name,
+        **fields,
+    }
+    with _sink_lock:
+        stats = _summary[f"{event}:{name}"]
+        stats["count"] += 1
+        stats["seconds"] += end - start
+        stats["max_seconds"] = max(stats["max_seconds"], end - start)
+        for key in ("input_tokens", "output_tokens"):
+            stats[key] += fields.get(key) or 0
+        if _sink is not None:
+            _sink.write(json.dumps(record, default=str) + "\n")
+            _sink.flush()
+
+
+@contextmanager
+def span(event: str, name: str, **fields):
+    """
+    Times the enclosed block and emits it as one event. The yielded dict can
+    be filled with more fields (token usage, return codes, ...) inside the block.
+    Does nothing when tracing is off.
+    """
+    if not tracing_enabled():
+        yield {}
+        return
+    start = time.time()
+    fields = dict(fields)
+    try:
+        yield fields
+    except BaseException as e:
+        fields["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        emit(event, name, start, time.time(), **fields)
+
+
+def in_context(fn):
+    """
+    fn bound to the caller's context, for work handed to other threads: their
+    LLM and why3 events are then traced under the node that started them.
+    Each call runs in its own copy, so the result can be used by many threads at once.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+def traced_node(name: str, node):
+    """Wraps a graph node so each run is emitted as a "node" event and, if enabled, profiled"""
+    @wraps(node)
+    def wrapper(state):
+        if not tracing_enabled():
+            return node(state)
+        token = _current_node.set((name, state.get("retry_count", 0)))
+        try:
+            with span("node", name):
+                return _profiled(name, node, state)
+        finally:
+            _current_node.reset(token)
+    return wrapper
+
+
+def _profiled(name: str, node, state):
+    if _profile_dir is None:
+        return node(state)
+    if not _profiler_lock.acquire(blocking=False):
+        # Another node is being profiled in parallel
+        with _sink_lock:
+            _unprofiled[name] += 1
+        return node(state)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            return node(state)
+        finally:
+            profiler.disable()
+    finally:
+        _profiler_lock.release()
+        with _sink_lock:
+            if name in _profiles:
+                _profiles[name].add(profiler)
+            else:
+                _profiles[name] = pstats.Stats(profiler)
+            _profiles[name].dump_stats(os.path.join(_profile_dir, f"{name}.prof"))
+
+
+def print_trace_summary(top: int = 5):
+    """Prints time per node, LLM and why3 event name, and the top functions of each profiled node"""
+    if not _summary:
+        return
+    import pandas as pd
+
+    rows = [{
+        "Event": key,
+        "Count": int(stats["count"]),
+        "Total s": round(stats["seconds"], 2),
+        "Mean s": round(stats["seconds"] / stats["count"], 3),
+        "Max s": round(stats["max_seconds"], 2),
+        "Input tokens": int(stats["input_tokens"]),
+        "Output tokens": int(stats["output_tokens"]),
+    } for key, stats in sorted(_summary.items())]
+
+    print("\n" + "=" * 120)
+    print("TRACE SUMMARY")
+    print("=" * 120)
+    print(pd.DataFrame(rows).to_string(index=False))
+
+    for name, stats in sorted(_profiles.items()):
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats("cumulative").print_stats(top)
+        print(f"\n--- Profile: {name} ({os.path.join(_profile_dir, name + '.prof')}) ---")
+        print("\n".join(line for line in out.getvalue().splitlines() if line.strip()))
+    for name, count in sorted(_unprofiled.items()):
+        print(f"{name}: {count} runs not profiled (another node was being profiled in parallel)")
+    print("=" * 120)
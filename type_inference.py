@@ -0,0 +1,325 @@
+import ast
+
+# Confidence levels reported by annotate_types
+HIGH = "high"        # every parameter and return type was inferred
+PARTIAL = "partial"  # some types could not be inferred
+NONE = "none"        # the input could not be analysed at all
+
+SIMPLE_TYPES = {"int", "float", "bool", "str"}
+
+
+class TypeVar:
+    """An unknown type, resolved by unification"""
+
+    def __init__(self):
+        self.ref = None
+
+
+def resolve(t):
+    while isinstance(t, TypeVar) and t.ref is not None:
+        t = t.ref
+    return t
+
+
+def can_fall_through(statements: list) -> bool:
+    """True if running the statements can reach their end instead of returning or raising"""
+    for stmt in statements:
+        if isinstance(stmt, (ast.Return, ast.Raise)):
+            return False
+        if isinstance(stmt, ast.If) and not (can_fall_through(stmt.body) or can_fall_through(stmt.orelse)):
+            return False
+        if isinstance(stmt, ast.While) and isinstance(stmt.test, ast.Constant) and stmt.test.value \
+                and not any(isinstance(node, ast.Break) for node in ast.walk(stmt)):
+            return False
+    return True
+
+
+class FunctionInference:
+    """
+    Infers parameter and return types of one function from literals,
+    arithmetic, len(), indexing, comparisons, loops and return statements.
+    Types are "int", "float", "bool", "str", "None", or ("list", element).
+    """
+
+    def __init__(self, node: ast.FunctionDef, signatures: dict):
+        self.node = node
+        self.signatures = signatures
+        self.env = {}
+        self.complete = True
+        self.returns_value = False
+        self.returns_none = False
+        self.params, self.ret = signatures[node.name]
+        for arg, t in zip(node.args.args, self.params):
+            self.env[arg.arg] = t
+
+    def fail(self):
+        self.complete = False
+        return TypeVar()
+
+    def unify(self, a, b):
+        a, b = resolve(a), resolve(b)
+        if a is b:
+            return
+        if isinstance(a, TypeVar):
+            a.ref = b
+        elif isinstance(b, TypeVar):
+            b.ref = a
+        elif isinstance(a, tuple) and isinstance(b, tuple) and a[0] == b[0]:
+            self.unify(a[1], b[1])
+        elif a != b:
+            # Conflicting uses, e.g. int and float mixed: leave it to the LLM
+            self.complete = False
+
+    def var(self, name: str):
+        if name not in self.env:
+            self.env[name] = TypeVar()
+        return self.env[name]
+
+    def run(self):
+        if self.node.args.vararg or self.node.args.kwarg or self.node.args.kwonlyargs:
+            self.complete = False
+        for stmt in self.node.body:
+            self.stmt(stmt)
+        # Running off the end returns None, e.g. after an if/elif without else or a search loop
+        if can_fall_through(self.node.body):
+            self.returns_none = True
+        if not self.returns_value:
+            self.unify(self.ret, "None")
+
+    def stmt(self, stmt):
+        if isinstance(stmt, ast.Assign):
+            value = self.expr(stmt.value)
+            for target in stmt.targets:
+                self.assign(target, stmt.value, value)
+        elif isinstance(stmt, ast.AnnAssign):
+            declared = parse_annotation(stmt.annotation)
+            target = self.expr(stmt.target) if not isinstance(stmt.target, ast.Name) else self.var(stmt.target.id)
+            self.unify(target, declared if declared is not None else self.fail())
+            if stmt.value is not None:
+                self.unify(target, self.expr(stmt.value))
+        elif isinstance(stmt, ast.AugAssign):
+            target = self.var(stmt.target.id) if isinstance(stmt.target, ast.Name) else self.expr(stmt.target)
+            value = self.expr(stmt.value)
+            if isinstance(stmt.op, ast.Div):
+                self.unify(target, "float")
+            self.unify(target, value)
+        elif isinstance(stmt, ast.Return):
+            if stmt.value is None or (isinstance(stmt.value, ast.Constant) and stmt.value.value is None):
+                self.returns_none = True
+            else:
+                self.returns_value = True
+                self.unify(self.ret, self.expr(stmt.value))
+        elif isinstance(stmt, (ast.If, ast.While)):
+            self.expr(stmt.test)
+            for child in stmt.body + stmt.orelse:
+                self.stmt(child)
+        elif isinstance(stmt, ast.For):
+            if not isinstance(stmt.target, ast.Name):
+                self.fail()
+            elif isinstance(stmt.iter, ast.Call) and isinstance(stmt.iter.func, ast.Name) and stmt.iter.func.id == "range":
+                for arg in stmt.iter.args:
+                    self.unify(self.expr(arg), "int")
+                self.unify(self.var(stmt.target.id), "int")
+            else:
+                self.unify(self.expr(stmt.iter), ("list", self.var(stmt.target.id)))
+            for child in stmt.body + stmt.orelse:
+                self.stmt(child)
+        elif isinstance(stmt, ast.Expr):
+            if not isinstance(stmt.value, ast.Constant):  # skip docstrings
+                self.expr(stmt.value)
+        elif isinstance(stmt, ast.Assert):
+            self.expr(stmt.test)
+        elif not isinstance(stmt, (ast.Pass, ast.Break, ast.Continue, ast.Raise)):
+            self.fail()
+
+    def assign(self, target, value_node, value):
+        if isinstance(target, ast.Name):
+            self.unify(self.var(target.id), value)
+        elif isinstance(target, ast.Subscript):
+            self.unify(self.expr(target), value)
+        elif isinstance(target, ast.Tuple) and isinstance(value_node, ast.Tuple) \
+                and len(target.elts) == len(value_node.elts):
+            for element, element_node in zip(target.elts, value_node.elts):
+                self.assign(element, element_node, self.expr(element_node))
+        else:
+            self.fail()
+
+    def expr(self, e):
+        if isinstance(e, ast.Constant):
+            if isinstance(e.value, bool):
+                return "bool"
+            if e.value is None:
+                return "None"
+            name = type(e.value).__name__
+            return name if name in SIMPLE_TYPES else self.fail()
+        if isinstance(e, ast.Name):
+            if e.id in self.env:
+                return self.env[e.id]
+            if e.id in ("True", "False"):
+                return "bool"
+            return self.fail()
+        if isinstance(e, ast.BinOp):
+            left, right = self.expr(e.left), self.expr(e.right)
+            if isinstance(e.op, ast.Div):
+                self.unify(left, right)
+                return "float"
+            if isinstance(e.op, ast.Mult) and (resolve(left) == "str" or resolve(right) == "str"):
+                return self.fail()
+            self.unify(left, right)
+            return left
+        if isinstance(e, ast.UnaryOp):
+            operand = self.expr(e.operand)
+            return "bool" if isinstance(e.op, ast.Not) else operand
+        if isinstance(e, ast.BoolOp):
+            values = [self.expr(v) for v in e.values]
+            for value in values[1:]:
+                self.unify(values[0], value)
+            return values[0]
+        if isinstance(e, ast.Compare):
+            left = self.expr(e.left)
+            for op, comparator in zip(e.ops, e.comparators):
+                right = self.expr(comparator)
+                if isinstance(op, (ast.In, ast.NotIn)):
+                    self.unify(right, ("list", left))
+                elif not isinstance(op, (ast.Is, ast.IsNot)):
+                    self.unify(left, right)
+            return "bool"
+        if isinstance(e, ast.IfExp):
+            self.expr(e.test)
+            body = self.expr(e.body)
+            self.unify(body, self.expr(e.orelse))
+            return body
+        if isinstance(e, ast.Subscript):
+            value = self.expr(e.value)
+            if isinstance(e.slice, ast.Slice):
+                for part in (e.slice.lower, e.slice.upper, e.slice.step):
+                    if part is not None:
+                        self.unify(self.expr(part), "int")
+                return value
+            self.unify(self.expr(e.slice), "int")
+            element = TypeVar()
+            self.unify(value, ("list", element))
+            return element
+        if isinstance(e, ast.List):
+            element = TypeVar()
+            for item in e.elts:
+                self.unify(element, self.expr(item))
+            return ("list", element)
+        if isinstance(e, ast.Call):
+            return self.call(e)
+        return self.fail()
+
+    def call(self, e):
+        if not isinstance(e.func, ast.Name) or e.keywords:
+            return self.fail()
+        name = e.func.id
+        args = [self.expr(arg) for arg in e.args]
+        if name in self.signatures:
+            params, ret = self.signatures[name]
+            if len(params) != len(args):
+                return self.fail()
+            for param, arg in zip(params, args):
+                self.unify(param, arg)
+            return ret
+        if name == "len" and len(args) == 1:
+            self.unify(args[0], ("list", TypeVar()))
+            return "int"
+        if name in ("abs", "min", "max") and args:
+            if len(args) == 1 and name != "abs":
+                element = TypeVar()
+                self.unify(args[0], ("list", element))
+                return element
+            for arg in args[1:]:
+                self.unify(args[0], arg)
+            return args[0]
+        if name == "sum" and len(args) == 1:
+            element = TypeVar()
+            self.unify(args[0], ("list", element))
+            return element
+        if name in ("int", "float", "bool", "str") and len(args) == 1:
+            return name
+        return self.fail()
+
+
+def parse_annotation(node):
+    """Type of a simple annotation (int, List[int], list[int], ...) or None"""
+    if isinstance(node, ast.Name) and node.id in SIMPLE_TYPES:
+        return node.id
+    if isinstance(node, ast.Constant) and node.value is None:
+        return "None"
+    if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id in ("list", "List"):
+        element = parse_annotation(node.slice)
+        return ("list", element) if element is not None else None
+    return None
+
+
+def render(t):
+    """Python annotation text for an inferred type, or None if still unknown"""
+    t = resolve(t)
+    if isinstance(t, TypeVar):
+        return None
+    if isinstance(t, tuple):
+        element = render(t[1])
+        return f"list[{element}]" if element else None
+    return t
+
+
+def annotate_types(source: str) -> tuple:
+    """
+    Adds parameter and return type hints to every function in the source,
+    using local AST inference instead of the LLM. Existing annotations are kept.
+    Returns (annotated_source, confidence) where confidence is HIGH only if
+    every function was fully typed; otherwise the result should not be used.
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return source, NONE
+
+    functions = [node for node in tree.body if isinstance(node, ast.FunctionDef)]
+    if not functions:
+        return source, NONE
+
+    confidence = HIGH
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.Import, ast.ImportFrom)) and \
+                not (isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant)):
+            confidence = PARTIAL
+
+    # Signatures first, so calls between functions and recursion unify with them
+    signatures = {}
+    for function in functions:
+        params = []
+        for arg in function.args.args:
+            declared = parse_annotation(arg.annotation) if arg.annotation else None
+            params.append(declared if declared is not None else TypeVar())
+        declared_return = parse_annotation(function.returns) if function.returns else None
+        signatures[function.name] = (params, declared_return if declared_return is not None else TypeVar())
+
+    inferences = []
+    for function in functions:
+        inference = FunctionInference(function, signatures)
+        inference.run()
+        inferences.append(inference)
+
+    for function, inference in zip(functions, inferences):
+        params, ret = signatures[function.name]
+        for arg, t in zip(function.args.args, params):
+            rendered = render(t)
+            if arg.annotation is None and rendered:
+                arg.annotation = ast.parse(rendered, mode="eval").body
+            if rendered is None and arg.annotation is None:
+                inference.complete = False
+
+        rendered = render(ret)
+        if rendered and inference.returns_none and inference.returns_value and rendered != "None":
+            rendered = f"{rendered} | None"
+        if function.returns is None and rendered:
+            function.returns = ast.parse(rendered, mode="eval").body
+        if rendered is None and function.returns is None:
+            inference.complete = False
+
+        if not inference.complete:
+            confidence = PARTIAL
+
+    return ast.unparse(tree), confidence
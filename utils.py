@@ -1,9 +1,24 @@
 import re
-import pandas as pd
+import threading
+from collections import Counter
 from langchain_core.messages import SystemMessage, HumanMessage
 
 from state import State
-from config import llm, CAPABILITY_GAP_PROMPT
+from config import CAPABILITY_GAP_PROMPT, LLM_DEADLINES
+from llm_client import invoke_llm
+from why3_runner import strip_whyml_comments
+
+# Keywords opening a block closed by `end`
+WHYML_BLOCK_OPENERS = {"module", "theory", "scope", "begin", "match", "try", "loop", "abstract"}
+
+# Clauses that give a WhyML module something to prove
+WHYML_SPEC_CLAUSES = {"requires", "ensures", "invariant", "variant"}
+
+
+def strip_thinking(text: str) -> str:
+    """Remove the <thinking> blocks that precede the code in error_corrector responses"""
+    return re.sub(r"<thinking>.*?</thinking>", "", text, flags=re.DOTALL).strip()
+
 
 def clean_whyml_code(code: str) -> str:
     """Remove markdown code blocks and extra formatting from WhyML code"""
@@ -36,17 +51,170 @@ def clean_whyml_code(code: str) -> str:
     return '\n'.join(whyml_lines).strip()
 
 
+def whyml_tokens(code: str) -> list:
+    """Identifier-like tokens of WhyML code, ignoring comments and string literals"""
+    code = strip_whyml_comments(code)
+    code = re.sub(r'"(?:\\.|[^"\\])*"', '""', code)
+    return re.findall(r"[A-Za-z_][A-Za-z0-9_']*", code)
+
+
+def has_specification(code: str) -> bool:
+    """True when the WhyML states at least one requires, ensures, invariant or variant clause"""
+    return not WHYML_SPEC_CLAUSES.isdisjoint(whyml_tokens(code))
+
+
+def whyml_block_depths(code: str) -> list:
+    """Nesting depth after each module/begin/match/... or end keyword, in order"""
+    depth = 0
+    depths = []
+    for token in whyml_tokens(code):
+        if token in WHYML_BLOCK_OPENERS:
+            depth += 1
+            depths.append(depth)
+        elif token == "end":
+            depth -= 1
+            depths.append(depth)
+    return depths
+
+
+def whyml_module_complete(text: str) -> bool:
+    """
+    True once streamed LLM output holds a closed top-level module (or theory)
+    followed by text that is not another module, e.g. an explanation or a
+    closing ``` fence. Used to stop a stream early.
+    """
+    if "<thinking>" in text:
+        if "</thinking>" not in text:
+            return False
+        text = text.split("</thinking>", 1)[1]
+    code = strip_whyml_comments(text)
+    code = re.sub(r'"(?:\\.|[^"\\])*"', '""', code)
+
+    depth = 0
+    for match in re.finditer(r"[A-Za-z_][A-Za-z0-9_']*", code):
+        token = match.group()
+        if token in WHYML_BLOCK_OPENERS:
+            if depth == 0 and token not in ("module", "theory"):
+                return False
+            depth += 1
+        elif token == "end":
+            depth -= 1
+            if depth < 0:
+                return False
+            if depth == 0:
+                trailing = code[match.end():].lstrip()
+                if trailing.startswith("```"):
+                    return True
+                # A short tail may still be the start of another module
+                if len(trailing) >= 8 and not re.match(r"(module|theory)\b", trailing):
+                    return True
+    return False
+
+
+def find_structural_problems(code: str) -> list:
+    """
+    Cheap local checks for WhyML output that cannot possibly type-check:
+    empty output, leftover markdown or <thinking> text, and unbalanced
+    module/end blocks. Code without any specification is rejected too, as it
+    would verify trivially. Returns a list of problem descriptions.
+    """
+    if not code or not code.strip():
+        return ["Empty output: no WhyML code was produced"]
+
+    problems = []
+    if "```" in code or re.search(r"^\s*#{1,6}\s", code, re.MULTILINE):
+        problems.append("Leftover markdown formatting in the WhyML code")
+    if re.search(r"</?thinking>", code):
+        problems.append("Leftover <thinking> text in the WhyML code")
+
+    tokens = whyml_tokens(code)
+    if "module" not in tokens and "theory" not in tokens:
+        problems.append("No `module ... end` block found")
+    elif not has_specification(code):
+        problems.append("No specification: add requires/ensures clauses and loop invariants describing "
+                        "what the Python function computes, otherwise the proof shows nothing")
+    depths = whyml_block_depths(code)
+    if any(depth < 0 for depth in depths):
+        problems.append("Unbalanced blocks: `end` without a matching module/begin/match/try/loop/abstract")
+    elif depths and depths[-1] != 0:
+        problems.append(f"Unbalanced blocks: {depths[-1]} module/begin/match/try/loop/abstract block(s) not closed with `end`")
+    return problems
+
+
+# Local rules mapping common Why3 messages to capability gap categories.
+# Checked in order, so more specific patterns come first.
+CAPABILITY_GAP_RULES = [
+    (r"why3 (command )?not found", "EKnow - Why3 is not installed or not on PATH"),
+    (r"^Prover \S+ not found", "EKnow - Prover is not installed or not on PATH"),
+    (r"^Semantic mismatch", "PSem - WhyML program computes different results from the Python function"),
+    (r"Structural check failed:\s*Empty output", "PSyn - No WhyML code was produced for the Python function"),
+    (r"Structural check failed:.*(markdown|<thinking>)", "PSyn - Non-WhyML text (markdown or reasoning) left in the generated code"),
+    (r"Structural check failed:.*No specification",
+     "SSyn - Python behaviour not stated as a WhyML specification (no requires/ensures/invariant)"),
+    (r"Structural check failed:.*(Unbalanced|No `module)", "PSyn - Python structure not translated into balanced WhyML module/end blocks"),
+    (r"Library file not found|No (library|module or theory) (file )?named|[Uu]nbound (module|theory|namespace)",
+     "EKnow - Imported Why3 module or theory does not exist; wrong `use` path"),
+    (r"[Uu]nbound type( constructor| symbol)?",
+     "PTyp - Python type translated to a Why3 type that is not defined or imported"),
+    (r"[Uu]nbound (function or predicate |program function |variable |symbol )?(symbol )?'?[A-Za-z_]",
+     "EKnow - Identifier not in scope; missing `use` import or undeclared Why3 function"),
+    (r"[Ss]yntax error", "PSyn - Python syntax not translated to valid WhyML syntax"),
+    (r"has type .*,? but is expected to have type|[Tt]ype mismatch|[Ii]ncompatible type",
+     "PTyp - Python value translated with a mismatched Why3 program type"),
+    (r"may not terminate|non-?terminat|must be annotated with .?diverges",
+     "PKnow - Termination not established; loop or recursion needs a variant"),
+    (r"[Dd]uplicate (definition|declaration)|already (declared|defined)|[Cc]lash with previous",
+     "PSyn - Duplicate declaration in the translated module"),
+    (r"Prover result is: (Timeout|Unknown|OutOfMemory|StepLimitExceeded)",
+     "PKnow - Prover could not discharge a goal automatically with the given specification"),
+    (r"Prover result is: Invalid",
+     "SSem - Prover found a specification goal false for the translated program"),
+    # After the verdicts: stdout can mention ghost code in goal names or messages
+    (r"[Gg]host (code|expression|write|variable|function|modification|result)|non-ghost|"
+     r"must be (explicitly )?(marked|declared) ghost",
+     "SSem - Ghost and program code mixed incorrectly in the specification"),
+]
+
+# How each classification was obtained (rule, llm, keyword, unclassified, failed)
+_classification_stats = Counter()
+_classification_lock = threading.Lock()
+
+
+def _count_classification(path: str):
+    with _classification_lock:
+        _classification_stats[path] += 1
+
+
+def classification_stats() -> dict:
+    """Number of capability gap classifications answered by each path"""
+    with _classification_lock:
+        return dict(_classification_stats)
+
+
+def classify_capability_gap_locally(error_message: str):
+    """Classify the error with the local rules, or return None if no rule matches"""
+    for pattern, classification in CAPABILITY_GAP_RULES:
+        if re.search(pattern, error_message, re.DOTALL):
+            return classification
+    return None
+
+
 def classify_capability_gap(error_message: str) -> str:
-    """Classify the error into capability gap categories"""
-    if not error_message or error_message == "Timeout":
+    """Classify the error into capability gap categories, asking the LLM only when no local rule matches"""
+    if not error_message or error_message.startswith("Timeout"):
         return "N/A"
 
+    classification = classify_capability_gap_locally(error_message)
+    if classification:
+        _count_classification("rule")
+        return classification
+
     # Create classification prompt
     system_msg = SystemMessage(content=CAPABILITY_GAP_PROMPT.format(error=error_message))
     human_msg = HumanMessage(content="Classify this error")
 
     try:
-        response = llm.invoke([system_msg, human_msg])
+        response = invoke_llm([system_msg, human_msg], deadline=LLM_DEADLINES["classify_capability_gap"])
         # Extract the full response (category + explanation)
         classification = response.content.strip()
 
@@ -57,48 +225,52 @@ def classify_capability_gap(error_message: str) -> str:
         # Check if response starts with a valid category
         for category in valid_categories:
             if classification.startswith(category):
+                _count_classification("llm")
                 return classification  # Return full response with explanation
 
         # If no valid category found at start, search in the response
         for category in valid_categories:
             if category in classification:
+                _count_classification("llm")
                 return classification
 
         # Fallback classification based on keywords
         if "module" in error_message.lower() and "not found" in error_message.lower():
+            _count_classification("keyword")
             return "EKnow - Module not found in Why3 environment/library"
         elif "type" in error_message.lower():
+            _count_classification("keyword")
             return "TTyp - Type translation issue"
         elif "syntax" in error_message.lower():
+            _count_classification("keyword")
             return "PSyn - Syntax translation issue"
         else:
+            _count_classification("unclassified")
             return "Unknown - Could not classify error"
     except Exception:
+        _count_classification("failed")
         return "Unknown - Classification failed"
 
 
 def create_output_table(state: State):
-    """Create output table with all collected data"""
-    data = {
-        "Original Python": [state.get("original_python", "")],
-        "Well-typed Python": [state.get("typed_python", "")],
-        "Number of Tries": [len(state.get("whyml_attempts", []))]
-    }
-
-    whyml_attempts = state.get("whyml_attempts", [])
-    for i, attempt in enumerate(whyml_attempts):
-        data[f"WhyML Attempt {i+1}"] = [attempt]
+    """
+    Print one row per attempt of the run. Every attempt is also appended to
+    the results store as it happens (see results_store.py).
+    """
+    import pandas as pd
 
     errors = state.get("errors", [])
-    for i, error in enumerate(errors):
-        data[f"Error {i+1}"] = [error]
-
     capability_gaps = state.get("capability_gaps", [])
-    for i, gap in enumerate(capability_gaps):
-        data[f"Capability Gap {i+1}"] = [gap]
-
-    df = pd.DataFrame(data)
-    df.to_csv("whyml_conversion_results.csv", index=False)
+    rows = []
+    for i, attempt in enumerate(state.get("whyml_attempts", [])):
+        error = errors[i] if i < len(errors) else ""
+        rows.append({
+            "Attempt": i + 1,
+            "Status": "failed" if error else "verified",
+            "Capability Gap": capability_gaps[i] if i < len(capability_gaps) else "",
+            "Error": error.strip().splitlines()[-1] if error.strip() else "",
+            "WhyML": attempt,
+        })
 
     print("\n" + "="*120)
     print("CONVERSION RESULTS TABLE")
@@ -108,7 +280,32 @@ def create_output_table(state: State):
     pd.set_option('display.width', None)
     pd.set_option('display.max_colwidth', 40)
 
-    print(df.to_string(index=False))
+    if rows:
+        print(pd.DataFrame(rows).to_string(index=False))
+    verified = state.get("execution_success", False)
+    provers = state.get("provers", [])
+    print(f"{'Verified' if verified else 'Not verified'} after {len(rows)} attempts"
+          + (f" (winning prover: {provers[-1]})" if verified and provers and provers[-1] else ""))
+    print("="*120)
+
+
+def create_batch_table(rows: list):
+    """Create a summary table with one row per file processed in batch mode"""
+    import pandas as pd
+
+    df = pd.DataFrame(rows)
+    df.to_csv("whyml_batch_results.csv", index=False)
+
+    print("\n" + "="*120)
+    print("BATCH RESULTS TABLE")
+    print("="*120)
+
+    pd.set_option('display.max_columns', None)
+    pd.set_option('display.width', None)
+    pd.set_option('display.max_colwidth', 40)
+
+    print(df.drop(columns=["Final WhyML"]).to_string(index=False))
     print("="*120)
-    print("Results saved to: whyml_conversion_results.csv")
-    print("\nNote: Full content available in the CSV file")
\ No newline at end of file
+    verified = sum(1 for row in rows if row["Verified"])
+    print(f"Verified {verified}/{len(rows)} files")
+    print("Results saved to: whyml_batch_results.csv")
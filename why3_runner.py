@@ -0,0 +1,578 @@
+import atexit
+import os
+import queue
+import re
+import signal
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from cache import SQLiteCache, make_key
+from cassette import active_cassette
+from tracing import span, in_context
+from config import (
+    MAX_CONCURRENT_WHY3,
+    WHY3_PROVER,
+    WHY3_TIMEOUT,
+    WHY3_WARM_WORKERS,
+    PROVER_PORTFOLIO,
+    SPLIT_GOALS,
+    SPLIT_GOAL_TIMELIMIT,
+    SPLIT_PROVER_COMMANDS,
+    PROOF_CACHE_ENABLED,
+    PROOF_CACHE_PATH,
+    PROOF_CACHE_MAX_ENTRIES,
+    PROOF_CACHE_MAX_AGE_DAYS,
+)
+
+# Bounds the number of why3 processes running across all pipelines
+_why3_slots = threading.BoundedSemaphore(MAX_CONCURRENT_WHY3)
+
+# Prover results keyed on normalised WhyML, prover, toolchain version and limits
+proof_cache = SQLiteCache(PROOF_CACHE_PATH, max_entries=PROOF_CACHE_MAX_ENTRIES,
+                          max_age_days=PROOF_CACHE_MAX_AGE_DAYS, enabled=PROOF_CACHE_ENABLED)
+
+
+# Provers raced against each other by prove_whyml; empty means WHY3_PROVER alone
+prover_portfolio = list(PROVER_PORTFOLIO)
+
+# Whether prove_whyml splits the module into individual goals proved in parallel
+split_goals = SPLIT_GOALS
+
+# Matches the per-goal verdicts printed by `why3 prove`
+VERDICT_PATTERN = re.compile(r"Prover result is: (\w+)")
+
+# Runs and seconds of type checks and proofs since the last reset
+_usage = Counter()
+_usage_lock = threading.Lock()
+
+
+def why3_usage() -> dict:
+    """Type-check and proof counters since the last reset_why3_usage()"""
+    with _usage_lock:
+        return dict(_usage)
+
+
+def reset_why3_usage():
+    with _usage_lock:
+        _usage.clear()
+
+
+def set_prover_portfolio(provers: list):
+    """Change the provers run in parallel by prove_whyml"""
+    global prover_portfolio
+    prover_portfolio = list(provers)
+
+
+def set_split_goals(enabled: bool):
+    """Turn per-goal parallel proving on or off"""
+    global split_goals
+    split_goals = enabled
+
+
+def set_why3_concurrency(limit: int):
+    """Change the maximum number of concurrent why3 processes"""
+    global _why3_slots
+    _why3_slots = threading.BoundedSemaphore(max(1, limit))
+
+
+def set_proof_cache_enabled(enabled: bool):
+    """Turn the proof result cache on or off"""
+    proof_cache.enabled = enabled
+
+
+class Why3WorkerPool:
+    """
+    why3 processes started ahead of time, a few per command line, each having
+    loaded its configuration and prover drivers and now blocked reading a
+    module from stdin. Taking a worker skips process start-up, and the module
+    is piped in from memory instead of a temporary file. A replacement is
+    started in the background for every worker taken.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._lock = threading.Lock()
+        self._idle = defaultdict(deque)
+        self._starting = Counter()
+
+    def _spawn(self, args: tuple) -> subprocess.Popen:
+        return subprocess.Popen(['why3', *args, '-F', 'whyml', '-'],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                text=True, start_new_session=(os.name == "posix"))
+
+    def _refill(self, args: tuple):
+        with self._lock:
+            missing = self.size - len(self._idle[args]) - self._starting[args]
+            self._starting[args] += max(0, missing)
+        for _ in range(missing):
+            try:
+                proc = self._spawn(args)
+            except OSError:
+                proc = None
+            with self._lock:
+                self._starting[args] -= 1
+                if proc is not None:
+                    self._idle[args].append(proc)
+
+    def take(self, args: list) -> subprocess.Popen:
+        """
+        An idle worker running `why3 <args>` on stdin, or a new process if none
+        is ready. Raises FileNotFoundError if why3 is not installed.
+        """
+        args = tuple(args)
+        proc = None
+        with self._lock:
+            idle = self._idle[args]
+            while idle and proc is None:
+                candidate = idle.popleft()
+                if candidate.poll() is None:
+                    proc = candidate
+        if proc is None:
+            proc = self._spawn(args)
+        if self.size > 0:
+            threading.Thread(target=self._refill, args=(args,), daemon=True).start()
+        return proc
+
+    def set_size(self, size: int):
+        """Change the number of idle workers kept per command; extra idle workers are stopped"""
+        extra = []
+        with self._lock:
+            self.size = max(0, size)
+            for idle in self._idle.values():
+                while len(idle) > self.size:
+                    extra.append(idle.pop())
+        for proc in extra:
+            _kill(proc)
+
+    def close(self):
+        """Stops every idle worker"""
+        self.set_size(0)
+
+
+# Shared by every pipeline; idle workers are stopped when the process exits
+why3_workers = Why3WorkerPool(WHY3_WARM_WORKERS)
+atexit.register(why3_workers.close)
+
+
+def set_why3_workers(size: int):
+    """Change the number of why3 processes kept waiting per command (0 starts them on demand)"""
+    why3_workers.set_size(size)
+
+
+def communicate(proc: subprocess.Popen, whyml_code: str, timeout: float) -> subprocess.CompletedProcess:
+    """
+    Sends the module to a worker and waits for its result. On timeout the
+    worker and its prover are killed and subprocess.TimeoutExpired is raised.
+    """
+    try:
+        stdout, stderr = proc.communicate(whyml_code, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill(proc)
+        proc.communicate()
+        raise
+    return subprocess.CompletedProcess(proc.args, proc.returncode, stdout, stderr)
+
+
+def run_why3(args: list, whyml_code: str, timeout: float = WHY3_TIMEOUT) -> subprocess.CompletedProcess:
+    """
+    Runs `why3 <args>` on the WhyML code, using a warm worker when one is ready.
+    Raises subprocess.TimeoutExpired / FileNotFoundError like subprocess.run.
+    """
+    with span("why3", "run", args=args) as trace:
+        start = time.perf_counter()
+        with _why3_slots:
+            trace["slot_wait"] = round(time.perf_counter() - start, 6)
+            result = communicate(why3_workers.take(args), whyml_code, timeout)
+        trace["returncode"] = result.returncode
+        return result
+
+
+def strip_whyml_comments(whyml_code: str) -> str:
+    """Removes (possibly nested) (* ... *) comments, keeping string literals and the (*) operator"""
+    out = []
+    depth = 0
+    i = 0
+    n = len(whyml_code)
+    while i < n:
+        if depth == 0 and whyml_code[i] == '"':
+            end = i + 1
+            while end < n and whyml_code[end] != '"':
+                end += 2 if whyml_code[end] == '\\' else 1
+            out.append(whyml_code[i:end + 1])
+            i = end + 1
+        elif whyml_code.startswith("(*)", i) and depth == 0:
+            out.append("(*)")
+            i += 3
+        elif whyml_code.startswith("(*", i):
+            depth += 1
+            i += 2
+        elif depth > 0 and whyml_code.startswith("*)", i):
+            depth -= 1
+            i += 2
+            if depth == 0:
+                out.append(" ")
+        else:
+            if depth == 0:
+                out.append(whyml_code[i])
+            i += 1
+    return "".join(out)
+
+
+def normalize_whyml(whyml_code: str) -> str:
+    """Canonical form of WhyML used for cache keys: no comments, single spaces"""
+    return re.sub(r"\s+", " ", strip_whyml_comments(whyml_code)).strip()
+
+
+def proves_everything(result: subprocess.CompletedProcess) -> bool:
+    """True when why3 exited cleanly and every goal it reported was Valid"""
+    verdicts = VERDICT_PATTERN.findall(result.stdout or "")
+    return result.returncode == 0 and all(verdict == "Valid" for verdict in verdicts)
+
+
+def _kill(proc: subprocess.Popen):
+    """Kills a why3 process together with the prover it spawned"""
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def run_portfolio(whyml_code: str, provers: list, timeout: float = WHY3_TIMEOUT):
+    """
+    Runs `why3 prove -P <prover>` for every prover at once on the same file.
+    Returns (result, prover) for the first prover that proves every goal and
+    kills the others. If none does, returns the result of the earliest prover
+    in the list that finished, with prover set to None.
+    Raises subprocess.TimeoutExpired if every prover timed out.
+    """
+    with span("why3", "portfolio", provers=provers) as trace:
+        result, prover = _run_portfolio(whyml_code, provers, timeout)
+        trace.update(winner=prover, returncode=result.returncode)
+        return result, prover
+
+
+def _run_portfolio(whyml_code: str, provers: list, timeout: float):
+    finished = queue.Queue()
+    processes = {}
+
+    def wait_for(prover, proc):
+        try:
+            finished.put((prover, communicate(proc, whyml_code, timeout)))
+        except subprocess.TimeoutExpired:
+            finished.put((prover, None))
+
+    try:
+        # One slot covers the whole portfolio so concurrent runs cannot deadlock on partial slots
+        with _why3_slots:
+            for prover in provers:
+                proc = why3_workers.take(['prove', '-P', prover])
+                processes[prover] = proc
+                threading.Thread(target=in_context(wait_for), args=(prover, proc), daemon=True).start()
+
+            results = {}
+            for _ in provers:
+                prover, result = finished.get()
+                results[prover] = result
+                if result is not None and proves_everything(result):
+                    for other, proc in processes.items():
+                        if other != prover and proc.poll() is None:
+                            _kill(proc)
+                    return result, prover
+    finally:
+        for proc in processes.values():
+            if proc.poll() is None:
+                _kill(proc)
+
+    for prover in provers:
+        if results.get(prover) is not None:
+            return results[prover], None
+    raise subprocess.TimeoutExpired(['why3', 'prove', *provers], timeout)
+
+
+def goal_name(task_file: str) -> str:
+    """Goal name as encoded by `why3 prove -o` in the task file name"""
+    return os.path.splitext(os.path.basename(task_file))[0]
+
+
+def prove_task(task_file: str, prover: str) -> tuple:
+    """Runs the prover directly on one task file. Returns (verdict, seconds)"""
+    command, valid_pattern = SPLIT_PROVER_COMMANDS[prover]
+    args = [part.format(file=task_file, timelimit=SPLIT_GOAL_TIMELIMIT) for part in command]
+    start = time.perf_counter()
+    try:
+        with span("why3", "prove_task", prover=prover, task=goal_name(task_file)) as trace, _why3_slots:
+            result = subprocess.run(args, capture_output=True, text=True, timeout=SPLIT_GOAL_TIMELIMIT + 5)
+            trace["returncode"] = result.returncode
+    except subprocess.TimeoutExpired:
+        return "Timeout", time.perf_counter() - start
+    except FileNotFoundError:
+        return "Failure", time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+    if re.search(valid_pattern, result.stdout, re.MULTILINE):
+        return "Valid", elapsed
+    if "timeout" in (result.stdout + result.stderr).lower():
+        return "Timeout", elapsed
+    return "Unknown", elapsed
+
+
+def task_key(task_file: str, prover: str) -> str:
+    """
+    Session key of a goal: the task text without source locations, so a goal
+    whose text is unchanged keeps its key when code above it moves.
+    """
+    with open(task_file) as f:
+        text = f.read()
+    text = re.sub(r'File "[^"]*", line \d+, characters \d+-\d+', "", text)
+    text = re.sub(r'#"[^"]*"(?: \d+)+#', "", text)
+    return make_key(prover, SPLIT_GOAL_TIMELIMIT, re.sub(r"\s+", " ", text).strip())
+
+
+def merge_goal_results(args: list, verdicts: dict, prover: str, reused: set = frozenset()) -> subprocess.CompletedProcess:
+    """Merges per-goal verdicts into one result shaped like `why3 prove` output"""
+    stdout = []
+    stderr = []
+    for name, (verdict, elapsed) in sorted(verdicts.items()):
+        line = f"Goal {name}. Prover result is: {verdict} ({elapsed:.2f}s)."
+        if name in reused:
+            line += " [unchanged, result reused]"
+        stdout.append(line)
+        if verdict != "Valid":
+            stderr.append(f"{prover}: {line}")
+    if reused:
+        stdout.append(f"{len(reused)} of {len(verdicts)} goals unchanged since the previous attempt")
+    returncode = 0 if not stderr else 1
+    return subprocess.CompletedProcess(args, returncode, "\n".join(stdout) + "\n", "\n".join(stderr))
+
+
+def missing_split_prover(prover: str):
+    """Why the prover cannot be run directly on task files, or None if it can"""
+    if prover not in SPLIT_PROVER_COMMANDS:
+        return f"Prover {prover} not found: no command for it in SPLIT_PROVER_COMMANDS"
+    command = SPLIT_PROVER_COMMANDS[prover][0][0]
+    if shutil.which(command) is None:
+        return f"Prover {prover} not found: split mode runs `{command}` directly, so it must be on PATH"
+    return None
+
+
+def prove_split(whyml_code: str, prover: str, session: dict = None) -> subprocess.CompletedProcess:
+    """
+    Splits the module into its individual VCs with `why3 prove -a split_vc -o`,
+    proves every goal as a separate prover process in parallel and merges the
+    verdicts. Parse and typing errors are returned unchanged from why3, and the
+    merged return code is 0 only if every goal is Valid. A prover that is not
+    installed gives a failed result saying so (not FileNotFoundError, which
+    means why3 itself is missing).
+
+    If a session dict is given, goals whose task text it holds as proved reuse
+    that verdict instead of being proved again (like `why3 replay`), and newly
+    proved goals are added to it. Goals that timed out or failed are always
+    tried again, as the proof cache does not keep timeouts either.
+    """
+    missing = missing_split_prover(prover)
+    if missing:
+        return subprocess.CompletedProcess(['why3', 'prove', '-P', prover, '-a', 'split_vc'], 1, "", missing)
+
+    work_dir = tempfile.mkdtemp(prefix="why3_split_")
+    try:
+        source = os.path.join(work_dir, "input.mlw")
+        task_dir = os.path.join(work_dir, "tasks")
+        os.makedirs(task_dir)
+        with open(source, "w") as f:
+            f.write(whyml_code)
+
+        args = ['why3', 'prove', '-P', prover, '-a', 'split_vc', '-o', task_dir, source]
+        with span("why3", "split_vc", prover=prover) as trace, _why3_slots:
+            split = subprocess.run(args, capture_output=True, text=True, timeout=WHY3_TIMEOUT)
+            trace["returncode"] = split.returncode
+        if split.returncode != 0:
+            return split
+
+        session = {} if session is None else session
+        tasks = sorted(os.path.join(task_dir, name) for name in os.listdir(task_dir))
+        keys = {task: task_key(task, prover) for task in tasks}
+        proved = {task for task in tasks if session.get(keys[task], [None])[0] == "Valid"}
+        verdicts = {goal_name(task): tuple(session[keys[task]]) for task in proved}
+        reused = set(verdicts)
+
+        pending = [task for task in tasks if task not in proved]
+        with ThreadPoolExecutor(max_workers=max(1, len(pending))) as pool:
+            for task, verdict in zip(pending, pool.map(in_context(lambda task: prove_task(task, prover)), pending)):
+                verdicts[goal_name(task)] = verdict
+                if verdict[0] == "Valid":
+                    session[keys[task]] = list(verdict)
+        return merge_goal_results(args, verdicts, prover, reused)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+@lru_cache(maxsize=None)
+def toolchain_version(prover: str) -> str:
+    """Why3 version plus the matching prover line from `why3 config list-provers`"""
+    try:
+        why3 = subprocess.run(['why3', '--version'], capture_output=True, text=True, timeout=10).stdout.strip()
+        provers = subprocess.run(['why3', 'config', 'list-provers'],
+                                 capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+    name = prover.replace("-", "").lower()
+    matching = [line.strip() for line in provers.splitlines() if name in line.replace("-", "").lower()]
+    return f"{why3} | {'; '.join(matching) or prover}"
+
+
+def recorded_why3(kind: str, key: str, run):
+    """
+    Calls run() -> (result, prover), recording the outcome on the active
+    cassette, or replays the recorded outcome (including timeouts and a
+    missing why3) without running anything. Counts runs and seconds per kind.
+    """
+    start = time.perf_counter()
+    cassette = active_cassette()
+    try:
+        with span("why3", kind) as trace:
+            result, prover = _recorded_why3(kind, key, run, cassette)
+            trace.update(returncode=result.returncode, prover=prover)
+            return result, prover
+    finally:
+        with _usage_lock:
+            _usage[f"{kind}_runs"] += 1
+            _usage[f"{kind}_seconds"] += time.perf_counter() - start
+
+
+def _recorded_why3(kind: str, key: str, run, cassette):
+    if cassette is not None and cassette.replaying:
+        outcome = cassette.play(kind, key)
+        if outcome.get("exception") == "timeout":
+            raise subprocess.TimeoutExpired("why3", WHY3_TIMEOUT)
+        if outcome.get("exception") == "not found":
+            raise FileNotFoundError("why3")
+        return subprocess.CompletedProcess(outcome["args"], outcome["returncode"],
+                                           outcome["stdout"], outcome["stderr"]), outcome["prover"]
+    try:
+        result, prover = run()
+    except subprocess.TimeoutExpired:
+        if cassette is not None:
+            cassette.record(kind, key, {"exception": "timeout"})
+        raise
+    except FileNotFoundError:
+        if cassette is not None:
+            cassette.record(kind, key, {"exception": "not found"})
+        raise
+    if cassette is not None:
+        cassette.record(kind, key, {"args": result.args, "returncode": result.returncode,
+                                    "stdout": result.stdout, "stderr": result.stderr, "prover": prover})
+    return result, prover
+
+
+def type_check_whyml(whyml_code: str) -> subprocess.CompletedProcess:
+    """
+    Parses and type-checks the WhyML code with `why3 prove --type-only`, without
+    generating VCs or starting a prover. Results are cached like proofs.
+    """
+    result, _ = recorded_why3("type_check", make_key(normalize_whyml(whyml_code)),
+                              lambda: (_type_check_whyml(whyml_code), None))
+    return result
+
+
+def _type_check_whyml(whyml_code: str) -> subprocess.CompletedProcess:
+    key = make_key("type-only", normalize_whyml(whyml_code), toolchain_version("why3"))
+    cached = proof_cache.get(key)
+    if cached is not None:
+        return subprocess.CompletedProcess(cached["args"], cached["returncode"],
+                                           cached["stdout"], cached["stderr"])
+
+    result = run_why3(['prove', '--type-only'], whyml_code)
+    proof_cache.put(key, {
+        "args": result.args,
+        "returncode": result.returncode,
+        "stdout": result.stdout,
+        "stderr": result.stderr,
+    })
+    return result
+
+
+def execute_whyml(whyml_code: str, module: str, expression: str,
+                  timeout: float = WHY3_TIMEOUT) -> subprocess.CompletedProcess:
+    """
+    Evaluates the expression with `why3 execute` inside the given module of the
+    WhyML code. Results are cached and recorded like proofs.
+    """
+    result, _ = recorded_why3("execute", make_key(normalize_whyml(whyml_code), module, expression),
+                              lambda: (_execute_whyml(whyml_code, module, expression, timeout), None))
+    return result
+
+
+def _execute_whyml(whyml_code: str, module: str, expression: str, timeout: float) -> subprocess.CompletedProcess:
+    key = make_key("execute", normalize_whyml(whyml_code), module, expression, toolchain_version("why3"))
+    cached = proof_cache.get(key)
+    if cached is not None:
+        return subprocess.CompletedProcess(cached["args"], cached["returncode"],
+                                           cached["stdout"], cached["stderr"])
+
+    # why3 execute reads a file rather than stdin
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.mlw', delete=False) as f:
+        f.write(whyml_code)
+    try:
+        args = ['why3', 'execute', f.name, f'--use={module}', expression]
+        with span("why3", "execute", module=module) as trace, _why3_slots:
+            result = subprocess.run(args, capture_output=True, text=True, timeout=timeout)
+            trace["returncode"] = result.returncode
+    finally:
+        os.remove(f.name)
+
+    proof_cache.put(key, {
+        "args": result.args,
+        "returncode": result.returncode,
+        "stdout": result.stdout,
+        "stderr": result.stderr,
+    })
+    return result
+
+
+def prove_whyml(whyml_code: str, session: dict = None):
+    """
+    Runs `why3 prove` on the WhyML code with the configured prover, races the
+    prover portfolio when one is set, or proves goals in parallel in split mode.
+    Returns (result, prover) where prover is the one whose verdict was used
+    (None if no portfolio prover proved everything).
+    Results of earlier runs on the same normalised code are returned without starting why3.
+    In split mode, session holds per-goal verdicts of earlier attempts (see prove_split).
+    """
+    provers = [WHY3_PROVER] if split_goals else (prover_portfolio or [WHY3_PROVER])
+    limits = (WHY3_TIMEOUT, SPLIT_GOAL_TIMELIMIT) if split_goals else WHY3_TIMEOUT
+    mode = "prove-split" if split_goals else "prove"
+    return recorded_why3("prove", make_key(mode, normalize_whyml(whyml_code), provers, limits),
+                         lambda: _prove_whyml(whyml_code, session, mode, provers, limits))
+
+
+def _prove_whyml(whyml_code: str, session: dict, mode: str, provers: list, limits):
+    key = make_key(mode, normalize_whyml(whyml_code), provers,
+                   [toolchain_version(prover) for prover in provers], limits)
+    cached = proof_cache.get(key)
+    if cached is not None:
+        return subprocess.CompletedProcess(cached["args"], cached["returncode"],
+                                           cached["stdout"], cached["stderr"]), cached["prover"]
+
+    if split_goals:
+        result, prover = prove_split(whyml_code, WHY3_PROVER, session), WHY3_PROVER
+    elif len(provers) > 1:
+        result, prover = run_portfolio(whyml_code, provers)
+    else:
+        result, prover = run_why3(['prove', '-P', provers[0]], whyml_code), provers[0]
+
+    proof_cache.put(key, {
+        "args": result.args,
+        "returncode": result.returncode,
+        "stdout": result.stdout,
+        "stderr": result.stderr,
+        "prover": prover,
+    })
+    return result, prover